@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import httpx
+
+# 20250821のディレクトリから python benchmarks/bench_todos.py で実行する
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import main2
+from main2 import TodoFetcher, create_client
+
+# 1,000件のID(一部重複)を/todosと同じ手順で取得する
+# 上流の代わりにローカルのHTTPサーバー(1リクエストdelay秒)を立て、本物のTCP接続で比べる
+# - 変更前: リクエストごとにクライアントを作り、全IDを同時に投げる
+# - TodoFetcher: 共有クライアント + 同時数の上限 + 相乗り + キャッシュ(1回目と2回目)
+
+
+class Upstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    delay = 0.01
+    lock = threading.Lock()
+    inflight = 0
+    max_inflight = 0
+    calls = 0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        with Upstream.lock:
+            Upstream.connections += 1
+
+    def do_GET(self):
+        with Upstream.lock:
+            Upstream.calls += 1
+            Upstream.inflight += 1
+            Upstream.max_inflight = max(Upstream.max_inflight, Upstream.inflight)
+        time.sleep(self.delay)
+        body = json.dumps({"id": int(self.path.rsplit("/", 1)[1])}).encode()
+        with Upstream.lock:
+            Upstream.inflight -= 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def reset(cls):
+        cls.max_inflight = cls.calls = cls.connections = 0
+
+
+async def per_request_client(ids):
+    async with httpx.AsyncClient() as client:
+        async def fetch(todo_id):
+            return (await client.get(f"{main2.BASE_URL}{todo_id}")).json()
+        # 変更前は1件でも失敗すると500だった。ここでは失敗の件数を数える
+        return await asyncio.gather(*(fetch(todo_id) for todo_id in ids), return_exceptions=True)
+
+
+async def measure(name, run, ids):
+    Upstream.reset()
+    start = time.perf_counter()
+    todos = await run(ids)
+    elapsed = time.perf_counter() - start
+    errors = sum(isinstance(todo, Exception) for todo in todos)
+    print(f"{name:<28}elapsed_ms={elapsed * 1000:.1f}  errors={errors}  upstream_calls={Upstream.calls}  "
+          f"max_concurrent={Upstream.max_inflight}  connections={Upstream.connections}")
+
+
+async def main(args):
+    Upstream.delay = args.delay
+    ThreadingHTTPServer.request_queue_size = 2048
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    main2.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/todos/"
+
+    rng = random.Random(0)
+    ids = [rng.randrange(1, args.distinct + 1) for _ in range(args.ids)]
+    print(f"ids={args.ids} distinct={len(set(ids))} upstream_delay_ms={args.delay * 1000:g}")
+
+    await measure("per-request client", per_request_client, ids)
+    async with create_client() as client:
+        fetcher = TodoFetcher(client)
+        await measure("TodoFetcher (cold)", fetcher.get_many, ids)
+        await measure("TodoFetcher (warm)", fetcher.get_many, ids)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", type=int, default=1000)
+    parser.add_argument("--distinct", type=int, default=500)
+    parser.add_argument("--delay", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
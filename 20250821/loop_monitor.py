@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import anyio.to_thread
+
+# イベントループの遅延とスレッドプールの混み具合を監視する
+# - 遅延: interval秒のsleepが実際に何秒遅れて戻ってきたか
+# - ブロック: ループがthreshold秒以上戻ってこなければ、別スレッドからループのスレッドのスタックをログに出す
+#   (async defの中でtime.sleepなどを呼んでいる箇所がわかる)
+# - スレッドプール: def(同期)のルートを動かすAnyIOのスレッドの使用数と空き待ちの数
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.5"))
+THREADPOOL_LIMIT = int(os.getenv("THREADPOOL_LIMIT", "40"))  # app1/database.pyと同じ既定値
+
+logger = logging.getLogger("loop_monitor")
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.ticks = 0
+        self.blocked = 0
+        self.last_blocked_stack = None
+        self._heartbeat = time.monotonic()
+        self._limiter = None
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    # ループの中(起動時のイベント)で呼ぶ
+    async def start(self, threadpool_limit: int = THREADPOOL_LIMIT):
+        self._limiter = anyio.to_thread.current_default_thread_limiter()
+        self._limiter.total_tokens = threadpool_limit
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _measure(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self._heartbeat = time.monotonic()
+            self.lag_last = lag
+            self.lag_max = max(self.lag_max, lag)
+            self.lag_total += lag
+            self.ticks += 1
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat
+            # 1回のブロックにつき1回だけ出す
+            if stalled < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            self.blocked += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.last_blocked_stack = stack
+            logger.warning("event loop blocked for %.3fs\n%s", stalled, stack)
+
+    def stats(self) -> dict:
+        threadpool = self._limiter.statistics() if self._limiter is not None else None
+        return {
+            "loop_lag_seconds": self.lag_last,
+            "loop_lag_max_seconds": self.lag_max,
+            "loop_lag_avg_seconds": self.lag_total / self.ticks if self.ticks else 0.0,
+            "loop_blocked_total": self.blocked,
+            "threadpool_limit": threadpool.total_tokens if threadpool else None,
+            "threadpool_busy": threadpool.borrowed_tokens if threadpool else None,
+            "threadpool_queued": threadpool.tasks_waiting if threadpool else None,
+        }
+
+
+loop_monitor = LoopMonitor()
@@ -1,14 +1,26 @@
 import asyncio
 from fastapi import FastAPI
 import time
+from loop_monitor import loop_monitor
 
 app = FastAPI()
 
+# イベントループの遅延・ブロックとスレッドプールの使用状況を/metrics/loopで見る
+# スレッドプールの上限は起動時にTHREADPOOL_LIMITで変えられる
+@app.on_event("startup")
+async def start_loop_monitor():
+    await loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    await loop_monitor.stop()
+
 @app.get("/hello")
 async def hello():
     await asyncio.sleep(2)
     return {"message": "Hello, FastAPI!"}
 
+# defのルートはスレッドプールで動く。上限を超えた分はthreadpool_queuedに積まれる
 @app.get("/wait_sync/{seconds}")
 def wait_sync(seconds: int):
     time.sleep(seconds)
@@ -19,4 +31,12 @@ async def wait_async(seconds: int):
     await asyncio.sleep(seconds)
     return {"message": "done"}
 
-    
+# 悪い例: async defの中でtime.sleepを呼ぶとループ全体が止まる(スタックがログに出る)
+@app.get("/block_loop/{seconds}")
+async def block_loop(seconds: float):
+    time.sleep(seconds)
+    return {"message": "done"}
+
+@app.get("/metrics/loop")
+async def loop_metrics():
+    return loop_monitor.stats()
@@ -1,20 +1,112 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
 import asyncio
+import importlib.util
+import os
+import time
 import httpx
 
 app = FastAPI()
 
 BASE_URL = "https://jsonplaceholder.typicode.com/todos/"
 
-async def fetch_todo(client: httpx.AsyncClient, todo_id: int):
-    response = await client.get(f"{BASE_URL}{todo_id}")
-    return response.json()
+# クライアントはアプリの起動時に1つだけ作り、接続(TCP+TLS)を使い回す
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+# h2が入っていればHTTP/2で1本の接続に多重化する
+HTTP2 = importlib.util.find_spec("h2") is not None
+# 1リクエストの中で同時に投げる上限。idsが長くても接続を開きすぎない
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "20"))
+TODO_CACHE_TTL = float(os.getenv("TODO_CACHE_TTL", "5"))
+TODO_CACHE_SIZE = int(os.getenv("TODO_CACHE_SIZE", "10000"))
+
+
+class TodoFetcher:
+    def __init__(self, client: httpx.AsyncClient, ttl: float = TODO_CACHE_TTL, maxsize: int = TODO_CACHE_SIZE):
+        self.client = client
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache = {}     # todo_id → (期限, 値)
+        self._inflight = {}  # todo_id → 取得中のTask
+        self.hits = 0
+        self.coalesced = 0
+        self.fetches = 0
+
+    async def _fetch(self, todo_id: int):
+        self.fetches += 1
+        response = await self.client.get(f"{BASE_URL}{todo_id}")
+        value = response.json()
+        if response.is_success and self.maxsize > 0:
+            self._cache[todo_id] = (time.monotonic() + self.ttl, value)
+            while len(self._cache) > self.maxsize:
+                del self._cache[next(iter(self._cache))]  # 古いものから捨てる
+        return value
+
+    # キャッシュ → 取得中のものに相乗り → 取得、の順に見る
+    async def get(self, todo_id: int):
+        entry = self._cache.get(todo_id)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            del self._cache[todo_id]
+        task = self._inflight.get(todo_id)
+        if task is None:
+            task = self._inflight[todo_id] = asyncio.ensure_future(self._fetch(todo_id))
+            task.add_done_callback(lambda _: self._inflight.pop(todo_id, None))
+        else:
+            self.coalesced += 1
+        # 待っている側がキャンセルされても、相乗りしている他の待ち手のために取得は続ける
+        return await asyncio.shield(task)
+
+    async def get_many(self, todo_ids: list, concurrency: int = FETCH_CONCURRENCY):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(todo_id):
+            async with semaphore:
+                return await self.get(todo_id)
+
+        return await asyncio.gather(*(bounded(todo_id) for todo_id in todo_ids))
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "fetches": self.fetches,
+        }
+
+
+# テストではstartupの前にapp.state.http_transportへhttpx.MockTransportなどを入れておく
+def create_client(transport: httpx.AsyncBaseTransport = None) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        transport=transport,
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT),
+    )
+
+@app.on_event("startup")
+async def open_http_client():
+    app.state.http_client = create_client(getattr(app.state, "http_transport", None))
+    app.state.todo_fetcher = TodoFetcher(app.state.http_client)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await app.state.http_client.aclose()
 
 @app.get("/todos")
-async def get_todos(ids: str = Query(..., description="カンマ区切りのIDリスト")):
+async def get_todos(request: Request, ids: str = Query(..., description="カンマ区切りのIDリスト")):
     id_list = [int(i) for i in ids.split(",")]
-
-    async with httpx.AsyncClient() as client:
-        tasks = [fetch_todo(client, i) for i in id_list]
-        results = await asyncio.gather(*tasks)
+    results = await request.app.state.todo_fetcher.get_many(id_list)
     return {"todos": results}
+
+@app.get("/metrics/todos")
+async def todo_metrics(request: Request):
+    return request.app.state.todo_fetcher.stats()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 20250821のモジュールはディレクトリ直下にあり、フラットにimportする(from loop_monitor import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+import anyio
+import anyio.to_thread
+import pytest
+from loop_monitor import LoopMonitor
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def monitor():
+    monitors = []
+
+    async def start(interval=0.01, threshold=10.0, **kwargs):
+        m = LoopMonitor(interval, threshold)
+        await m.start(**kwargs)
+        monitors.append(m)
+        return m
+
+    yield start
+    for m in monitors:
+        await m.stop()
+
+
+async def _wait_until(condition, timeout=5):
+    with anyio.fail_after(timeout):
+        while not condition():
+            await anyio.sleep(0.005)
+
+
+# ループを止めると、sleepが戻るのが遅れた分だけ遅延として数える
+async def test_measures_loop_lag(monitor):
+    m = await monitor()
+    await _wait_until(lambda: m.ticks >= 2)
+    assert m.stats()["loop_lag_max_seconds"] < 0.1
+
+    time.sleep(0.2)
+    await _wait_until(lambda: m.lag_max >= 0.1)
+
+    stats = m.stats()
+    assert 0.1 <= stats["loop_lag_max_seconds"] < 1
+    assert stats["loop_lag_avg_seconds"] > 0
+    assert stats["loop_blocked_total"] == 0
+
+
+def _block_loop(seconds):
+    time.sleep(seconds)
+
+
+# 長いブロックでも1回につき1件だけ。スタックにはブロックしている関数が出る
+async def test_reports_each_stall_once(monitor, caplog):
+    m = await monitor(threshold=0.05)
+    await _wait_until(lambda: m.ticks >= 1)
+
+    with caplog.at_level(logging.WARNING, logger="loop_monitor"):
+        _block_loop(0.3)
+        await _wait_until(lambda: m.ticks >= 3)
+        assert m.blocked == 1
+        _block_loop(0.3)
+        await _wait_until(lambda: m.ticks >= 5)
+
+    assert m.stats()["loop_blocked_total"] == 2
+    assert "_block_loop" in m.last_blocked_stack
+    assert [record.getMessage().startswith("event loop blocked") for record in caplog.records] == [True, True]
+
+
+async def test_threadpool_busy_and_queued(monitor):
+    m = await monitor(threadpool_limit=2)
+    release = threading.Event()
+
+    async with anyio.create_task_group() as tg:
+        for _ in range(3):
+            tg.start_soon(anyio.to_thread.run_sync, release.wait)
+        await _wait_until(lambda: m.stats()["threadpool_queued"] == 1)
+        stats = m.stats()
+        assert (stats["threadpool_limit"], stats["threadpool_busy"]) == (2, 2)
+        release.set()
+
+    assert m.stats()["threadpool_busy"] == 0
+
+
+# 既定の上限はapp1/database.pyのTHREADPOOL_LIMITと同じ40で、起動時に必ず設定する
+async def test_default_threadpool_limit(monitor):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 7
+    m = await monitor()
+
+    assert m.stats()["threadpool_limit"] == 40
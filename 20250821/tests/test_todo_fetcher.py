@@ -0,0 +1,118 @@
+import asyncio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from main2 import TodoFetcher, app, create_client
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# 上流のAPIの代わり。同時に処理中のリクエスト数の最大と、IDごとの呼び出し回数を記録する
+class FakeTodos:
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.inflight = 0
+        self.max_inflight = 0
+        self.calls = {}
+        self.release = None
+
+    async def __call__(self, request: httpx.Request):
+        todo_id = int(request.url.path.rsplit("/", 1)[1])
+        self.calls[todo_id] = self.calls.get(todo_id, 0) + 1
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            if self.release is not None:
+                await self.release.wait()
+            await asyncio.sleep(self.delay)
+        finally:
+            self.inflight -= 1
+        return httpx.Response(200, json={"id": todo_id, "title": f"todo {todo_id}"})
+
+
+@pytest.fixture
+async def upstream():
+    fake = FakeTodos()
+    async with create_client(httpx.MockTransport(fake)) as client:
+        fake.client = client
+        yield fake
+
+
+async def test_get_many_caps_concurrency(upstream):
+    fetcher = TodoFetcher(upstream.client)
+
+    todos = await fetcher.get_many(list(range(1, 101)), concurrency=5)
+
+    assert [todo["id"] for todo in todos] == list(range(1, 101))
+    assert upstream.max_inflight <= 5
+    assert fetcher.fetches == 100
+
+
+# 同じIDは取得中のものに相乗りし、終わった後はキャッシュから返す
+async def test_identical_ids_are_fetched_once(upstream):
+    fetcher = TodoFetcher(upstream.client)
+
+    todos = await fetcher.get_many([1] * 50 + [2] * 50)
+
+    assert len(todos) == 100
+    assert upstream.calls == {1: 1, 2: 1}
+    stats = fetcher.stats()
+    assert stats["fetches"] == 2
+    assert stats["coalesced"] + stats["hits"] == 98
+
+
+async def test_cache_entries_expire_after_ttl(upstream):
+    fetcher = TodoFetcher(upstream.client, ttl=0.05)
+
+    await fetcher.get(1)
+    await fetcher.get(1)
+    assert upstream.calls[1] == 1
+
+    await asyncio.sleep(0.06)
+    await fetcher.get(1)
+    assert upstream.calls[1] == 2
+
+
+async def test_cache_is_bounded(upstream):
+    fetcher = TodoFetcher(upstream.client, maxsize=10)
+
+    await fetcher.get_many(list(range(1, 31)))
+
+    assert fetcher.stats()["cached"] == 10
+
+
+# 待っている側がキャンセルされても、相乗りしている他の待ち手には結果が届く
+async def test_cancelled_waiter_does_not_abort_shared_fetch(upstream):
+    upstream.release = asyncio.Event()
+    fetcher = TodoFetcher(upstream.client)
+    first = asyncio.create_task(fetcher.get(7))
+    second = asyncio.create_task(fetcher.get(7))
+    await asyncio.sleep(0.01)
+
+    first.cancel()
+    upstream.release.set()
+
+    assert (await second)["id"] == 7
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert upstream.calls == {7: 1}
+    assert fetcher.stats()["coalesced"] == 1
+
+
+# 起動時にapp.state.http_transportのトランスポートでクライアントを作る
+def test_todos_endpoint_uses_injected_transport(monkeypatch):
+    fake = FakeTodos(delay=0)
+    monkeypatch.setattr(app.state, "http_transport", httpx.MockTransport(fake), raising=False)
+
+    with TestClient(app) as client:
+        response = client.get("/todos", params={"ids": "3,4,3"})
+        metrics = client.get("/metrics/todos").json()
+
+    assert [todo["id"] for todo in response.json()["todos"]] == [3, 4, 3]
+    assert fake.calls == {3: 1, 4: 1}
+    assert metrics["fetches"] == 2
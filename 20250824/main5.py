@@ -1,3 +1,7 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Annotated, Set
 import jwt
@@ -81,12 +85,59 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
-        expire = datetime.mkfir now(timezone.utc) + timedelta(minutes=15)
+        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# 検証済みトークンのキャッシュ。キーはトークンのSHA-256、値は(ユーザ, 有効期限)
+# 同じトークンが何度も来るのでjwt.decodeとUserInDBの組み立てを省く
+# app2/token_cache.pyのTokenCacheと同じ動き。TOKEN_CACHE_SIZE=0で無効になる
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+token_cache = OrderedDict()
+token_cache_stats = {"hits": 0, "misses": 0}
+
+def get_cached_user(token: str):
+    if TOKEN_CACHE_SIZE <= 0:
+        return None
+    key = hashlib.sha256(token.encode()).digest()
+    entry = token_cache.get(key)
+    if entry is None or entry[1] <= time.time():
+        token_cache.pop(key, None)
+        token_cache_stats["misses"] += 1
+        return None
+    token_cache.move_to_end(key)
+    token_cache_stats["hits"] += 1
+    return entry[0]
+
+def cache_user(token: str, user: UserInDB, exp: float | None):
+    if TOKEN_CACHE_SIZE <= 0:
+        return
+    # トークンのexpを超えてキャッシュしない
+    expires_at = time.time() + TOKEN_CACHE_TTL
+    if exp is not None:
+        expires_at = min(expires_at, exp)
+    token_cache[hashlib.sha256(token.encode()).digest()] = (user, expires_at)
+    while len(token_cache) > TOKEN_CACHE_SIZE:
+        token_cache.popitem(last=False)
+
+# ユーザを無効化したらそのユーザのキャッシュを消す
+def invalidate_user_tokens(username: str):
+    for key, (user, _) in list(token_cache.items()):
+        if user.username == username:
+            del token_cache[key]
+
+# キャッシュ済みのトークンでも無効化したユーザは通さない
+def disable_user(username: str):
+    if username in fake_users_db:
+        fake_users_db[username]["disabled"] = True
+    invalidate_user_tokens(username)
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    cached_user = get_cached_user(token)
+    if cached_user is not None:
+        return cached_user
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -103,6 +154,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     user = get_user(fake_users_db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    cache_user(token, user, payload.get("exp"))
     return user
 
 async def get_current_active_user(current_user: Annotated[User, Depends(get_current_user)]):
@@ -136,3 +188,7 @@ async def read_own_items(
     current_user: Annotated[User, Depends(get_current_active_user)]
 ):
     return [{"item_id": "Foo", "owner": current_user.username}] 
+
+@app.get("/metrics/token-cache")
+async def token_cache_metrics():
+    return {"size": len(token_cache), "maxsize": TOKEN_CACHE_SIZE, **token_cache_stats}
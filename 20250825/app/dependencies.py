@@ -1,8 +1,10 @@
 from fastapi import Header, HTTPException
 from typing_extensions import Annotated
 
+ADMIN_TOKEN = "fake-super-secret-token"
+
 async def get_token_header(x_token: Annotated[str, Header()]):
-    if x_token != "fake-super-secret-token":
+    if x_token != ADMIN_TOKEN:
         raise HTTPException(status_code=400, detail="X-Token header invalid")
 async def get_query_token(token: str):
     if token != "jessica":
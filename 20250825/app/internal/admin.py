@@ -1,8 +1,43 @@
-from fastapi import APIRouter
+import asyncio
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from ..profiler import PROFILER_ENABLED, PROFILER_INTERVAL_MS, PROFILER_MAX_SECONDS, profiler
 
 router = APIRouter()
 
 
 @router.post("/")
 async def update_admin():
-    return {"message": "Admin getting schwifty"}
\ No newline at end of file
+    return {"message": "Admin getting schwifty"}
+
+
+def _require_profiler():
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+
+
+# seconds秒だけプロセス全体をサンプリングし、collapsed stack形式で返す
+# 待っている間もイベントループは止めないので、その間に来たリクエストの処理が記録される
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(seconds: float = 5, interval_ms: float = PROFILER_INTERVAL_MS):
+    _require_profiler()
+    if not 0 < seconds <= PROFILER_MAX_SECONDS or interval_ms < 1:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILER_MAX_SECONDS}] and interval_ms >= 1")
+    sampler = profiler.try_start(interval_ms)
+    if sampler is None:
+        raise HTTPException(status_code=409, detail="Profiler is busy")
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        collapsed = profiler.finish(sampler)
+    return collapsed
+
+
+# X-Profile: 1 を付けたリクエストのプロファイル。IDはそのレスポンスのX-Profile-Idヘッダー
+@router.get("/profile/requests/{profile_id}", response_class=PlainTextResponse)
+async def request_profile(profile_id: str):
+    _require_profiler()
+    collapsed = profiler.get(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return collapsed
@@ -1,10 +1,17 @@
-from fastapi import Depends, FastAPI
-from .dependencies import get_query_token, get_token_header
+from fastapi import Depends, FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from .dependencies import ADMIN_TOKEN, get_query_token, get_token_header
 from .internal import admin
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, request_metrics
+from .profiler import PROFILER_ENABLED, RequestProfilerMiddleware
 # from app.routers import items, usersでもよい
 from .routers import items, users
 
 app = FastAPI(dependencies=[Depends(get_query_token)])
+app.add_middleware(MetricsMiddleware)
+# 無効のときはミドルウェア自体を入れない
+if PROFILER_ENABLED:
+    app.add_middleware(RequestProfilerMiddleware, token=ADMIN_TOKEN)
 
 app.include_router(users.router)
 app.include_router(items.router)
@@ -20,3 +27,22 @@ app.include_router(
 @app.get("/")
 async def root():
     return {"message": "Hello Bigger Applications!"}
+
+
+@app.on_event("startup")
+async def start_request_metrics():
+    await request_metrics.start()
+
+@app.on_event("shutdown")
+async def stop_request_metrics():
+    await request_metrics.stop()
+
+
+# Prometheus形式のメトリクス。スクレイパーがtokenを持たなくてよいよう、
+# アプリ全体の依存関係(get_query_token)がかからないStarletteのルートとして登録する
+async def prometheus_metrics(request: Request):
+    snapshot = request_metrics.snapshot()
+    body = await run_in_threadpool(request_metrics.render, snapshot)
+    return Response(body, media_type=METRICS_CONTENT_TYPE)
+
+app.add_route("/metrics", prometheus_metrics, include_in_schema=False)
@@ -0,0 +1,131 @@
+import os
+import secrets
+import sys
+import threading
+from collections import OrderedDict
+
+# 稼働中のワーカー用のサンプリングプロファイラ
+# 別スレッドから一定間隔でsys._current_frames()を読み、スタックごとの出現回数を数える
+# 結果はcollapsed stack形式("root;caller;callee 回数")で、flamegraph.plやspeedscopeでそのまま読める
+# PROFILER_ENABLED=1のときだけ有効。無効ならミドルウェアも入れず、サンプリング用のスレッドも作らない
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+PROFILER_MAX_CONCURRENT = int(os.getenv("PROFILER_MAX_CONCURRENT", "2"))
+PROFILER_KEEP = int(os.getenv("PROFILER_KEEP", "20"))  # 保持するリクエスト単位のプロファイルの数
+
+# プロファイラ自身のスレッドはサンプルに含めない
+_sampler_threads = set()
+
+
+class Sampler:
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.counts = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return self.collapsed()
+
+    def _run(self):
+        _sampler_threads.add(threading.get_ident())
+        try:
+            while not self._stop.wait(self.interval):
+                self._sample()
+        finally:
+            _sampler_threads.discard(threading.get_ident())
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in _sampler_threads:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items()))
+
+
+class Profiler:
+    def __init__(self):
+        self._slots = threading.BoundedSemaphore(PROFILER_MAX_CONCURRENT)
+        self._lock = threading.Lock()
+        self._profiles = OrderedDict()
+
+    # 同時に動かすサンプラーの数を制限する。空きが無ければNone
+    def try_start(self, interval_ms: float = PROFILER_INTERVAL_MS):
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            return Sampler(interval_ms).start()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def finish(self, sampler: Sampler) -> str:
+        try:
+            return sampler.stop()
+        finally:
+            self._slots.release()
+
+    def save(self, profile_id: str, profile: str):
+        with self._lock:
+            self._profiles[profile_id] = profile
+            while len(self._profiles) > PROFILER_KEEP:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+
+profiler = Profiler()
+
+
+# X-Profile: 1 と管理者用のX-Tokenが付いたリクエストの処理中だけサンプリングする
+# プロファイルはIDを付けて保持し、IDはX-Profile-Idヘッダーで返す(/admin/profile/requests/{id}で取り出す)
+# サンプルはプロセス全体なので、同時に処理している他のリクエストも含まれる
+class RequestProfilerMiddleware:
+    def __init__(self, app, token: str):
+        self.app = app
+        self.token = token.encode()
+
+    def _wants_profile(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        return headers.get(b"x-profile") == b"1" and secrets.compare_digest(headers.get(b"x-token", b""), self.token)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        sampler = profiler.try_start()
+        if sampler is None:
+            await self.app(scope, receive, send)
+            return
+        profile_id = secrets.token_hex(8)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.save(profile_id, profiler.finish(sampler))
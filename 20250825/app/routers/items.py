@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException
+import secrets
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 # 一つ上の階層のdependenciesをインポートなので..をつける。
 from ..dependencies import get_token_header
 
@@ -11,12 +12,38 @@ router = APIRouter(
 
 fake_items_db = {"plumbus": {"name": "Plumbus"}, "gun": {"name": "Portal Gun"}}
 
+# ETagは本文のハッシュではなくリソースごとのバージョン番号から作る
+# 更新したらバージョンを上げる。起動ごとのnonceで再起動前のETagとは一致しないようにする
+ETAG_NONCE = secrets.token_hex(4)
+item_versions = {}
 
-@router.get("/")
+def bump_version(*resources: str):
+    for resource in resources:
+        item_versions[resource] = item_versions.get(resource, 0) + 1
+
+# existsはリソースが存在するか。"*"は存在するときだけ一致し、無ければハンドラまで進めて404にする
+def check_etag(request: Request, response: Response, resource: str, exists: bool = True):
+    etag = f'"{ETAG_NONCE}-{resource}-{item_versions.get(resource, 0)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if (if_none_match.strip() == "*" and exists) or etag in tags:
+        # 304ならハンドラは実行されず本文も作らない
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+def items_etag(request: Request, response: Response):
+    check_etag(request, response, "items")
+
+def item_etag(item_id: str, request: Request, response: Response):
+    check_etag(request, response, f"item:{item_id}", exists=item_id in fake_items_db)
+
+
+@router.get("/", dependencies=[Depends(items_etag)])
 async def read_items():
     return fake_items_db
 
-@router.get("/{item_id}")
+@router.get("/{item_id}", dependencies=[Depends(item_etag)])
 async def read_item(item_id: str):
     if item_id not in fake_items_db:
         raise HTTPException(status_code=404, detail="Item not Found")
@@ -30,4 +57,5 @@ async def read_item(item_id: str):
 async def update_item(item_id: str):
     if item_id != "plumbus":
         raise HTTPException(status_code=403, detail="You can only update the item plumbus")
+    bump_version("items", f"item:{item_id}")
     return {"item_id": item_id, "name": "The great Plumbus"}
\ No newline at end of file
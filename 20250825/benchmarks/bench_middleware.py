@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+import anyio
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+# 20250825のディレクトリから python benchmarks/bench_middleware.py で実行する
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import main1
+from main1 import AccessLogMiddleware, ProcessTimeMiddleware
+
+# GET / の1リクエストあたりの時間を、ミドルウェアの組み方ごとに比べる
+# - none: ミドルウェア無し(CORSのみ)
+# - before: 変更前のmain1.py。BaseHTTPMiddlewareでヘッダーをprint + @app.middleware("http")
+# - after: 今のmain1.py。ASGIのミドルウェア + キュー経由のアクセスログ
+# ログの出力先はどちらも/dev/null(端末に書くとprintはさらに遅い)
+
+ORIGINS = ["http://localhost"]
+HEADERS = {"Authorization": "Bearer secret", "Accept": "application/json", "User-Agent": "bench"}
+
+
+def _app():
+    app = FastAPI()
+
+    @app.get("/")
+    async def root():
+        return {"message": "Hello World"}
+
+    return app
+
+
+def _cors(app):
+    app.add_middleware(CORSMiddleware, allow_origins=ORIGINS, allow_credentials=True,
+                       allow_methods=["*"], allow_headers=["*"])
+
+
+def none_app():
+    app = _app()
+    _cors(app)
+    return app
+
+
+def before_app():
+    app = _app()
+
+    class LoggingMiddleware(BaseHTTPMiddleware):
+        async def dispatch(self, request: Request, call_next):
+            print(f"Request: {request.method}, {request.url}")
+            for name, value in request.headers.items():
+                print(f"{name}: {value}")
+            response = await call_next(request)
+            print(f"Response status: {response.status_code}")
+            return response
+
+    app.add_middleware(LoggingMiddleware)
+    _cors(app)
+
+    @app.middleware("http")
+    async def add_process_time_header(request: Request, call_next):
+        start_time = time.time()
+        response = await call_next(request)
+        response.headers["X-Process-Time"] = str(time.time() - start_time)
+        return response
+
+    return app
+
+
+def after_app(sample_rate):
+    app = _app()
+    app.add_middleware(AccessLogMiddleware, sample_rate=sample_rate)
+    _cors(app)
+    app.add_middleware(ProcessTimeMiddleware)
+    return app
+
+
+async def measure(app, requests: int):
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=HEADERS) as client:
+        for _ in range(100):
+            await client.get("/")
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = await client.get("/")
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return cuts[49] * 1e6, cuts[98] * 1e6
+
+
+async def main(args):
+    devnull = open(os.devnull, "w")
+    main1._log_handler.setStream(devnull)
+    main1.log_listener.start()
+    scenarios = [
+        ("none", none_app()),
+        ("before (BaseHTTPMiddleware)", before_app()),
+        ("after sample=1.0", after_app(1.0)),
+        ("after sample=0.01", after_app(0.01)),
+    ]
+    print(f"requests={args.requests}")
+    baseline = None
+    with contextlib.redirect_stdout(devnull):
+        results = [(name, await measure(app, args.requests)) for name, app in scenarios]
+    main1.log_listener.stop()
+    for name, (p50, p99) in results:
+        baseline = p50 if baseline is None else baseline
+        print(f"{name:<30}p50_us={p50:.1f} p99_us={p99:.1f} overhead_p50_us={p50 - baseline:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    anyio.run(main, parser.parse_args())
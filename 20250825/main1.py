@@ -1,21 +1,132 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
 import time
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
 
 
 app = FastAPI()
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        print(f"Request: {request.method}, {request.url}")
-        for name, value in request.headers.items():
-            print(f"{name}: {value}")
-        response = await call_next(request)
-        print(f"Response status: {response.status_code}")
-        return response
+# BaseHTTPMiddlewareはリクエストごとにタスクとストリームを挟むうえ、ストリーミングのレスポンスと相性が悪い
+# ここではASGIのアプリを直接包むミドルウェアにして、send()に流れるメッセージだけを覗く
 
-app.add_middleware(LoggingMiddleware)
+# アクセスログ
+# ハンドラはキューに積むだけで、整形と出力はQueueListenerのスレッドで行う(イベントループを止めない)
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1.0"))  # 5xxは常に記録する
+REDACTED_HEADERS = {"authorization", "proxy-authorization", "cookie", "set-cookie", "x-api-key", "x-token"}
+
+access_logger = logging.getLogger("access")
+access_logger.setLevel(logging.INFO)
+access_logger.propagate = False
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # 標準のprepare()は呼び出し側で文字列に整形してしまうので、レコードをそのまま渡す
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False)
+
+
+_log_queue = queue.SimpleQueue()
+access_logger.addHandler(DeferredQueueHandler(_log_queue))
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(JsonFormatter())
+log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+
+
+def redact_headers(raw_headers) -> dict:
+    headers = {}
+    for name, value in raw_headers:
+        name = name.decode("latin-1")
+        headers[name] = "[REDACTED]" if name in REDACTED_HEADERS else value.decode("latin-1")
+    return headers
+
+
+class AccessLogMiddleware:
+    def __init__(self, app, sample_rate: float = ACCESS_LOG_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter_ns()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        failed = False
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            # ヘッダーを送った後の例外はステータスが2xxのままなので、5xxと同じく必ず記録する
+            failed = True
+            raise
+        finally:
+            if failed or status >= 500 or random.random() < self.sample_rate:
+                client = scope.get("client")
+                access_logger.info({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope["query_string"].decode("latin-1"),
+                    "status": status,
+                    "bytes": size,
+                    "duration_ms": (time.perf_counter_ns() - start) / 1e6,
+                    "client": client[0] if client else None,
+                    "headers": redact_headers(scope["headers"]),
+                })
+
+
+# レスポンスヘッダーを送る時点までの処理時間をServer-TimingとX-Process-Time(秒)で返す
+class ProcessTimeMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter_ns()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter_ns() - start
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", f"app;dur={elapsed / 1e6:.3f}")
+                headers["X-Process-Time"] = f"{elapsed / 1e9:.6f}"
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+@app.on_event("startup")
+def start_log_listener():
+    log_listener.start()
+
+@app.on_event("shutdown")
+def stop_log_listener():
+    # キューに残っているログを書き出してから止まる
+    log_listener.stop()
+
+
+app.add_middleware(AccessLogMiddleware)
 origins = [
     "http://localhost.tiangolo.com",
     "https://localhost.tiangolo.com",
@@ -31,14 +142,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+app.add_middleware(ProcessTimeMiddleware)
 
 @app.get("/")
 async def main():
@@ -1,5 +1,9 @@
+import base64
+import json
+import os
 from typing import Annotated
-from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Response
+from sqlalchemy import event
 from sqlmodel import Field, Session, SQLModel, create_engine, select
 from pydantic import BaseModel
 
@@ -25,7 +29,24 @@ sqlite_url = f"sqlite:///{sqlite_file_name}"
 
 # check_same_thread=FalseはUvicornのスレッド間アクセスを許可する。
 connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+# プールの大きさ・待ち時間・接続の張り直し間隔は環境変数で調整する
+engine = create_engine(
+    sqlite_url,
+    connect_args=connect_args,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+)
+
+# 接続ごとにWALモードとbusy_timeoutを設定。書き込みが重なっても"database is locked"ですぐ失敗しない
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+    cursor.close()
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
@@ -44,6 +65,16 @@ app = FastAPI()
 def on_startup():
     create_db_and_tables()
 
+@app.get("/metrics/db-pool")
+def db_pool_metrics():
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+
 @app.post("/heroes/", response_model=HeroRead)
 def create_hero(hero: HeroCreate, session: SessionDep) -> HeroRead:
     db_hero = HeroTable.model_validate(hero)
@@ -52,13 +83,44 @@ def create_hero(hero: HeroCreate, session: SessionDep) -> HeroRead:
     session.refresh(db_hero)
     return db_hero
 
+def encode_cursor(hero_id: int) -> str:
+    raw = json.dumps([hero_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        (hero_id,) = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(hero_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return hero_id
+
+# cursorを渡すとキーセット方式(id > 前ページ最後のid)。主キーのシークなので深いページでも速い。
+# 次ページのカーソルはX-Next-Cursorヘッダで返す。offsetは互換性のため残している。
 @app.get("/heroes/")
 def read_heroes(
     session: SessionDep,
+    response: Response,
     offset: int = 0, 
     limit: Annotated[int, Query(le=100)] = 100,
+    cursor: str | None = None,
     ) -> list[HeroRead]:
-    heroes = session.exec(select(HeroTable).offset(offset).limit(limit)).all()
+    if cursor is None:
+        heroes = session.exec(select(HeroTable).offset(offset).limit(limit)).all()
+        return heroes
+
+    last_id = decode_cursor(cursor) if cursor else 0
+    statement = (
+        select(HeroTable)
+        .where(HeroTable.id > last_id)
+        .order_by(HeroTable.id)
+        .limit(limit + 1)
+    )
+    heroes = session.exec(statement).all()
+    if len(heroes) > limit:
+        heroes = heroes[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(heroes[-1].id)
     return heroes
 
 @app.get("/heroes/{hero_id}")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 20250825のモジュールはディレクトリ直下から読み込む(import main1 / from app.profiler import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
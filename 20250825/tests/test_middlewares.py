@@ -0,0 +1,144 @@
+import logging
+import re
+import pytest
+from fastapi.testclient import TestClient
+import main1
+from main1 import AccessLogMiddleware, ProcessTimeMiddleware, access_logger, redact_headers
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# アクセスログのレコード(dict)を集める。キューのハンドラとは別に付けるので出力は変わらない
+@pytest.fixture
+def access_logs():
+    records = []
+    handler = logging.Handler()
+    handler.emit = lambda record: records.append(record.msg)
+    access_logger.addHandler(handler)
+    yield records
+    access_logger.removeHandler(handler)
+
+
+def _scope(path="/", headers=()):
+    return {"type": "http", "method": "GET", "path": path, "query_string": b"a=1",
+            "headers": list(headers), "client": ("127.0.0.1", 5000)}
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+def _app(status=200, chunks=(b"ok",), headers=(), error=None):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+        if error is not None:
+            raise error
+    return app
+
+
+async def _call(app, scope=None):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope or _scope(), _receive, send)
+    return messages
+
+
+def test_redact_headers():
+    headers = redact_headers([(b"authorization", b"Bearer abc"), (b"cookie", b"s=1"),
+                              (b"x-token", b"t"), (b"accept", b"*/*")])
+    assert headers == {"authorization": "[REDACTED]", "cookie": "[REDACTED]",
+                       "x-token": "[REDACTED]", "accept": "*/*"}
+
+
+@pytest.mark.anyio
+async def test_access_log_record(access_logs):
+    await _call(AccessLogMiddleware(_app(chunks=(b"ab", b"cde")), sample_rate=1.0),
+                _scope("/items", [(b"authorization", b"Bearer secret")]))
+
+    [record] = access_logs
+    assert record["path"] == "/items"
+    assert record["query"] == "a=1"
+    assert record["status"] == 200
+    assert record["bytes"] == 5
+    assert record["client"] == "127.0.0.1"
+    assert record["headers"] == {"authorization": "[REDACTED]"}
+    assert record["duration_ms"] >= 0
+
+
+# サンプリングで間引いても5xxと例外は必ず記録する(ヘッダーの送信後の例外も)
+@pytest.mark.anyio
+async def test_sampling_always_logs_server_errors(access_logs):
+    await _call(AccessLogMiddleware(_app(status=200), sample_rate=0.0))
+    await _call(AccessLogMiddleware(_app(status=503), sample_rate=0.0))
+    with pytest.raises(RuntimeError):
+        await _call(AccessLogMiddleware(_app(chunks=(), error=RuntimeError("boom")), sample_rate=0.0))
+
+    assert [record["status"] for record in access_logs] == [503, 200]
+
+
+@pytest.mark.anyio
+async def test_exception_before_response_is_logged_as_500(access_logs):
+    async def failing(scope, receive, send):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await _call(AccessLogMiddleware(failing, sample_rate=0.0))
+
+    assert [record["status"] for record in access_logs] == [500]
+
+
+# ストリーミングのレスポンスはまとめずに、届いたチャンクをそのまま順に流す
+@pytest.mark.anyio
+async def test_streaming_passthrough(access_logs):
+    sent = []
+
+    async def streaming(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in (b"1", b"2", b"3"):
+            sent.append(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            # 次のチャンクを作る前に、外側へもう届いている
+            assert received == sent
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    received = []
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message["body"]:
+            received.append(message["body"])
+
+    await ProcessTimeMiddleware(AccessLogMiddleware(streaming, sample_rate=1.0))(_scope(), _receive, send)
+
+    assert received == [b"1", b"2", b"3"]
+    assert access_logs[0]["bytes"] == 3
+
+
+@pytest.mark.anyio
+async def test_process_time_headers_keep_existing_server_timing():
+    messages = await _call(ProcessTimeMiddleware(_app(headers=[(b"server-timing", b"db;dur=1")])))
+
+    headers = [(name.decode(), value.decode()) for name, value in messages[0]["headers"]]
+    timings = [value for name, value in headers if name == "server-timing"]
+    assert timings[0] == "db;dur=1"
+    assert re.fullmatch(r"app;dur=\d+\.\d{3}", timings[1])
+    assert float(dict(headers)["x-process-time"]) >= 0
+
+
+def test_main1_app(access_logs):
+    with TestClient(main1.app) as client:
+        response = client.get("/", headers={"Authorization": "Bearer secret",
+                                            "Origin": "http://localhost"})
+
+    assert response.json() == {"message": "Hello World"}
+    assert re.fullmatch(r"app;dur=\d+\.\d{3}", response.headers["server-timing"])
+    assert float(response.headers["x-process-time"]) < 1
+    assert response.headers["access-control-allow-origin"] == "http://localhost"
+    assert access_logs[-1]["headers"]["authorization"] == "[REDACTED]"
@@ -0,0 +1,133 @@
+import re
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app import profiler as profiler_module
+from app.dependencies import ADMIN_TOKEN
+from app.internal import admin
+from app.main import app
+from app.profiler import RequestProfilerMiddleware, Sampler, profiler
+
+ADMIN = {"X-Token": ADMIN_TOKEN}
+COLLAPSED_LINE = re.compile(r"\S.* \d+")
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(admin, "PROFILER_ENABLED", True)
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+# X-Profile用のミドルウェアはPROFILER_ENABLED=1のときしか入らないので、テストでは外から包む
+@pytest.fixture
+def profiled_client(enabled):
+    with TestClient(RequestProfilerMiddleware(app, token=ADMIN_TOKEN)) as c:
+        yield c
+
+
+def test_disabled_returns_404(client):
+    assert client.get("/admin/profile?token=jessica&seconds=0.01", headers=ADMIN).status_code == 404
+    assert client.get("/admin/profile/requests/abc?token=jessica", headers=ADMIN).status_code == 404
+
+
+# 有効でもアプリ全体の?token=jessicaと、/adminのX-Tokenが要る
+@pytest.mark.parametrize("path, headers, status", [
+    ("/admin/profile?seconds=0.01", ADMIN, 422),
+    ("/admin/profile?seconds=0.01&token=rick", ADMIN, 400),
+    ("/admin/profile?seconds=0.01&token=jessica", {}, 422),
+    ("/admin/profile?seconds=0.01&token=jessica", {"X-Token": "wrong"}, 400),
+    ])
+def test_requires_tokens(client, enabled, path, headers, status):
+    assert client.get(path, headers=headers).status_code == status
+
+
+def test_profile_returns_collapsed_stacks(client, enabled):
+    response = client.get("/admin/profile?token=jessica&seconds=0.1&interval_ms=5", headers=ADMIN)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert lines
+    assert all(COLLAPSED_LINE.fullmatch(line) for line in lines)
+
+
+@pytest.mark.parametrize("query", ["seconds=0", "seconds=61", "seconds=1&interval_ms=0.5"])
+def test_profile_rejects_bad_parameters(client, enabled, query):
+    assert client.get(f"/admin/profile?token=jessica&{query}", headers=ADMIN).status_code == 400
+
+
+# 同時に動かせるサンプラーの数を使い切っていれば409
+def test_profile_busy(client, enabled):
+    samplers = [profiler.try_start() for _ in range(profiler_module.PROFILER_MAX_CONCURRENT)]
+    try:
+        assert profiler.try_start() is None
+        assert client.get("/admin/profile?token=jessica&seconds=0.01", headers=ADMIN).status_code == 409
+    finally:
+        for sampler in samplers:
+            profiler.finish(sampler)
+
+    assert client.get("/admin/profile?token=jessica&seconds=0.01", headers=ADMIN).status_code == 200
+
+
+def test_request_profile_by_id(profiled_client):
+    response = profiled_client.get("/users/me?token=jessica", headers={**ADMIN, "X-Profile": "1"})
+
+    assert response.json() == {"username": "fakecurrentuser"}
+    profile_id = response.headers["x-profile-id"]
+    profile = profiled_client.get(f"/admin/profile/requests/{profile_id}?token=jessica", headers=ADMIN)
+    assert profile.status_code == 200
+    assert all(COLLAPSED_LINE.fullmatch(line) for line in profile.text.splitlines())
+    assert profiled_client.get("/admin/profile/requests/unknown?token=jessica", headers=ADMIN).status_code == 404
+
+
+# X-Profileだけ、またはX-Tokenが違えばプロファイルしない。空きが無いときもそのまま処理する
+def test_request_profile_needs_token_and_slot(profiled_client):
+    assert "x-profile-id" not in profiled_client.get("/?token=jessica", headers={"X-Profile": "1"}).headers
+    assert "x-profile-id" not in profiled_client.get(
+        "/?token=jessica", headers={"X-Profile": "1", "X-Token": "wrong"}).headers
+
+    samplers = [profiler.try_start() for _ in range(profiler_module.PROFILER_MAX_CONCURRENT)]
+    try:
+        response = profiled_client.get("/?token=jessica", headers={**ADMIN, "X-Profile": "1"})
+    finally:
+        for sampler in samplers:
+            profiler.finish(sampler)
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+
+
+def test_keeps_latest_profiles(monkeypatch):
+    monkeypatch.setattr(profiler_module, "PROFILER_KEEP", 2)
+    store = profiler_module.Profiler()
+    for profile_id in ("a", "b", "c"):
+        store.save(profile_id, profile_id)
+
+    assert [store.get(profile_id) for profile_id in ("a", "b", "c")] == [None, "b", "c"]
+
+
+# 他のスレッドのスタックは記録し、サンプラー自身のスレッドは含めない
+def test_sampler_records_other_threads():
+    stop = threading.Event()
+
+    def busy_loop_for_profiler():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_loop_for_profiler, name="busy-worker")
+    worker.start()
+    sampler = Sampler(interval_ms=1).start()
+    time.sleep(0.1)
+    collapsed = sampler.stop()
+    stop.set()
+    worker.join()
+
+    assert sampler.samples > 0
+    assert any(line.startswith("busy-worker;") and "busy_loop_for_profiler" in line
+               for line in collapsed.splitlines())
+    assert "profiler-sampler" not in collapsed
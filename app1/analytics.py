@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# 売上の集計。注文明細を列ごとのNumPy配列で持ち、np.unique/bincountでまとめて集計する
+# - 取り込み済みの最大注文IDを覚えておき、それより新しい明細だけを追加で読み込む
+# - 集計結果は(開始日, 終了日, 上位件数)ごとにキャッシュし、新しい明細の日付を含む期間だけ捨てる
+# - ステータス変更(キャンセル)は差分で反映できないので全件を読み直す
+ANALYTICS_REFRESH_INTERVAL = float(os.getenv("ANALYTICS_REFRESH_INTERVAL", "5"))
+# 並行にコミットされた注文の取りこぼしを拾うため、この間隔で全件を読み直す
+ANALYTICS_REBUILD_INTERVAL = float(os.getenv("ANALYTICS_REBUILD_INTERVAL", "300"))
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "256"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "100000"))
+
+
+# 追記用の列。容量を倍々で増やすので追加のたびに全体をコピーしない
+class _Columns:
+    DTYPES = {
+        "order_id": np.int64,
+        "day": "datetime64[D]",
+        "category": np.int32,
+        "product_id": np.int64,
+        "quantity": np.int64,
+        "revenue": np.float64,
+    }
+
+    def __init__(self):
+        self.size = 0
+        self._data = {name: np.empty(0, dtype) for name, dtype in self.DTYPES.items()}
+
+    def append(self, **columns):
+        size = self.size + len(columns["order_id"])
+        capacity = len(self._data["order_id"])
+        if size > capacity:
+            capacity = max(size, capacity * 2)
+            for name, values in self._data.items():
+                grown = np.empty(capacity, values.dtype)
+                grown[:self.size] = values[:self.size]
+                self._data[name] = grown
+        for name, values in columns.items():
+            self._data[name][self.size:size] = values
+        self.size = size
+
+    def __getitem__(self, name):
+        return self._data[name][:self.size]
+
+
+class SalesAnalytics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._dirty = True
+        self._refreshed_at = 0.0
+        self.refreshes = 0
+        self.rebuilds = 0
+        self.hits = 0
+        self.misses = 0
+        self._clear()
+
+    def _clear(self):
+        self._columns = _Columns()
+        self._category_codes = {}
+        self._category_names = []
+        self._last_order_id = 0
+        self._built_at = None
+        self._results.clear()
+
+    # 注文が増えたら呼ぶ。次の集計で新しい明細を読み込む
+    def mark_dirty(self):
+        self._dirty = True
+
+    # 取り込み済みの明細が変わったら(キャンセルなど)呼ぶ。次の集計で全件を読み直す
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _category_code(self, category: str) -> int:
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._category_names)
+            self._category_names.append(category)
+        return code
+
+    def _ingest(self, batch: list):
+        order_ids, days, product_ids, categories, quantities, prices = zip(*batch)
+        # カテゴリ名はバッチ内でユニークにしてから全体の番号に置き換える
+        names, inverse = np.unique(np.asarray(categories, dtype=str), return_inverse=True)
+        codes = np.array([self._category_code(name) for name in names.tolist()], dtype=np.int32)
+        quantities = np.asarray(quantities, dtype=np.int64)
+        order_ids = np.asarray(order_ids, dtype=np.int64)
+        days = np.asarray(days, dtype="datetime64[D]")
+        self._columns.append(
+                order_id=order_ids,
+                day=days,
+                category=codes[inverse],
+                product_id=np.asarray(product_ids, dtype=np.int64),
+                quantity=quantities,
+                revenue=quantities * np.asarray(prices, dtype=np.float64),
+                )
+        self._last_order_id = max(self._last_order_id, int(order_ids.max()))
+        return days.min()
+
+    def _refresh(self, repo):
+        now = time.monotonic()
+        if self._built_at is None or now - self._built_at >= ANALYTICS_REBUILD_INTERVAL:
+            self._clear()
+            self._built_at = now
+            self.rebuilds += 1
+        elif not self._dirty and now - self._refreshed_at < ANALYTICS_REFRESH_INTERVAL:
+            return
+        self._dirty = False
+        self._refreshed_at = now
+        self.refreshes += 1
+
+        first_day = None
+        for batch in repo.iter_sales_lines(self._last_order_id, ANALYTICS_BATCH_SIZE):
+            day = self._ingest(batch)
+            first_day = day if first_day is None else min(first_day, day)
+        if first_day is not None:
+            # 新しい明細の日付を含む期間の結果だけ捨てる。過去の期間はそのまま使える
+            for key in [key for key in self._results if key[1] is None or np.datetime64(key[1], "D") >= first_day]:
+                del self._results[key]
+
+    def _aggregate(self, start, end, top_n: int) -> dict:
+        columns = self._columns
+        days = columns["day"]
+        mask = np.ones(len(days), dtype=bool)
+        if start is not None:
+            mask &= days >= np.datetime64(start, "D")
+        if end is not None:
+            mask &= days <= np.datetime64(end, "D")
+        days = days[mask]
+        revenue = columns["revenue"][mask]
+        quantity = columns["quantity"][mask]
+
+        # (日, カテゴリ)を1つの整数キーにしてまとめる
+        category_count = max(len(self._category_names), 1)
+        keys = days.astype(np.int64) * category_count + columns["category"][mask]
+        groups, inverse = np.unique(keys, return_inverse=True)
+        group_revenue = np.bincount(inverse, weights=revenue, minlength=len(groups))
+        by_category_day = [{
+            "day": str(np.datetime64(key // category_count, "D")),
+            "category": self._category_names[key % category_count] or None,
+            "revenue": value,
+            } for key, value in zip(groups.tolist(), group_revenue.tolist())]
+
+        product_ids, inverse = np.unique(columns["product_id"][mask], return_inverse=True)
+        product_revenue = np.bincount(inverse, weights=revenue, minlength=len(product_ids))
+        product_quantity = np.bincount(inverse, weights=quantity, minlength=len(product_ids))
+        top = np.argsort(-product_revenue, kind="stable")[:top_n]
+        top_products = [{
+            "product_id": product_id,
+            "quantity": int(sold),
+            "revenue": value,
+            } for product_id, sold, value in zip(
+                product_ids[top].tolist(), product_quantity[top].tolist(), product_revenue[top].tolist())]
+
+        return {
+            "start": start,
+            "end": end,
+            "lines": len(days),
+            "total_revenue": float(revenue.sum()),
+            "revenue_by_category_day": by_category_day,
+            "top_products": top_products,
+        }
+
+    def report(self, repo, start=None, end=None, top_n: int = 10) -> dict:
+        key = (start, end, top_n)
+        with self._lock:
+            self._refresh(repo)
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+            result = self._aggregate(start, end, top_n)
+            self._results[key] = result
+            while len(self._results) > ANALYTICS_CACHE_SIZE:
+                self._results.popitem(last=False)
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "lines": self._columns.size,
+            "last_order_id": self._last_order_id,
+            "categories": len(self._category_names),
+            "cached_results": len(self._results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "rebuilds": self.rebuilds,
+        }
+
+
+sales_analytics = SalesAnalytics()
@@ -0,0 +1,59 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app import crud, db_models, models
+from app.password_hasher import password_hasher
+
+# crud.pyの非同期版。get_async_dbのAsyncSessionと一緒に使う
+# AsyncSessionでは遅延ロードができないので、関連はselectinloadで先に読み込む
+# 在庫の引き当てなど手順のある処理はcrudの関数をrun_syncでそのまま動かす
+# (同じSQLを同じ順で実行し、待ちはイベントループに返すのでスレッドを使わない)
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(db_models.User, user_id)
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.scalars(select(db_models.User).where(db_models.User.email == email))
+    return result.first()
+
+async def create_user(db: AsyncSession, user: models.UserCreate, hashed_password: str = None):
+    if hashed_password is None:
+        hashed_password = await password_hasher.hash(user.password)
+    return await db.run_sync(crud.create_user, user, hashed_password)
+
+async def get_product(db: AsyncSession, product_id: int):
+    return await db.get(db_models.Product, product_id)
+
+async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100, category: str = None):
+    query = select(db_models.Product)
+    if category:
+        query = query.where(db_models.Product.category == category)
+    result = await db.scalars(query.offset(skip).limit(limit))
+    return result.all()
+
+async def get_products_page(db: AsyncSession, limit: int = 100, category: str = None, cursor: str = None):
+    return await db.run_sync(crud.get_products_page, limit, category, cursor)
+
+async def create_product(db: AsyncSession, product: models.ProductCreate):
+    return await db.run_sync(crud.create_product, product)
+
+async def bulk_create_products(db: AsyncSession, products: list, chunk_size: int = 1000):
+    return await db.run_sync(crud.bulk_create_products, products, chunk_size)
+
+# crud.place_orderと同じ。DBの価格で計算し、在庫は条件付きUPDATEで引き当てる
+async def place_order(db: AsyncSession, order: models.OrderCreate):
+    return await db.run_sync(crud.place_order, order)
+
+async def bulk_create_orders(db: AsyncSession, orders: list, chunk_size: int = 1000):
+    return await db.run_sync(crud.bulk_create_orders, orders, chunk_size)
+
+async def update_order_status(db: AsyncSession, order_id: int, status: str):
+    return await db.run_sync(crud.update_order_status, order_id, status)
+
+async def get_order(db: AsyncSession, order_id: int):
+    result = await db.scalars(
+            select(db_models.Order)
+            .where(db_models.Order.id == order_id)
+            .options(selectinload(db_models.Order.order_items))
+            )
+    return result.first()
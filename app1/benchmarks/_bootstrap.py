@@ -0,0 +1,30 @@
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+# ベンチマークはapp1のディレクトリから python benchmarks/bench_xxx.py で実行する
+# tests/conftest.pyと同じく、app1をパッケージ名appとして読み込む
+APP_DIR = Path(__file__).resolve().parents[1]
+
+# DATABASE_URLを指定しなければ一時ファイルのSQLiteを使う(計測のたびに空のDB)
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir.name}/bench.db")
+
+if "app" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+            "app", APP_DIR / "__init__.py", submodule_search_locations=[str(APP_DIR)])
+    sys.modules["app"] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules["app"])
+
+
+# 秒のリストからp50/p95/p99(ミリ秒)
+def percentiles(samples: list) -> dict:
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {f"p{p}_ms": round(cuts[p - 1] * 1000, 3) for p in (50, 95, 99)}
+
+
+def report(name: str, **values):
+    print(f"{name:<32}" + "  ".join(f"{key}={value}" for key, value in values.items()))
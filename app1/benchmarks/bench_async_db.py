@@ -0,0 +1,100 @@
+import os
+# SQLiteは書き込みが1本ずつなので、500件同時の注文ではロック待ちが既定の5秒を超えることがある
+os.environ.setdefault("SQLITE_BUSY_TIMEOUT_MS", "60000")
+import _bootstrap
+import argparse
+import random
+import time
+import anyio
+import anyio.to_thread
+import httpx
+from fastapi import Depends, FastAPI
+from app import async_crud, crud, models
+from app.database import SessionLocal, THREADPOOL_LIMIT, dispose_async_engine, get_async_db
+from app.repositories import create_tables
+
+# 同じ処理を同期(def + スレッドプール + Session)と非同期(async def + AsyncSession)で比べる
+# 同時接続数(既定500)がスレッド数(THREADPOOL_LIMIT)を超えると、同期側はスレッド待ちの列ができる
+# 本番と同じDBで測るときはDATABASE_URL=postgresql://...を指定する(非同期側はasyncpgを使う)
+
+sync_app = FastAPI()
+async_app = FastAPI()
+
+
+@sync_app.get("/products/{product_id}")
+def sync_get_product(product_id: int):
+    with SessionLocal() as db:
+        return {"id": crud.get_product(db, product_id).id}
+
+
+@sync_app.post("/orders")
+def sync_create_order(order: models.OrderCreate):
+    with SessionLocal() as db:
+        return {"id": crud.place_order(db, order)["id"]}
+
+
+@async_app.get("/products/{product_id}")
+async def async_get_product(product_id: int, db=Depends(get_async_db)):
+    return {"id": (await async_crud.get_product(db, product_id)).id}
+
+
+@async_app.post("/orders")
+async def async_create_order(order: models.OrderCreate, db=Depends(get_async_db)):
+    return {"id": (await async_crud.place_order(db, order))["id"]}
+
+
+def seed(products: int):
+    create_tables()
+    with SessionLocal() as db:
+        user = crud.create_user(db, models.UserCreate(
+            email=f"bench{time.time_ns()}@example.com", username="bench", password="password"), "x")
+        user_id = user.id
+        ids = [crud.create_product(db, models.ProductCreate(
+            name=f"bench{n}", price=10.0, category="bench", stock_quantity=10**9)).id for n in range(products + 1)]
+    # OrderCreateはproduct_id=1を受け付けない
+    return user_id, [i for i in ids if i != 1]
+
+
+async def run(app, requests: list, concurrency: int):
+    latencies = []
+    limiter = anyio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(method, url, body):
+            async with limiter:
+                start = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            for request in requests:
+                tg.start_soon(one, *request)
+        elapsed = time.perf_counter() - start
+    return len(requests) / elapsed, latencies
+
+
+async def main(args):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_LIMIT
+    user_id, product_ids = seed(args.products)
+    rng = random.Random(0)
+    mixes = {
+        "read": [("GET", f"/products/{rng.choice(product_ids)}", None) for _ in range(args.requests)],
+        "order": [("POST", "/orders", {"user_id": user_id, "items": [
+            {"product_id": rng.choice(product_ids), "quantity": 1}]}) for _ in range(args.requests)],
+    }
+    print(f"concurrency={args.concurrency} threadpool_limit={THREADPOOL_LIMIT} requests={args.requests}")
+    for mix, requests in mixes.items():
+        for name, app in (("sync", sync_app), ("async", async_app)):
+            throughput, latencies = await run(app, requests, args.concurrency)
+            _bootstrap.report(f"{mix}/{name}", rps=round(throughput), **_bootstrap.percentiles(latencies))
+    await dispose_async_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=100)
+    anyio.run(main, parser.parse_args())
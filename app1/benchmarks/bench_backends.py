@@ -0,0 +1,76 @@
+import _bootstrap
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+from app.main import app
+from app.repositories import InMemoryRepository, get_repository, sql_repository
+
+# 同じリクエストの組み合わせをdictのストアとSQLAlchemyの両方に流し、スループットとレイテンシを比べる
+# 組み合わせ: 商品の取得60% / 注文20% / ユーザーの注文一覧10% / 検索10%
+
+
+def seed(client, products: int):
+    n = time.time_ns()
+    users = [client.post("/users", json={
+        "email": f"bench{n}-{i}@example.com", "username": f"bench{n}-{i}", "password": "password",
+        }).json()["id"] for i in range(10)]
+    rows = [{"name": f"bench{n}-{i}", "description": f"benchmark product {i}", "price": 1 + i % 50,
+             "category": f"c{i % 10}", "stock_quantity": 10**9} for i in range(products + 1)]
+    client.post("/products/bulk", json=rows)
+    # OrderCreateはproduct_id=1を受け付けない
+    product_ids = [p["id"] for p in client.get("/products").json()["products"] if p["id"] != 1]
+    return users, product_ids
+
+
+def request_mix(users: list, product_ids: list, count: int):
+    rng = random.Random(0)
+    requests = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.6:
+            requests.append(("GET", f"/products/{rng.choice(product_ids)}", None))
+        elif roll < 0.8:
+            requests.append(("POST", "/orders", {"user_id": rng.choice(users), "items": [
+                {"product_id": rng.choice(product_ids), "quantity": 1}]}))
+        elif roll < 0.9:
+            requests.append(("GET", f"/users/{rng.choice(users)}/orders?limit=20", None))
+        else:
+            requests.append(("GET", f"/search?q=product+{rng.randrange(1000)}", None))
+    return requests
+
+
+def run(client, requests: list, concurrency: int):
+    def one(request):
+        method, url, body = request
+        start = time.perf_counter()
+        response = client.request(method, url, json=body)
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(one, requests))
+    return len(requests) / (time.perf_counter() - start), latencies
+
+
+def main(args):
+    backends = {"memory": InMemoryRepository(), "sqlalchemy": sql_repository}
+    print(f"requests={args.requests} concurrency={args.concurrency} products={args.products}")
+    with TestClient(app) as client:
+        for name, repo in backends.items():
+            app.dependency_overrides[get_repository] = (lambda r: lambda: r)(repo)
+            users, product_ids = seed(client, args.products)
+            throughput, latencies = run(client, request_mix(users, product_ids, args.requests), args.concurrency)
+            _bootstrap.report(name, rps=round(throughput), **_bootstrap.percentiles(latencies))
+        app.dependency_overrides.pop(get_repository, None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--products", type=int, default=1000)
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+import _bootstrap
+import argparse
+import time
+from typing import List
+from fastapi import Depends
+from fastapi.testclient import TestClient
+from app import main, models, responses
+from app.main import app, product_list_etag
+from app.models import Product
+from app.repositories import InMemoryRepository, get_repository
+
+# 1,000件の一覧を返すエンドポイントの1リクエストあたりの時間
+# - FastJSONResponse: 今の/productsと/items。dictをorjsonで1回でバイト列にする
+# - 変更前: dictをそのまま返す(jsonable_encoderで1件ずつ辿ってから標準のjson)
+# - response_model=List[Product]: pydanticで検証してからJSONにする
+# - FastJSONResponse(標準json): orjsonが無い環境のフォールバック
+# DBの読み込みを除くため、1,000件を入れたインメモリのリポジトリを使う
+
+
+def seed(count: int):
+    repo = InMemoryRepository()
+    repo.bulk_create_products([models.ProductCreate(
+        name=f"item{n}", description=f"description of item {n}", price=1 + n % 100 + 0.99,
+        category=f"c{n % 20}", stock_quantity=n % 50,
+        ) for n in range(count)], chunk_size=count)
+    return repo
+
+
+# 比べるためのルート。どちらも/productsと同じETagの依存関係を通す
+@app.get("/bench/products-encoder", dependencies=[Depends(product_list_etag)])
+def products_encoder(repo: main.RepositoryDep):
+    return {"products": repo.list_products()}
+
+
+@app.get("/bench/products-model", response_model=List[Product], dependencies=[Depends(product_list_etag)])
+def products_model(repo: main.RepositoryDep):
+    return repo.list_products()
+
+
+def measure(client, path, requests):
+    latencies = []
+    size = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+        size = len(response.content)
+    return latencies, size
+
+
+def main_(args):
+    repo = seed(args.items)
+    app.dependency_overrides[get_repository] = (lambda r: lambda: r)(repo)
+    print(f"items={args.items} requests={args.requests}")
+    scenarios = [
+        ("/products FastJSONResponse", "/products", True),
+        ("/products jsonable_encoder", "/bench/products-encoder", True),
+        ("/products response_model", "/bench/products-model", True),
+        ("/products FastJSON (stdlib)", "/products", False),
+        ("/items FastJSONResponse", f"/items?limit={args.items}", True),
+    ]
+    orjson = responses.orjson
+    with TestClient(app) as client:
+        for name, path, use_orjson in scenarios:
+            responses.orjson = orjson if use_orjson else None
+            measure(client, path, 20)
+            latencies, size = measure(client, path, args.requests)
+            _bootstrap.report(name, bytes=size, **_bootstrap.percentiles(latencies))
+    responses.orjson = orjson
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=300)
+    main_(parser.parse_args())
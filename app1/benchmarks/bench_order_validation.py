@@ -0,0 +1,81 @@
+import _bootstrap
+import argparse
+import json
+import time
+import warnings
+from typing import List, Optional
+from pydantic import BaseModel, ValidationError
+from app.models import OrderCreate
+
+# 1,000明細のOrderCreateの検証を、変更前のv1形式(@validatorでPythonのループ)と今のモデルで比べる
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    from pydantic import validator
+
+    # 変更前のapp1/models.pyのまま
+    class OrderItemV1(BaseModel):
+        product_id: int
+        quantity: int
+        price: float
+
+        @validator('quantity')
+        def validate_quantity(cls, v):
+            if v <= 0:
+                raise ValueError('数量は正の値である必要があります。')
+            return v
+
+    class OrderCreateV1(BaseModel):
+        user_id: int
+        items: List[OrderItemV1]
+        description: Optional[str] = None
+
+        @validator('items')
+        def validate_items(cls, v):
+            if not v:
+                raise ValueError('注文には少なくとも1つの商品が必要です。')
+            for item in v:
+                if item.product_id == 1:
+                    raise ValueError('No!')
+            return v
+
+
+def payload(items: int, bad_quantity: bool = False) -> dict:
+    lines = [{"product_id": 2 + n % 500, "quantity": 1 + n % 5, "price": 9.99} for n in range(items)]
+    if bad_quantity:
+        lines[-1]["quantity"] = 0
+    return {"user_id": 1, "items": lines, "description": "bench"}
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            fn()
+        except ValidationError:
+            pass
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main(args):
+    valid = payload(args.items)
+    invalid = payload(args.items, bad_quantity=True)
+    raw = json.dumps(valid).encode()
+    print(f"items={args.items} repeat={args.repeat}")
+    for name, model in (("before (v1 validators)", OrderCreateV1), ("after (v2 constraints)", OrderCreate)):
+        assert len(model.model_validate(valid).items) == args.items
+        for case, fn in (
+                ("dict", lambda: model.model_validate(valid)),
+                ("json", lambda: model.model_validate_json(raw)),
+                ("invalid", lambda: model.model_validate(invalid)),
+                ):
+            _bootstrap.report(f"{name} {case}", **_bootstrap.percentiles(timed(fn, args.repeat)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=500)
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+import _bootstrap
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from app import crud, models
+from app.cache import ReadThroughCache
+from app.database import SessionLocal
+from app.repositories import create_tables, sql_repository
+
+# 商品の取得をZipf分布(一部の人気商品にアクセスが集中する)のIDで流し、
+# キャッシュ無し(毎回DB)とReadThroughCacheを比べる
+
+
+def seed(count: int) -> int:
+    create_tables()
+    with SessionLocal() as db:
+        crud.bulk_create_products(db, [models.ProductCreate(
+            name=f"zipf{n}", price=1 + n % 100, category=f"c{n % 20}", stock_quantity=100,
+            ) for n in range(count)], chunk_size=10000)
+    return count
+
+
+def run(get, ids, threads: int):
+    def one(product_id):
+        start = time.perf_counter()
+        get(int(product_id))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = list(pool.map(one, ids, chunksize=256))
+    return len(ids) / (time.perf_counter() - start), latencies
+
+
+def main(args):
+    products = seed(args.products)
+    ids = np.random.default_rng(0).zipf(args.zipf, args.requests)
+    ids = ids[ids <= products]
+    print(f"products={products} requests={len(ids)} zipf_s={args.zipf} cache_size={args.cache_size} "
+          f"distinct={len(np.unique(ids))}")
+
+    throughput, latencies = run(sql_repository.get_product, ids, args.threads)
+    _bootstrap.report("no cache", rps=round(throughput), **_bootstrap.percentiles(latencies))
+
+    cache = ReadThroughCache("bench", args.cache_size, ttl=60)
+    throughput, latencies = run(
+            lambda product_id: cache.get_or_load(product_id, lambda: sql_repository.get_product(product_id)),
+            ids, args.threads)
+    stats = cache.stats()
+    hit_rate = stats["hits"] / (stats["hits"] + stats["misses"])
+    _bootstrap.report("ReadThroughCache", rps=round(throughput), hit_rate=round(hit_rate, 3),
+                      loads=stats["loads"], coalesced=stats["coalesced"], **_bootstrap.percentiles(latencies))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--threads", type=int, default=16)
+    main(parser.parse_args())
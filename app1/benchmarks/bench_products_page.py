@@ -0,0 +1,66 @@
+import _bootstrap
+import argparse
+import random
+import time
+from sqlalchemy import insert
+from app import crud, db_models
+from app.database import SessionLocal
+from app.pagination import encode_cursor
+from app.repositories import create_tables
+
+# 商品一覧の深いページを、OFFSETとキーセット(crud.get_products_page)で比べる
+# 並び順はどちらもカテゴリ(NULLが先頭)→id。OFFSETは読み飛ばす行の数だけ遅くなる
+
+
+def seed(count: int):
+    create_tables()
+    rng = random.Random(0)
+    rows = [{"name": f"p{n}", "price": 1 + n % 100, "stock_quantity": 0,
+             # 5%はカテゴリ無し(NULL)
+             "category": None if rng.random() < 0.05 else f"c{rng.randrange(50):02d}"}
+            for n in range(count)]
+    with SessionLocal() as db:
+        for i in range(0, count, 50000):
+            db.execute(insert(db_models.Product), rows[i:i + 50000])
+        db.commit()
+
+
+def offset_page(db, skip, limit):
+    Product = db_models.Product
+    return (db.query(Product).order_by(Product.category.asc().nulls_first(), Product.id)
+            .offset(skip).limit(limit).all())
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - start)
+    return result, latencies
+
+
+def main(args):
+    seed(args.products)
+    print(f"products={args.products} limit={args.limit}")
+    with SessionLocal() as db:
+        for depth in (0, 1000, 10000, 50000, args.products // 2, args.products - args.limit):
+            offset_rows, offset_latencies = timed(lambda: offset_page(db, depth, args.limit), args.repeat)
+            # 直前のページの最後の行からカーソルを作る(クライアントがnext_cursorを渡すのと同じ)
+            cursor = None
+            if depth:
+                last = offset_page(db, depth - 1, 1)[0]
+                cursor = encode_cursor(last.category, last.id)
+            (keyset_rows, _), keyset_latencies = timed(
+                    lambda: crud.get_products_page(db, args.limit, cursor=cursor), args.repeat)
+            assert [p.id for p in keyset_rows] == [p.id for p in offset_rows]
+            _bootstrap.report(f"depth={depth} OFFSET", **_bootstrap.percentiles(offset_latencies))
+            _bootstrap.report(f"depth={depth} keyset", **_bootstrap.percentiles(keyset_latencies))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
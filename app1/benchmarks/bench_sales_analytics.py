@@ -0,0 +1,116 @@
+import _bootstrap
+import argparse
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from app import crud, db_models
+from app.analytics import SalesAnalytics
+from app.database import SessionLocal
+from app.repositories import create_tables, sql_repository
+
+# /analytics/sales(NumPyの列で集計)を、ORMのオブジェクトを1件ずつ足す実装と比べる
+# SalesAnalyticsは新しいインスタンスを使うので、間隔の設定に関係なく初回は全件を読み込む
+
+START = datetime(2025, 1, 1)
+
+
+def seed(lines: int, lines_per_order: int = 3, first_order_id: int = 1):
+    rng = random.Random(first_order_id)
+    orders = []
+    items = []
+    for n in range(lines // lines_per_order):
+        order_id = first_order_id + n
+        orders.append({"id": order_id, "user_id": 1, "total_amount": 0, "status": "pending",
+                       "created_at": START + timedelta(days=rng.randrange(90), seconds=rng.randrange(86400))})
+        for _ in range(lines_per_order):
+            items.append({"order_id": order_id, "product_id": rng.randint(1, 1000),
+                          "quantity": rng.randint(1, 5), "price": rng.choice((1.5, 9.99, 20.0, 120.0))})
+    with SessionLocal() as db:
+        db.execute(insert(db_models.Order), orders)
+        for i in range(0, len(items), 100000):
+            db.execute(insert(db_models.OrderItem), items[i:i + 100000])
+        db.commit()
+    return first_order_id + len(orders)
+
+
+# 明細をORMのオブジェクトで読み、Pythonのdictで集計する
+def orm_report(start=None, end=None, top_n=10):
+    by_category_day = defaultdict(float)
+    by_product = defaultdict(lambda: [0, 0.0])
+    with SessionLocal() as db:
+        query = (
+                db.query(db_models.OrderItem)
+                .join(db_models.OrderItem.order)
+                .options(joinedload(db_models.OrderItem.order), joinedload(db_models.OrderItem.product))
+                .filter(db_models.Order.status != crud.CANCELLED)
+                )
+        for item in query:
+            day = item.order.created_at.date()
+            if (start and day < start) or (end and day > end):
+                continue
+            revenue = item.quantity * item.price
+            by_category_day[(day.isoformat(), item.product.category)] += revenue
+            by_product[item.product_id][0] += item.quantity
+            by_product[item.product_id][1] += revenue
+    top = sorted(by_product.items(), key=lambda entry: -entry[1][1])[:top_n]
+    return {
+        "total_revenue": sum(by_category_day.values()),
+        "revenue_by_category_day": by_category_day,
+        "top_products": top,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(args):
+    create_tables()
+    with SessionLocal() as db:
+        db.execute(insert(db_models.User), [{"id": 1, "email": "bench@example.com", "username": "bench",
+                                             "hashed_password": "x"}])
+        db.execute(insert(db_models.Product), [{"id": i, "name": f"p{i}", "price": 1, "category": f"c{i % 20}"}
+                                               for i in range(1, 1001)])
+        db.commit()
+    next_order_id = seed(args.lines)
+    print(f"lines={args.lines} products=1000 categories=20 days=90")
+
+    orm, seconds = timed(orm_report)
+    _bootstrap.report("ORM per request", ms=round(seconds * 1000, 1))
+
+    sales = SalesAnalytics()
+    result, seconds = timed(sales.report, sql_repository)
+    _bootstrap.report("NumPy cold (load + aggregate)", ms=round(seconds * 1000, 1))
+    assert abs(result["total_revenue"] - orm["total_revenue"]) < 1e-6 * orm["total_revenue"]
+
+    latencies = [timed(sales.report, sql_repository)[1] for _ in range(args.requests)]
+    _bootstrap.report("NumPy cached", **_bootstrap.percentiles(latencies))
+
+    # 期間ごとに結果のキャッシュは分かれる。読み込み済みの列から集計だけやり直す
+    latencies = []
+    for day in range(args.requests):
+        start = (START + timedelta(days=day % 90)).date()
+        latencies.append(timed(sales.report, sql_repository, start, start + timedelta(days=6), 1 + day // 90)[1])
+    _bootstrap.report("NumPy new range (aggregate)", **_bootstrap.percentiles(latencies))
+
+    # 新しい注文の明細だけを追加で読み込む
+    latencies = []
+    for _ in range(20):
+        next_order_id = seed(args.new_lines, first_order_id=next_order_id)
+        sales.mark_dirty()
+        latencies.append(timed(sales.report, sql_repository)[1])
+    _bootstrap.report(f"NumPy +{args.new_lines} lines (incremental)", **_bootstrap.percentiles(latencies))
+    print(sales.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=300000)
+    parser.add_argument("--new-lines", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+import _bootstrap
+import argparse
+import random
+import time
+from sqlalchemy import or_
+from app import crud, db_models, models
+from app.database import SessionLocal
+from app.repositories import create_tables
+from app.search import tokenize
+
+# /searchの商品検索をFTS5(crud.search_products)と、それ以前のLIKE '%語%'で比べる
+# LIKEは先頭がワイルドカードなのでインデックスが使えず、毎回全件を走査する
+
+# 5,000語の語彙。1語あたり300件ほどの商品に出てくる
+_letters = random.Random(2)
+WORDS = sorted({"".join(_letters.choices("abcdefghijklmnopqrstuvwxyz", k=7)) for _ in range(5000)})
+
+
+def like_search(db, q, limit=10, offset=0):
+    Product = db_models.Product
+    query = db.query(Product)
+    for token in tokenize(q):
+        query = query.filter(or_(Product.name.ilike(f"%{token}%"), Product.description.ilike(f"%{token}%")))
+    return query.count(), query.order_by(Product.id).offset(offset).limit(limit).all()
+
+
+def fts_search(db, q, limit=10, offset=0):
+    return crud.search_products(db, q, limit=limit, offset=offset)
+
+
+def seed(count: int):
+    create_tables()
+    rng = random.Random(0)
+    products = [models.ProductCreate(
+        name=" ".join(rng.sample(WORDS, 3)) + f" {n}",
+        description=" ".join(rng.choices(WORDS, k=12)),
+        price=1 + n % 100,
+        category=f"c{n % 20}",
+        ) for n in range(count)]
+    with SessionLocal() as db:
+        crud.bulk_create_products(db, products, chunk_size=10000)
+
+
+def main(args):
+    seed(args.products)
+    rng = random.Random(1)
+    queries = [" ".join(rng.sample(WORDS, rng.choice((1, 2)))) for _ in range(args.queries)]
+    print(f"products={args.products} queries={args.queries}")
+    with SessionLocal() as db:
+        for name, search in (("LIKE", like_search), ("FTS5 + bm25", fts_search)):
+            latencies = []
+            for q in queries:
+                start = time.perf_counter()
+                search(db, q)
+                latencies.append(time.perf_counter() - start)
+            _bootstrap.report(name, qps=round(len(queries) / sum(latencies)), **_bootstrap.percentiles(latencies))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    main(parser.parse_args())
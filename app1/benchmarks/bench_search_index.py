@@ -0,0 +1,79 @@
+import _bootstrap
+import argparse
+import random
+import time
+from app.search import ProductSearchIndex, tokenize
+
+# dictのストアの/itemsと/searchをProductSearchIndexと、全商品を毎回なめる線形走査で比べる
+# 条件: カテゴリ+価格帯 / 価格帯だけ / 1語の検索 / 1語+カテゴリ
+
+WORDS = [f"w{n}" for n in range(5000)]
+
+
+def make_products(count: int):
+    rng = random.Random(0)
+    return [{
+        "id": n,
+        "name": " ".join(rng.sample(WORDS, 3)),
+        "description": " ".join(rng.choices(WORDS, k=8)),
+        "category": f"c{n % 50}",
+        "price": round(rng.uniform(1, 1000), 2),
+        } for n in range(1, count + 1)]
+
+
+def linear_search(products, q=None, category=None, min_price=None, max_price=None, limit=10, offset=0):
+    tokens = tokenize(q)
+    hits = []
+    for product in products:
+        if category is not None and product["category"] != category:
+            continue
+        if min_price is not None and product["price"] < min_price:
+            continue
+        if max_price is not None and product["price"] > max_price:
+            continue
+        if tokens:
+            name, description = tokenize(product["name"]), tokenize(product["description"])
+            if not all(token in name or token in description for token in tokens):
+                continue
+            score = sum(2 * name.count(token) + description.count(token) for token in tokens)
+            hits.append((-score, product["id"]))
+        else:
+            hits.append((0, product["id"]))
+    hits.sort()
+    return len(hits), [product_id for _, product_id in hits[offset:offset + limit]]
+
+
+def main(args):
+    rng = random.Random(1)
+    queries = []
+    for _ in range(args.queries):
+        low = rng.uniform(1, 900)
+        queries.append(rng.choice([
+            {"category": f"c{rng.randrange(50)}", "min_price": low, "max_price": low + 50},
+            {"min_price": low, "max_price": low + 10},
+            {"q": rng.choice(WORDS)},
+            {"q": rng.choice(WORDS), "category": f"c{rng.randrange(50)}"},
+            ]))
+    for size in args.sizes:
+        products = make_products(size)
+        index = ProductSearchIndex()
+        start = time.perf_counter()
+        index.add_many(products)
+        print(f"products={size} queries={len(queries)} index_build_s={time.perf_counter() - start:.1f}")
+        for name, search in (("linear scan", lambda **kw: linear_search(products, **kw)),
+                             ("ProductSearchIndex", index.search)):
+            latencies = []
+            for query in queries[:args.linear_queries] if name == "linear scan" else queries:
+                start = time.perf_counter()
+                search(**query)
+                latencies.append(time.perf_counter() - start)
+            _bootstrap.report(f"  {name}", queries=len(latencies), **_bootstrap.percentiles(latencies))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in s.split(",")], default=[100000, 1000000])
+    parser.add_argument("--queries", type=int, default=400)
+    # 線形走査は1回が遅いので、先頭のこの件数だけ測る
+    parser.add_argument("--linear-queries", type=int, default=20)
+    main(parser.parse_args())
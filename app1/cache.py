@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 商品の読み取りキャッシュ
+# 1段目: プロセス内のLRU+TTL / 2段目(任意): 複数ワーカーで共有するキャッシュ
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "10000"))  # 0で無効
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "60"))
+# "local"でLocalSharedCacheを2段目に使う。Redisなどを使う場合はSharedCacheを実装して差し替える
+PRODUCT_CACHE_SHARED = os.getenv("PRODUCT_CACHE_SHARED", "")
+
+
+class SharedCache:
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+# 共有キャッシュの代わりに使うプロセス内実装(開発・テスト用)
+class LocalSharedCache(SharedCache):
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._data[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class TTLCache:
+    _MISSING = object()
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _InflightLoad:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class ReadThroughCache:
+    def __init__(self, prefix: str, maxsize: int, ttl: float, shared: SharedCache = None):
+        self.prefix = prefix
+        self.local = TTLCache(maxsize, ttl)
+        self.shared = shared
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    def _shared_key(self, key) -> str:
+        return f"{self.prefix}:{key}"
+
+    # キャッシュに無ければloaderで読み込む。同じキーの読み込みが同時に来たら1回だけ実行する(single-flight)
+    def get_or_load(self, key, loader):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        if self.shared is not None:
+            value = self.shared.get(self._shared_key(key))
+            if value is not None:
+                self.shared_hits += 1
+                self.local.set(key, value)
+                return value
+
+        with self._lock:
+            inflight = self._inflight.get(key)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[key] = _InflightLoad()
+            else:
+                self.coalesced += 1
+        if not leader:
+            inflight.event.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.value
+
+        try:
+            self.loads += 1
+            value = loader()
+            inflight.value = value
+            # 読み込み中に無効化された値はキャッシュしない
+            with self._lock:
+                if value is not None and not inflight.stale:
+                    self.local.set(key, value)
+                    if self.shared is not None:
+                        self.shared.set(self._shared_key(key), value, self.local.ttl)
+            return value
+        except Exception as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            inflight.event.set()
+
+    def invalidate(self, key):
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                inflight.stale = True
+            self.local.delete(key)
+            if self.shared is not None:
+                self.shared.delete(self._shared_key(key))
+
+    # プロセス内の値だけ消す(テスト用)。共有キャッシュは他のワーカーも使っているので触らない
+    def clear(self):
+        with self._lock:
+            for inflight in self._inflight.values():
+                inflight.stale = True
+            self.local.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.local),
+            "maxsize": self.local.maxsize,
+            "hits": self.local.hits,
+            "misses": self.local.misses,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "shared_hits": self.shared_hits,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+        }
+
+
+product_cache = ReadThroughCache(
+        "product",
+        PRODUCT_CACHE_SIZE,
+        PRODUCT_CACHE_TTL,
+        shared=LocalSharedCache() if PRODUCT_CACHE_SHARED == "local" else None,
+        )
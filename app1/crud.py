@@ -1,6 +1,13 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, aliased, joinedload, selectinload
+from sqlalchemy import and_, or_, func, insert, literal_column, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import column, table
+from sqlalchemy.exc import SQLAlchemyError
 from app import db_models, models
+from app.fts import build_match_query
+from app.search import tokenize
+from app.exceptions import InsufficientStockError, ProductNotFoundError
+from app.pagination import decode_cursor, encode_cursor, InvalidCursor
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -14,8 +21,10 @@ def get_user(db: Session, user_id: int):
 def get_user_by_email(db: Session, email: str):
     return db.query(db_models.User).filter(db_models.User.email == email).first()
 
-def create_user(db: Session, user: models.UserCreate):
-    hashed_password = get_password_hash(user.password)
+# hashed_passwordを渡せばここでは計算しない(password_hasherで事前に計算する場合)
+def create_user(db: Session, user: models.UserCreate, hashed_password: str = None):
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password)
     db_user = db_models.User(
             email=user.email,
             username=user.username,
@@ -37,5 +46,369 @@ def get_products(db: Session, skip: int = 0, limit: int = 100, category: str = N
         query = query.filter(db_models.Product.category == category)
     return query.offset(skip).limit(limit).all()
 
-def create_product
+# キーセット方式。(category, id)のインデックスをシークするので深いページでも遅くならない
+# カテゴリがNULLの商品は先頭に並べる(SQLiteのインデックスと同じ順。NULLは比較で落ちるので別の条件で拾う)
+def get_products_page(db: Session, limit: int = 100, category: str = None, cursor: str = None):
+    Product = db_models.Product
+    query = db.query(Product)
+    if category:
+        query = query.filter(Product.category == category)
+    if cursor:
+        last_category, last_id = _decode_product_cursor(cursor)
+        if category:
+            query = query.filter(Product.id > last_id)
+        elif last_category is None:
+            query = query.filter(or_(
+                and_(Product.category.is_(None), Product.id > last_id),
+                Product.category.is_not(None),
+                ))
+        else:
+            # 行値の比較にするとインデックスを(category, id)の位置からシークできる(ORに分けると全体を走査する)
+            # NULLのカテゴリは比較で落ちるが、先頭に並ぶので取りこぼさない
+            query = query.filter(tuple_(Product.category, Product.id) > tuple_(last_category, last_id))
+    if category:
+        query = query.order_by(Product.id)
+    else:
+        query = query.order_by(Product.category.asc().nulls_first(), Product.id)
+
+    products = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor(last.category, last.id)
+    return products, next_cursor
+
+def _decode_product_cursor(cursor: str):
+    key = decode_cursor(cursor)
+    if len(key) != 2 or not isinstance(key[0], (str, type(None))) or not isinstance(key[1], int):
+        raise InvalidCursor("不正なカーソルです")
+    return key[0], key[1]
+
+products_fts = table("products_fts", column("rowid"))
+
+# 商品の全文検索。SQLiteではFTS5のインデックスをBM25のスコア順(名前の一致を2倍に重み付け)で引く
+# それ以外のDBではLIKEで絞り込んでid順に返す。戻り値は(ヒット件数, 商品のリスト)
+def search_products(db: Session, q: str = None, category: str = None, price_range: tuple = None,
+                    limit: int = 10, offset: int = 0):
+    Product = db_models.Product
+    query = db.query(Product)
+    match = build_match_query(q)
+    use_fts = bool(match) and db.get_bind().dialect.name == "sqlite"
+    if use_fts:
+        query = query.join(products_fts, products_fts.c.rowid == Product.id).filter(
+                literal_column("products_fts").op("MATCH")(match))
+    else:
+        for token in tokenize(q):
+            query = query.filter(or_(Product.name.ilike(f"%{token}%"), Product.description.ilike(f"%{token}%")))
+    if category is not None:
+        query = query.filter(Product.category == category)
+    if price_range is not None:
+        min_price, max_price = price_range
+        if min_price is not None:
+            query = query.filter(Product.price >= min_price)
+        if max_price is not None:
+            query = query.filter(Product.price <= max_price)
+
+    total = query.count()
+    if use_fts:
+        query = query.order_by(func.bm25(literal_column("products_fts"), 2.0, 1.0), Product.id)
+    else:
+        query = query.order_by(Product.id)
+    return total, query.offset(offset).limit(limit).all()
+
+# ETag用。商品が無ければNone
+def get_product_version(db: Session, product_id: int):
+    return db.query(db_models.Product.version).filter(db_models.Product.id == product_id).scalar()
+
+# 商品一覧のETag用。追加で件数と最大のidが、在庫などの書き換えでversionの合計が変わる
+def get_product_list_version(db: Session) -> str:
+    Product = db_models.Product
+    count, version_sum, max_id = db.query(
+            func.count(Product.id), func.coalesce(func.sum(Product.version), 0), func.coalesce(func.max(Product.id), 0),
+            ).one()
+    return f"{count}-{version_sum}-{max_id}"
+
+def create_product(db: Session, product: models.ProductCreate):
+    db_product = db_models.Product(**product.model_dump())
+    db.add(db_product)
+    db.commit()
+    db.refresh(db_product)
+    return db_product
+
+# 一括登録。chunk_size件ごとに1トランザクションでexecutemanyする。
+# チャンクが失敗した場合はそのチャンクだけ1件ずつ入れ直し、失敗した行をerrorsに返す。
+def bulk_create_products(db: Session, products: list, chunk_size: int = 1000):
+    created = 0
+    errors = []
+    for start in range(0, len(products), chunk_size):
+        chunk = products[start:start + chunk_size]
+        try:
+            db.execute(insert(db_models.Product), [p.model_dump() for p in chunk])
+            db.commit()
+            created += len(chunk)
+        except SQLAlchemyError:
+            db.rollback()
+            for offset, product in enumerate(chunk):
+                try:
+                    db.execute(insert(db_models.Product), [product.model_dump()])
+                    db.commit()
+                    created += 1
+                except SQLAlchemyError as e:
+                    db.rollback()
+                    errors.append({"index": start + offset, "error": str(getattr(e, "orig", None) or e)})
+    return created, errors
+
+CANCELLED = models.OrderStatus.cancelled.value
+
+# ユーザーの集計行に差分を足す。行が無ければ作る(INSERT ... ON CONFLICT DO UPDATE)
+# ordered=Trueは新しい注文のときで、last_order_atも更新する
+def _user_summary_upsert(dialect_name: str, user_id: int, count_delta: int, spend_delta: float,
+                         ordered: bool = False):
+    Summary = db_models.UserOrderSummary
+    dialect_insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(Summary).values(
+            user_id=user_id,
+            order_count=count_delta,
+            lifetime_spend=spend_delta,
+            last_order_at=func.now() if ordered else None,
+            )
+    set_ = {
+        "order_count": Summary.order_count + stmt.excluded.order_count,
+        "lifetime_spend": Summary.lifetime_spend + stmt.excluded.lifetime_spend,
+        }
+    if ordered:
+        set_["last_order_at"] = stmt.excluded.last_order_at
+    return stmt.on_conflict_do_update(index_elements=[Summary.user_id], set_=set_)
+
+# 注文の行をユーザーごとにまとめて集計の更新文にする。ロック順を揃えるためuser_id順
+def _user_summary_statements(dialect_name: str, order_rows: list):
+    deltas = {}
+    for row in order_rows:
+        count, spend = deltas.get(row["user_id"], (0, 0))
+        deltas[row["user_id"]] = (count + 1, spend + row["total_amount"])
+    return [_user_summary_upsert(dialect_name, user_id, count, spend, ordered=True)
+            for user_id, (count, spend) in sorted(deltas.items())]
+
+def _order_quantities(order: models.OrderCreate) -> dict:
+    quantities = {}
+    for item in order.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+# 参照される商品の価格を1クエリでまとめて読む
+def _load_prices(db: Session, product_ids) -> dict:
+    Product = db_models.Product
+    return dict(db.query(Product.id, Product.price).filter(Product.id.in_(set(product_ids))).all())
+
+# 在庫が足りるときだけ減らす条件付きUPDATE。ロック順を揃えるためid順に実行する
+# ETag用のversionも同じUPDATEで上げる(戻すときも上げる。同じ番号を別の内容に使わない)
+# 途中で足りなくなったら、この注文で減らした分を戻してからInsufficientStockErrorを投げる
+def _reserve_stock(db: Session, quantities: dict, prices: dict):
+    Product = db_models.Product
+    for product_id in quantities:
+        if product_id not in prices:
+            raise ProductNotFoundError(product_id)
+    reserved = []
+    for product_id in sorted(quantities):
+        result = db.execute(
+                update(Product)
+                .where(Product.id == product_id, Product.stock_quantity >= quantities[product_id])
+                .values(stock_quantity=Product.stock_quantity - quantities[product_id], version=Product.version + 1)
+                .execution_options(synchronize_session=False)
+                )
+        if result.rowcount != 1:
+            for reserved_id in reserved:
+                db.execute(
+                        update(Product)
+                        .where(Product.id == reserved_id)
+                        .values(stock_quantity=Product.stock_quantity + quantities[reserved_id],
+                                version=Product.version + 1)
+                        .execution_options(synchronize_session=False)
+                        )
+            raise InsufficientStockError(product_id)
+        reserved.append(product_id)
+
+# 注文と明細をDBの価格で書き込み、書き込んだ値から注文のdictを作る(読み直さない)
+def _insert_order(db: Session, order: models.OrderCreate, prices: dict) -> dict:
+    row = {
+        "user_id": order.user_id,
+        "total_amount": sum(prices[item.product_id] * item.quantity for item in order.items),
+        "status": "pending",
+        }
+    order_id, created_at = db.execute(
+            insert(db_models.Order).returning(db_models.Order.id, db_models.Order.created_at), row,
+            ).one()
+    items = [{
+        "order_id": order_id,
+        "product_id": item.product_id,
+        "quantity": item.quantity,
+        "price": prices[item.product_id],
+        } for item in order.items]
+    item_ids = db.scalars(
+            insert(db_models.OrderItem).returning(db_models.OrderItem.id, sort_by_parameter_order=True),
+            items,
+            ).all()
+    return {
+        **row,
+        "id": order_id,
+        "created_at": created_at,
+        "items": [{"id": item_id, **item} for item_id, item in zip(item_ids, items)],
+        }
+
+# 在庫を引き当てて注文を作る。全体を1トランザクションで行い、途中で失敗したらロールバックする
+# 価格はクライアントの値ではなくDBの商品価格を使う。戻り値は明細(items)を含む注文のdict
+def place_order(db: Session, order: models.OrderCreate):
+    quantities = _order_quantities(order)
+    try:
+        prices = _load_prices(db, quantities)
+        _reserve_stock(db, quantities, prices)
+        created = _insert_order(db, order, prices)
+        for statement in _user_summary_statements(db.get_bind().dialect.name, [created]):
+            db.execute(statement)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return created
+
+# ステータスを変え、キャンセルになった/キャンセルが取り消されたときだけ集計を増減する
+# 読んだ時点のステータスのときだけ書き換える条件付きUPDATE。他で変わっていたら読み直す
+# 戻り値は(注文, 変更前のステータス)。注文が無ければ(None, None)
+def update_order_status(db: Session, order_id: int, status: str):
+    Order = db_models.Order
+    try:
+        while True:
+            current = db.query(Order.user_id, Order.total_amount, Order.status).filter(Order.id == order_id).first()
+            if current is None:
+                return None, None
+            result = db.execute(
+                    update(Order)
+                    .where(Order.id == order_id, Order.status == current.status)
+                    .values(status=status)
+                    .execution_options(synchronize_session=False)
+                    )
+            if result.rowcount == 1:
+                break
+            db.rollback()
+        was_cancelled = current.status == CANCELLED
+        if was_cancelled != (status == CANCELLED):
+            sign = 1 if was_cancelled else -1
+            db.execute(_user_summary_upsert(
+                db.get_bind().dialect.name, current.user_id, sign, sign * current.total_amount,
+                ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return get_order(db, order_id, load="selectin"), current.status
+
+def get_user_summary(db: Session, user_id: int):
+    return db.get(db_models.UserOrderSummary, user_id)
+
+# ユーザーの注文を新しい順に。(user_id, created_at DESC, id DESC)のインデックスをシークするので並び替えは不要
+# created_atは秒単位で重なるのでidで順序を決める。カーソルはidだけを持ち、その注文のcreated_atはDBから引く
+def get_user_orders_page(db: Session, user_id: int, status: str = None, limit: int = 20, cursor: str = None):
+    Order = db_models.Order
+    query = db.query(Order).filter(Order.user_id == user_id)
+    if status is not None:
+        query = query.filter(Order.status == status)
+    if cursor:
+        last_id = _decode_order_cursor(cursor)
+        last = aliased(Order)
+        last_created_at = select(last.created_at).where(last.id == last_id).scalar_subquery()
+        query = query.filter(or_(
+            Order.created_at < last_created_at,
+            and_(Order.created_at == last_created_at, Order.id < last_id),
+            ))
+    orders = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1].id)
+    return orders, next_cursor
+
+# 売上集計用の明細を(注文ID, 日付, 商品ID, カテゴリ, 数量, 単価)のタプルでbatch_size件ずつ返す
+# after_order_idより新しい注文だけを読む。キャンセルされた注文は含めない
+def iter_sales_lines(db: Session, after_order_id: int = 0, batch_size: int = 10000):
+    Order, OrderItem, Product = db_models.Order, db_models.OrderItem, db_models.Product
+    query = (
+            select(
+                OrderItem.order_id,
+                func.date(Order.created_at),
+                OrderItem.product_id,
+                func.coalesce(Product.category, ""),
+                OrderItem.quantity,
+                OrderItem.price,
+                )
+            .join(Order, Order.id == OrderItem.order_id)
+            .join(Product, Product.id == OrderItem.product_id)
+            .where(OrderItem.order_id > after_order_id, Order.status != CANCELLED)
+            .execution_options(yield_per=batch_size)
+            )
+    for partition in db.execute(query).partitions():
+        yield partition
+
+def _decode_order_cursor(cursor: str) -> int:
+    key = decode_cursor(cursor)
+    if len(key) != 1 or not isinstance(key[0], int):
+        raise InvalidCursor("不正なカーソルです")
+    return key[0]
+
+# 注文→明細→商品の読み込み方。Noneは遅延ロード(明細の数だけクエリが増える)
+ORDER_LOAD_STRATEGIES = {"selectin": selectinload, "joined": joinedload}
+
+def _order_load_options(load: str = None):
+    if load is None:
+        return []
+    if load not in ORDER_LOAD_STRATEGIES:
+        raise ValueError(f"loadは{list(ORDER_LOAD_STRATEGIES)}のいずれかです")
+    items = ORDER_LOAD_STRATEGIES[load](db_models.Order.order_items)
+    return [getattr(items, f"{load}load")(db_models.OrderItem.product)]
+
+def get_order(db: Session, order_id: int, load: str = None):
+    query = db.query(db_models.Order).options(*_order_load_options(load))
+    return query.filter(db_models.Order.id == order_id).first()
+
+def get_orders(db: Session, skip: int = 0, limit: int = 100, user_id: int = None, load: str = None):
+    query = db.query(db_models.Order).options(*_order_load_options(load))
+    if user_id is not None:
+        query = query.filter(db_models.Order.user_id == user_id)
+    return query.order_by(db_models.Order.id).offset(skip).limit(limit).all()
 
+# 一括注文。1件ずつplace_orderと同じ手順(DBの価格・在庫の条件付き引き当て)で処理し、
+# chunk_size件ごとに1トランザクションでコミットする。商品が無い・在庫が足りない注文はerrorsに返す
+# チャンクがDBのエラーで失敗した場合はそのチャンクだけ1件ずつplace_orderで入れ直す
+def bulk_create_orders(db: Session, orders: list, chunk_size: int = 1000):
+    created = 0
+    errors = []
+    dialect_name = db.get_bind().dialect.name
+    for start in range(0, len(orders), chunk_size):
+        chunk = orders[start:start + chunk_size]
+        chunk_errors = []
+        try:
+            prices = _load_prices(db, (item.product_id for order in chunk for item in order.items))
+            placed = []
+            for offset, order in enumerate(chunk):
+                try:
+                    _reserve_stock(db, _order_quantities(order), prices)
+                except (ProductNotFoundError, InsufficientStockError) as e:
+                    chunk_errors.append({"index": start + offset, "error": str(e)})
+                    continue
+                placed.append(_insert_order(db, order, prices))
+            for statement in _user_summary_statements(dialect_name, placed):
+                db.execute(statement)
+            db.commit()
+            created += len(placed)
+            errors += chunk_errors
+        except SQLAlchemyError:
+            db.rollback()
+            for offset, order in enumerate(chunk):
+                try:
+                    place_order(db, order)
+                    created += 1
+                except (ProductNotFoundError, InsufficientStockError) as e:
+                    errors.append({"index": start + offset, "error": str(e)})
+                except SQLAlchemyError as e:
+                    errors.append({"index": start + offset, "error": str(getattr(e, "orig", None) or e)})
+    return created, errors
@@ -1,17 +1,132 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+import logging
 import os
+import threading
+import time
 
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ecommerce.db")
 
+# 同期(def)のルートはAnyIOのスレッドプールで動き、1スレッドが同時に使う接続は1本
+# プールがスレッド数より小さいと接続待ちで詰まるので、2つは1つの設定として扱う
+# THREADPOOL_LIMITを変えればプールの既定値も変わる。起動時にcheck_pool_capacity()で確かめる
+THREADPOOL_LIMIT = int(os.getenv("THREADPOOL_LIMIT", "40"))
+
+# コネクションプールの設定。本番の負荷に合わせて環境変数で変える
+# max_overflowはストリーミング中のエクスポートなど、スレッドを離れても接続を持つ処理の分
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(THREADPOOL_LIMIT)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# フェイルオーバー後の古い接続を使い続けないよう、一定時間で張り直し+使う前にping
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+logger = logging.getLogger(__name__)
+
+
+# 接続の取得待ち時間を記録するQueuePool
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.wait_count += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or url.rstrip("/") in ("sqlite:", "sqlite+aiosqlite:"))
+
+def _pool_options(url: str) -> dict:
+    # インメモリSQLiteは1接続を共有する専用プールなのでプール設定は渡さない
+    if _is_sqlite_memory(url):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# SQLiteは接続ごとにWALとbusy_timeoutを設定し、同時書き込みで"database is locked"にならないようにする
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+engine_options = _pool_options(DATABASE_URL)
+if engine_options:
+    engine_options["poolclass"] = TimedQueuePool
+
 engine = create_engine(
         DATABASE_URL,
-        connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+        connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+        **engine_options
         )
+if DATABASE_URL.startswith("sqlite"):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+
+def pool_stats() -> dict:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    stats = {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "threadpool_limit": THREADPOOL_LIMIT,
+    }
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            "wait_count": pool.wait_count,
+            "wait_time_total_ms": pool.wait_time_total * 1000,
+            "wait_time_max_ms": pool.wait_time_max * 1000,
+            "timeouts": pool.timeouts,
+        })
+    return stats
 
-sessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 起動時に呼ぶ。プール(pool_size + max_overflow)がスレッド数より小さければ警告する
+def check_pool_capacity(threads: int = THREADPOOL_LIMIT) -> bool:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return True
+    capacity = pool.size() + DB_MAX_OVERFLOW
+    if capacity < threads:
+        logger.warning(
+                "DB pool capacity %d (DB_POOL_SIZE + DB_MAX_OVERFLOW) is below THREADPOOL_LIMIT %d; "
+                "requests will wait up to %ss for a connection", capacity, threads, DB_POOL_TIMEOUT)
+        return False
+    return True
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 def get_db():
@@ -21,4 +136,38 @@ def get_db():
     finally:
         db.close()
 
+# 非同期版。ドライバはローカルがaiosqlite、本番がasyncpg
+# ASYNC_DATABASE_URLが無ければDATABASE_URLのスキームを置き換えて使う
+def _to_async_url(url: str) -> str:
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    if url.startswith(("postgresql://", "postgres://")):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _to_async_url(DATABASE_URL))
+
+# ドライバが入っていない環境でもimportできるよう、エンジンは初回利用時に作る
+async_engine = None
+AsyncSessionLocal = None
+
+def get_async_engine():
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, **_pool_options(ASYNC_DATABASE_URL))
+        if ASYNC_DATABASE_URL.startswith("sqlite"):
+            event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
 
+async def dispose_async_engine():
+    global async_engine, AsyncSessionLocal
+    if async_engine is not None:
+        await async_engine.dispose()
+        async_engine = None
+        AsyncSessionLocal = None
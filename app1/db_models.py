@@ -1,7 +1,7 @@
-from sqlalchemy import Boolean, Column, integer, String, Float, DateTime, ForeignKey, Text
-from sqlalchemy.relationship import relationship
+from sqlalchemy import Boolean, Column, Integer, String, Float, DateTime, ForeignKey, Text, Index
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from app.database import base
+from app.database import Base
 
 class User(Base):
     __tablename__ = "users"
@@ -28,33 +28,67 @@ class Product(Base):
     category = Column(String, index=True)
     stock_quantity = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # ETag用。行を書き換えるUPDATEで一緒に+1する(在庫の引き当てなど)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     
     order_items = relationship("OrderItem", back_populates="product")
 
+    __table_args__ = (
+        # キーセットページング用 (category, id)
+        Index("ix_products_category_id", "category", "id"),
+        # カテゴリ内の価格での絞り込み・並び替え
+        Index("ix_products_category_price", "category", "price"),
+        # カテゴリを指定しない価格帯での絞り込み
+        Index("ix_products_price", "price"),
+    )
+
 class Order(Base):
-    __tablename__ = "order"
+    __tablename__ = "orders"
 
     id = Column(Integer, primary_key=True, index = True)
-    user_id = Column(integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     total_amount = Column(Float, nullable=False)
     status = Column(String, default="pending")
-    created_at = Column(Datetime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="orders")
     order_items = relationship("OrderItem", back_populates="order")
 
+    __table_args__ = (
+        # ユーザXの注文を新しい順に。同じ日時はidで並べるので、idまで含めて並び替えを不要にする
+        Index("ix_orders_user_id_created_at_id", user_id, created_at.desc(), id.desc()),
+        # ステータスごとの新しい順
+        Index("ix_orders_status_created_at", status, created_at),
+    )
+
 class OrderItem(Base):
     __tablename__ = "order_items"
 
-    id = Column(Integer, primary_Key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"),nullable=False)
-    product_id = Column(Integer, ForeignKey("product.id"), nullbale=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, nullable=False)
     price = Column(Float, nullable=False)
 
     order = relationship("Order", back_populates="order_items")
     product = relationship("Product", back_populates="order_items")
 
+    __table_args__ = (
+        # 注文Yの明細
+        Index("ix_order_items_order_id", "order_id"),
+        Index("ix_order_items_product_id", "product_id"),
+    )
+
+# ユーザーごとの注文の集計。注文の作成・ステータス変更と同じトランザクションで差分だけ更新する
+# キャンセルされた注文はorder_count/lifetime_spendに含めない。last_order_atは最後に注文した日時
+class UserOrderSummary(Base):
+    __tablename__ = "user_order_summaries"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    lifetime_spend = Column(Float, nullable=False, default=0)
+    last_order_at = Column(DateTime(timezone=True))
+
 
 
     
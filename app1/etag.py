@@ -0,0 +1,31 @@
+from fastapi import HTTPException, Request, Response
+
+# リソースのバージョン番号からETagを作る。本文をシリアライズしてハッシュする必要がない
+# バージョンはRepositoryが返す値(SQLAlchemyではDBの列)なので、同じDBを使うワーカー間で一致する
+CACHE_CONTROL = "no-cache"
+
+
+def make_etag(resource: str, version) -> str:
+    return f'"{resource}-{version}"'
+
+
+# "*"は現在の表現があれば一致する(存在しないリソースはここまで来ない)
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Matchは弱い比較なのでW/は外して比べる
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
+
+
+# ハンドラより前に実行する。クライアントが同じETagを持っていれば本文を作らずに304を返す
+# versionがNone(リソースが無い)ならETagを付けず、"*"でも304にせずにハンドラまで進めて404にする
+def check_etag(request: Request, response: Response, resource: str, version):
+    if version is None:
+        return
+    etag = make_etag(resource, version)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
@@ -0,0 +1,19 @@
+# Repositoryが投げる業務エラー。エンドポイントでHTTPのステータスに変換する
+
+class ProductNotFoundError(Exception):
+    def __init__(self, product_id: int):
+        super().__init__(f"商品が見つかりません: {product_id}")
+        self.product_id = product_id
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, product_id: int):
+        super().__init__(f"在庫が不足しています: {product_id}")
+        self.product_id = product_id
+
+
+# 一意であるべき値(メールアドレス・ユーザー名・商品名)がすでに使われている
+class DuplicateError(Exception):
+    def __init__(self, field: str):
+        super().__init__(f"{field}は既に登録されています")
+        self.field = field
@@ -0,0 +1,41 @@
+from sqlalchemy import text
+from app.search import tokenize
+
+# SQLite FTS5による商品の全文検索インデックス
+# productsを外部コンテンツとして参照し、トリガーでINSERT/UPDATE/DELETEに追従する
+# スキーマの変更はmigrations/versions/0001_products_fts.pyで行う。ここは開発時のcreate_tables用
+
+PRODUCT_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, content='products', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    # 在庫数の更新ではインデックスを触らないよう、対象の列を絞る
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+
+def ensure_product_fts(connection):
+    exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+            ).first()
+    for statement in PRODUCT_FTS_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        # 既存の商品をインデックスに取り込む
+        connection.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+
+# 検索語をFTS5のMATCH式にする。各トークンを引用符で囲んでAND検索にする
+def build_match_query(q: str) -> str:
+    return " ".join(f'"{token}"' for token in tokenize(q))
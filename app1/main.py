@@ -1,12 +1,52 @@
-from fastapi import FastAPI, HTTPException
-from typing import Optional
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import Annotated, Optional
 from enum import Enum
-from datetime import datetime
-from app.models import User, UserCreate, Product, ProductCreate, Order, OrderCreate
-
-fake_users_db = {}
-fake_products_db = {}
-fake_orders_db = {}
+from datetime import date, datetime
+import csv
+import io
+import json
+import os
+import anyio.to_thread
+from app.exceptions import DuplicateError, InsufficientStockError, ProductNotFoundError
+from app.models import (
+        User, UserCreate, Product, ProductCreate, Order, OrderCreate,
+        OrderStatus, OrderStatusUpdate, UserOrderPage, UserOrderSummary,
+        )
+from app.password_hasher import password_hasher, PasswordHasherBusy
+from app.analytics import sales_analytics
+from app.cache import product_cache
+from app.database import THREADPOOL_LIMIT, check_pool_capacity, dispose_async_engine, pool_stats
+from app.etag import check_etag
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, request_metrics
+from app.pagination import InvalidCursor
+from app.query_counter import QUERY_COUNT_HEADER, QueryCountMiddleware
+from app.responses import FastJSONResponse
+from app.repositories import Repository, create_tables, get_repository
+
+# 保存先(dict or SQLAlchemy)はDATABASE_URLで切り替わる。エンドポイントはRepositoryだけを使う
+RepositoryDep = Annotated[Repository, Depends(get_repository)]
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# 商品を書き換えたらキャッシュを消す(書き込みの後に呼ぶこと)。ETag用のバージョンは書き込みと一緒にRepositoryが上げる
+def _products_changed(product_ids=()):
+    for product_id in product_ids:
+        product_cache.invalidate(product_id)
+
+def _load_product(repo: Repository, product_id: int):
+    return product_cache.get_or_load(product_id, lambda: repo.get_product(product_id))
+
+def product_list_etag(request: Request, response: Response, repo: RepositoryDep):
+    check_etag(request, response, f"{repo.etag_namespace}-products", repo.get_product_list_version())
+
+# 主キーでバージョンだけを読む。戻り値のバージョンはハンドラで本文と揃えるのに使う
+def product_etag(product_id: int, request: Request, response: Response, repo: RepositoryDep):
+    version = repo.get_product_version(product_id)
+    check_etag(request, response, f"{repo.etag_namespace}-product:{product_id}", version)
+    return version
 
 
 
@@ -16,65 +56,250 @@ app = FastAPI(
         version="1.0.0"
 )
 
+# QUERY_COUNT_HEADER=1のとき、レスポンスにX-Query-Count(そのリクエストで実行したSQLの数)を付ける
+if QUERY_COUNT_HEADER:
+    app.add_middleware(QueryCountMiddleware)
+# ルートごとのレイテンシ・ステータス・サイズを集計する(/metrics)。最後に追加して一番外側で測る
+app.add_middleware(MetricsMiddleware)
+
+
+
+@app.on_event("startup")
+def on_startup():
+    create_tables()
+
+# スレッドプールの上限とDBのプールはTHREADPOOL_LIMITで揃える
+@app.on_event("startup")
+async def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_LIMIT
+    check_pool_capacity(THREADPOOL_LIMIT)
+
+@app.on_event("startup")
+async def start_request_metrics():
+    await request_metrics.start()
+
+@app.on_event("shutdown")
+async def stop_request_metrics():
+    await request_metrics.stop()
 
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_async_engine():
+    await dispose_async_engine()
 
 @app.post("/users", response_model=User)
-def create_user(user: UserCreate):
-    user_id = len(fake_users_db) + 1
-    user_dict = user.dict()
-    user_dict.update({
-        "id": user_id,
-        "created_at": datetime.now(),
-        "is_active": True
-        })
-    del user_dict["password"]
-
-    fake_users_db[user_id] = user_dict
-    return user_dict
+async def create_user(user: UserCreate, repo: RepositoryDep):
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="混み合っています。しばらくしてから再度お試しください", headers={"Retry-After": "1"})
+    try:
+        return await run_in_threadpool(repo.create_user, user, hashed_password)
+    except DuplicateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 @app.get("/users/{user_id}",response_model=User)
-def get_user(user_id: int):
-    if user_id not in fake_users_db:
+def get_user(user_id: int, repo: RepositoryDep):
+    user = repo.get_user(user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="ユーザが見つかりません")
+    return user
+
+# ユーザーの注文を新しい順に。次のページはレスポンスのnext_cursorを渡す
+@app.get("/users/{user_id}/orders", response_model=UserOrderPage)
+def list_user_orders(
+        user_id: int,
+        repo: RepositoryDep,
+        status: Optional[OrderStatus] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        ):
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limitは1〜100である必要があります")
+    if repo.get_user(user_id) is None:
         raise HTTPException(status_code=404, detail="ユーザが見つかりません")
-    return fake_users_db[user_id]
+    try:
+        orders, next_cursor = repo.list_user_orders(user_id, status.value if status else None, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"orders": orders, "next_cursor": next_cursor}
+
+# 注文件数・累計金額・最終注文日時。注文のたびに更新している集計を読むだけ
+@app.get("/users/{user_id}/summary", response_model=UserOrderSummary)
+def get_user_summary(user_id: int, repo: RepositoryDep):
+    if repo.get_user(user_id) is None:
+        raise HTTPException(status_code=404, detail="ユーザが見つかりません")
+    return repo.get_user_summary(user_id)
 
 @app.post("/products", response_model=Product)
-def create_product(product: ProductCreate):
-    product_id = len(fake_products_db) + 1
-    product_dict = product.dict()
-    product_dict["id"] = product_id
-
-    fake_products_db[product_id] = product_dict
-    return product_dict
+def create_product(product: ProductCreate, repo: RepositoryDep):
+    try:
+        created = repo.create_product(product)
+    except DuplicateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    _products_changed()
+    return created
+
+# 一括登録。JSON配列またはNDJSON(1行1オブジェクト)を受け付ける。
+# 不正な行はerrorsに行番号付きで返し、残りの行は登録を続ける。
+def _parse_bulk_body(body: bytes, content_type: str):
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        rows = []
+        for index, line in enumerate(l for l in body.splitlines() if l.strip()):
+            try:
+                rows.append((index, json.loads(line)))
+            except ValueError as e:
+                rows.append((index, e))
+        return rows
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON配列またはNDJSONを送信してください")
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="JSON配列またはNDJSONを送信してください")
+    return list(enumerate(data))
+
+def _validate_bulk_rows(rows, model):
+    valid = []
+    errors = []
+    for index, row in rows:
+        if isinstance(row, Exception):
+            errors.append({"index": index, "error": f"JSONとして解釈できません: {row}"})
+            continue
+        if not isinstance(row, dict):
+            errors.append({"index": index, "error": "オブジェクトではありません"})
+            continue
+        try:
+            valid.append((index, model(**row)))
+        except ValidationError as e:
+            errors.append({"index": index, "error": e.errors(include_url=False, include_context=False)})
+    return valid, errors
+
+# JSONの解析・検証・登録はどれも重いので、まとめてスレッドプールで実行する
+def _bulk_insert(body, content_type, model, insert, chunk_size):
+    valid, errors = _validate_bulk_rows(_parse_bulk_body(body, content_type), model)
+    created, insert_errors = insert([obj for _, obj in valid], chunk_size)
+    # Repositoryが返す位置はvalid内の位置なので、リクエストの行番号に戻す
+    for error in insert_errors:
+        errors.append({"index": valid[error["index"]][0], "error": error["error"]})
+    errors.sort(key=lambda e: e["index"])
+    return {"created": created, "errors": errors}, [obj for _, obj in valid]
+
+@app.post("/products/bulk")
+async def bulk_create_products(request: Request, repo: RepositoryDep, chunk_size: int = BULK_CHUNK_SIZE):
+    if chunk_size <= 0:
+        raise HTTPException(status_code=400, detail="chunk_sizeは正の値である必要があります")
+    result, _ = await run_in_threadpool(
+            _bulk_insert, await request.body(), request.headers.get("content-type", ""),
+            ProductCreate, repo.bulk_create_products, chunk_size,
+            )
+    _products_changed()
+    return result
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ["id", "name", "description", "price", "category", "stock_quantity"]
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# 数千行ずつまとめて送る。商品数が増えてもメモリ使用量は一定
+def _export_ndjson(products):
+    lines = []
+    for product in products:
+        lines.append(json.dumps(product, ensure_ascii=False, default=_json_default))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+def _export_csv(products):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, product in enumerate(products, 1):
+        writer.writerow([product.get(column) for column in EXPORT_COLUMNS])
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+# /products/{product_id}より前に定義する
+@app.get("/products/export")
+def export_products(repo: RepositoryDep, format: ExportFormat = ExportFormat.ndjson):
+    products = repo.iter_products(EXPORT_BATCH_SIZE)
+    if format == ExportFormat.csv:
+        return StreamingResponse(
+                _export_csv(products),
+                media_type="text/csv; charset=utf-8",
+                headers={"Content-Disposition": 'attachment; filename="products.csv"'},
+                )
+    return StreamingResponse(_export_ndjson(products), media_type="application/x-ndjson")
 
 @app.get("/products/{product_id}",response_model=Product)
-def get_product(product_id: int):
-    if product_id not in fake_products_db:
+def get_product(product_id: int, repo: RepositoryDep, version: Annotated[Optional[int], Depends(product_etag)]):
+    product = _load_product(repo, product_id)
+    # 他のワーカーの書き込みでキャッシュが古くなっていれば読み直し、ETagより古い本文を返さない
+    if version is not None and (product is None or product["version"] != version):
+        product_cache.invalidate(product_id)
+        product = _load_product(repo, product_id)
+    if product is None:
         raise HTTPException(status_code=404, detail="商品が見つかりません")
-    return fake_products_db[product_id]
+    return product
 
 @app.post("/orders", response_model=Order)
-def create_order(order: OrderCreate):
-    order_id = len(fake_orders_db) + 1
-    total_amount=sum(item.price * item.quantity for item in order.items)
-
-    order_dict = order.dict()
-    order_dict.update({
-        "id": order_id,
-        "total_amount": total_amount,
-        "status": "pending",
-        "created_at": datetime.now()
-        })
-
-
-    fake_orders_db[order_id] = order_dict
-    return order_dict
+def create_order(order: OrderCreate, repo: RepositoryDep):
+    try:
+        created = repo.create_order(order)
+    except ProductNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except InsufficientStockError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # 在庫が変わった商品はキャッシュとETagを更新する
+    _products_changed({item.product_id for item in order.items})
+    sales_analytics.mark_dirty()
+    return created
+
+@app.post("/orders/bulk")
+async def bulk_create_orders(request: Request, repo: RepositoryDep, chunk_size: int = BULK_CHUNK_SIZE):
+    if chunk_size <= 0:
+        raise HTTPException(status_code=400, detail="chunk_sizeは正の値である必要があります")
+    result, orders = await run_in_threadpool(
+            _bulk_insert, await request.body(), request.headers.get("content-type", ""),
+            OrderCreate, repo.bulk_create_orders, chunk_size,
+            )
+    _products_changed({item.product_id for order in orders for item in order.items})
+    sales_analytics.mark_dirty()
+    return result
 
 @app.get("/orders/{order_id}", response_model=Order)
-def get_order(order_id: int):
-    if order_id not in fake_orders_db:
+def get_order(order_id: int, repo: RepositoryDep):
+    order = repo.get_order(order_id)
+    if order is None:
+        raise HTTPException(status_code=404, detail="注文が見つかりません")
+    return order
+
+@app.patch("/orders/{order_id}/status", response_model=Order)
+def update_order_status(order_id: int, update: OrderStatusUpdate, repo: RepositoryDep):
+    order, previous = repo.update_order_status(order_id, update.status.value)
+    if order is None:
         raise HTTPException(status_code=404, detail="注文が見つかりません")
-    return fake_orders_db[order_id]
+    # キャンセルになった/取り消されたときは取り込み済みの明細が変わるので集計を作り直す
+    # それ以外のステータス変更は売上に影響しない
+    cancelled = OrderStatus.cancelled.value
+    if (previous == cancelled) != (order["status"] == cancelled):
+        sales_analytics.reset()
+    return order
 
 
 
@@ -98,15 +323,18 @@ class ItemType(str, Enum):
 def get_category(category: ItemType):
     return {"category": category}
 
+# 商品名・説明の全文検索。スコアの高い順に返す
 @app.get("/search")
-def search_items(q: Optional[str] = None, limit: int = 10, offset: int = 0):
+def search_items(repo: RepositoryDep, q: Optional[str] = None, limit: int = 10, offset: int = 0):
     results = {"query": q, "limit": limit, "offset": offset}
     if q:
         results["message"] = f"Searching for {q}"
-    return results
+    results["total"], results["results"] = repo.search_products(q=q, limit=limit, offset=offset)
+    return FastJSONResponse(results)
 
 @app.get("/items")
 def list_items(
+        repo: RepositoryDep,
         skip: int=0,
         limit: int = 100,
         category: Optional[str] = None,
@@ -120,18 +348,68 @@ def list_items(
             "min_price": min_price,
             "max_price": max_price
             }
-    return {"filters": filters, "items": ["sample_item_1", "sample_item_2"]}
+    total, items = repo.search_products(
+            category=category, min_price=min_price, max_price=max_price, limit=limit, offset=skip
+            )
+    return FastJSONResponse({"filters": filters, "total": total, "items": items})
 
 #２．商品一覧
-@app.get("/products")
-def get_product_list():
-    return {"products": list(fake_products_db.values())}
+# Responseを直接返すと依存関係で付けたヘッダーが引き継がれないので、ETagなどを移す
+# limit・category・cursorのどれかを付けるとキーセット方式のページ。次のページはレスポンスのnext_cursorを渡す
+@app.get("/products", dependencies=[Depends(product_list_etag)])
+def get_product_list(
+        repo: RepositoryDep,
+        response: Response,
+        limit: Optional[int] = None,
+        category: Optional[str] = None,
+        cursor: Optional[str] = None,
+        ):
+    if limit is None and category is None and cursor is None:
+        return FastJSONResponse({"products": repo.list_products()}, headers=response.headers)
+    limit = 100 if limit is None else limit
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="limitは1〜1000である必要があります")
+    try:
+        products, next_cursor = repo.list_products_page(limit, category, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"products": products, "next_cursor": next_cursor}, headers=response.headers)
 
 
 
 
+# カテゴリ×日ごとの売上と売上上位の商品。期間は両端を含む
+@app.get("/analytics/sales")
+def sales_report(repo: RepositoryDep, start: Optional[date] = None, end: Optional[date] = None, top_n: int = 10):
+    if not 1 <= top_n <= 100:
+        raise HTTPException(status_code=400, detail="top_nは1〜100である必要があります")
+    return FastJSONResponse(sales_analytics.report(repo, start, end, top_n))
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
+# Prometheus形式。スナップショットはイベントループで取り、整形(マルチプロセス時はファイルの集計)はスレッドで行う
+@app.get("/metrics")
+async def prometheus_metrics():
+    snapshot = request_metrics.snapshot()
+    body = await run_in_threadpool(request_metrics.render, snapshot)
+    return Response(body, media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/metrics/password-hasher")
+def password_hasher_metrics():
+    return password_hasher.stats()
+
+@app.get("/metrics/product-cache")
+def product_cache_metrics():
+    return product_cache.stats()
+
+@app.get("/metrics/db-pool")
+def db_pool_metrics():
+    return pool_stats()
+
+@app.get("/metrics/sales-analytics")
+def sales_analytics_metrics():
+    return sales_analytics.stats()
+
 
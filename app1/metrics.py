@@ -0,0 +1,195 @@
+import asyncio
+import bisect
+import glob
+import json
+import os
+import tempfile
+import time
+
+# ルート(パスのテンプレート)ごとのリクエストのメトリクスをPrometheusのテキスト形式で返す
+# - レイテンシ: 固定バケットのヒストグラム / 処理中のリクエスト数 / ステータスコードごとの件数 / レスポンスサイズ
+# - 値を更新するのはミドルウェア(イベントループのスレッド)だけなのでロックは使わない
+#   別スレッドから読むときは、ループのスレッドでsnapshot()を取ってから渡す
+# - METRICS_MULTIPROC_DIRを設定すると、ワーカーごとに値をファイルへ書き出し、/metricsでは全ワーカー分を合計する
+#   (uvicorn --workers N 用。起動前にディレクトリを空にしておくこと)
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+# 1-2.5-5刻みで0.5ms〜10秒。これを超えたものは+Infに入る
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "<unmatched>"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RouteStats:
+    __slots__ = ("buckets", "duration_sum", "size_sum", "size_count")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.duration_sum = 0.0
+        self.size_sum = 0
+        self.size_count = 0
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.in_flight = 0
+        self.routes = {}    # (method, route) → RouteStats
+        self.statuses = {}  # (method, route, status) → 件数
+        self._flusher = None
+
+    def observe(self, method: str, route: str, status: int, seconds: float, size: int):
+        stats = self.routes.get((method, route))
+        if stats is None:
+            stats = self.routes[(method, route)] = RouteStats()
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        stats.duration_sum += seconds
+        stats.size_sum += size
+        stats.size_count += 1
+        key = (method, route, status)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "routes": [
+                [method, route, list(s.buckets), s.duration_sum, s.size_sum, s.size_count]
+                for (method, route), s in self.routes.items()
+            ],
+            "statuses": [[method, route, status, count] for (method, route, status), count in self.statuses.items()],
+        }
+
+    # --- マルチプロセス用 ---
+
+    def _path(self) -> str:
+        return os.path.join(METRICS_MULTIPROC_DIR, f"metrics_{os.getpid()}.json")
+
+    # 定期的な書き出しと/metricsから同時に呼ばれるので、一時ファイルは呼び出しごとに別の名前にする
+    def flush(self, snapshot: dict = None):
+        fd, tmp_path = tempfile.mkstemp(prefix=f"metrics_{os.getpid()}.", suffix=".tmp", dir=METRICS_MULTIPROC_DIR)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot or self.snapshot(), f)
+            os.replace(tmp_path, self._path())  # 読む側に書きかけのファイルを見せない
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            await asyncio.to_thread(self.flush, self.snapshot())
+
+    # アプリの起動・終了時に呼ぶ。終了時は処理中0件の最終値を書いておく
+    async def start(self):
+        if METRICS_MULTIPROC_DIR:
+            os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+            self.flush()
+
+    def _collect(self, snapshot: dict) -> dict:
+        if not METRICS_MULTIPROC_DIR:
+            return snapshot
+        self.flush(snapshot)
+        merged = {"in_flight": 0, "routes": {}, "statuses": {}}
+        for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, "metrics_*.json")):
+            try:
+                with open(path) as f:
+                    worker = json.load(f)
+            except (OSError, ValueError):
+                continue
+            merged["in_flight"] += worker["in_flight"]
+            for method, route, buckets, duration_sum, size_sum, size_count in worker["routes"]:
+                total = merged["routes"].setdefault((method, route), [[0] * len(buckets), 0.0, 0, 0])
+                total[0] = [a + b for a, b in zip(total[0], buckets)]
+                total[1] += duration_sum
+                total[2] += size_sum
+                total[3] += size_count
+            for method, route, status, count in worker["statuses"]:
+                key = (method, route, status)
+                merged["statuses"][key] = merged["statuses"].get(key, 0) + count
+        return {
+            "in_flight": merged["in_flight"],
+            "routes": [[method, route, *values] for (method, route), values in merged["routes"].items()],
+            "statuses": [[*key, count] for key, count in merged["statuses"].items()],
+        }
+
+    # snapshotはループのスレッドで取ったもの。ファイルを読むのでスレッドプールで呼んでよい
+    def render(self, snapshot: dict) -> str:
+        data = self._collect(snapshot)
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being processed.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {data['in_flight']}",
+            "# HELP http_request_duration_seconds Request latency by route.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        sizes = []
+        for method, route, buckets, duration_sum, size_sum, size_count in sorted(data["routes"], key=lambda r: r[:2]):
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for le, count in zip((*LATENCY_BUCKETS, "+Inf"), buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {duration_sum}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+            sizes.append(f"http_response_size_bytes_sum{{{labels}}} {size_sum}")
+            sizes.append(f"http_response_size_bytes_count{{{labels}}} {size_count}")
+        lines += [
+            "# HELP http_response_size_bytes Response body size by route.",
+            "# TYPE http_response_size_bytes summary",
+            *sizes,
+            "# HELP http_responses_total Responses by route and status code.",
+            "# TYPE http_responses_total counter",
+        ]
+        for method, route, status, count in sorted(data["statuses"], key=lambda s: s[:3]):
+            lines.append(f'http_responses_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_metrics = RequestMetrics()
+
+
+# ラベルは実際のパスではなくルートのテンプレート(/products/{product_id})にして、系列が増えすぎないようにする
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics: RequestMetrics = request_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter_ns()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        self.metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics.in_flight -= 1
+            seconds = (time.perf_counter_ns() - start) / 1e9
+            self.metrics.observe(scope["method"], _route_template(scope), status, seconds, size)
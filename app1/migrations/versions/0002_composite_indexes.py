@@ -0,0 +1,40 @@
+"""composite indexes for product and order access patterns
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_products_category_id", "products", ["category", "id"], if_not_exists=True)
+    op.create_index("ix_products_category_price", "products", ["category", "price"], if_not_exists=True)
+    op.create_index(
+        "ix_orders_user_id_created_at", "orders", ["user_id", sa.text("created_at DESC")], if_not_exists=True
+    )
+    op.create_index("ix_orders_status_created_at", "orders", ["status", "created_at"], if_not_exists=True)
+    op.create_index("ix_order_items_order_id", "order_items", ["order_id"], if_not_exists=True)
+    op.create_index("ix_order_items_product_id", "order_items", ["product_id"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_order_items_product_id", table_name="order_items", if_exists=True)
+    op.drop_index("ix_order_items_order_id", table_name="order_items", if_exists=True)
+    op.drop_index("ix_orders_status_created_at", table_name="orders", if_exists=True)
+    op.drop_index("ix_orders_user_id_created_at", table_name="orders", if_exists=True)
+    op.drop_index("ix_products_category_price", table_name="products", if_exists=True)
+    op.drop_index("ix_products_category_id", table_name="products", if_exists=True)
@@ -0,0 +1,48 @@
+"""per-user order summaries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "user_order_summaries",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("order_count", sa.Integer(), nullable=False),
+        sa.Column("lifetime_spend", sa.Float(), nullable=False),
+        sa.Column("last_order_at", sa.DateTime(timezone=True)),
+        if_not_exists=True,
+    )
+    # 既存の注文から集計を作る。以降はアプリが注文のたびに差分で更新する
+    op.execute(
+        """
+        INSERT INTO user_order_summaries (user_id, order_count, lifetime_spend, last_order_at)
+        SELECT user_id,
+               SUM(CASE WHEN status = 'cancelled' THEN 0 ELSE 1 END),
+               SUM(CASE WHEN status = 'cancelled' THEN 0 ELSE total_amount END),
+               MAX(created_at)
+        FROM orders
+        WHERE user_id NOT IN (SELECT user_id FROM user_order_summaries)
+        GROUP BY user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("user_order_summaries", if_exists=True)
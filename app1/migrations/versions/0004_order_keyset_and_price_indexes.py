@@ -0,0 +1,39 @@
+"""order keyset index with id and price-only index
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_orders_user_id_created_at_id",
+        "orders",
+        ["user_id", sa.text("created_at DESC"), sa.text("id DESC")],
+        if_not_exists=True,
+    )
+    op.drop_index("ix_orders_user_id_created_at", table_name="orders", if_exists=True)
+    op.create_index("ix_products_price", "products", ["price"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_products_price", table_name="products", if_exists=True)
+    op.create_index(
+        "ix_orders_user_id_created_at", "orders", ["user_id", sa.text("created_at DESC")], if_not_exists=True
+    )
+    op.drop_index("ix_orders_user_id_created_at_id", table_name="orders", if_exists=True)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, conlist, field_validator
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
@@ -17,7 +17,8 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password: str
 
-    @validator('password')
+    @field_validator('password')
+    @classmethod
     def validate_password(cls, v):
         if len(v) < 8:
             raise ValueError('パスワードは8文字以上である必要があります。')
@@ -28,33 +29,21 @@ class User(UserBase):
     is_active: bool = True
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class Product(BaseModel):
     id: Optional[int] = None
     name: str
     description: Optional[str] = None
-    price: float
+    price: float = Field(gt=0)
     category: str
     stock_quantity: int = 0
 
-    @validator('price')
-    def validate_price(cls, v):
-        if v <= 0:
-            raise ValueError('価格は正の値である必要があります')
-        return v
-
 class OrderItem(BaseModel):
     product_id: int
-    quantity: int
-    price: float
-
-    @validator('quantity')
-    def validate_quantity(cls, v):
-        if v <= 0:
-            raise ValueError('数量は正の値である必要があります。')
-        return v
+    quantity: int = Field(gt=0)
+    # 価格はサーバー側で商品の価格から決めるので、クライアントは送らなくてよい
+    price: Optional[float] = None
 
 class ProductCreate(BaseModel):
     name: str
@@ -63,39 +52,53 @@ class ProductCreate(BaseModel):
     category: str
     stock_quantity: int = 0
 
+class OrderStatus(str, Enum):
+    pending = "pending"
+    paid = "paid"
+    shipped = "shipped"
+    delivered = "delivered"
+    cancelled = "cancelled"
+
 class Order(BaseModel):
     id: int
     total_amount: float
     status: str = "pending"
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class OrderStatusUpdate(BaseModel):
+    status: OrderStatus
+
+class UserOrderPage(BaseModel):
+    orders: List[Order]
+    next_cursor: Optional[str] = None
+
+# 注文の集計。キャンセルされた注文は件数・金額に含めない
+class UserOrderSummary(BaseModel):
+    user_id: int
+    order_count: int = 0
+    lifetime_spend: float = 0
+    last_order_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
     
 class OrderCreate(BaseModel):
     user_id: int
-    items: List[OrderItem]
+    # 件数・数量の検査はpydantic-core側で行う
+    items: conlist(OrderItem, min_length=1)
     description: Optional[str] = None
 
-    @validator('items')
+    @field_validator('items')
+    @classmethod
     def validate_items(cls, v):
-        if not v:
-            raise ValueError('注文には少なくとも1つの商品が必要です。')
-    
-        for item in v:
-            if item.product_id == 1:
-                raise ValueError('No!')
+        if any(item.product_id == 1 for item in v):
+            raise ValueError('No!')
         return v
 
 class HelloWorld(BaseModel):
-    hello_id: int
+    hello_id: int = Field(gt=0)
     hello_str: str
 
-    @validator('hello_id')
-    def hello_id_validator(cls, v):
-        if v <= 0:
-            raise ValueError('値は正である必要があります。')
-        return v
-
 
 
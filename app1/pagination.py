@@ -0,0 +1,23 @@
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# カーソルは最後に返した行のキーをJSON→base64にしただけの不透明な文字列
+def encode_cursor(*key) -> str:
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor("不正なカーソルです")
+    if not isinstance(key, list):
+        raise InvalidCursor("不正なカーソルです")
+    return key
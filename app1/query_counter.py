@@ -0,0 +1,61 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 実行したSQLの数を数える。N+1が入り込んだらテストでクエリ数の増加として検出できる
+#
+#   with count_queries() as counter:
+#       client.get("/orders/1")
+#   assert counter.count <= 3
+#
+# リクエスト単位ではQueryCountMiddlewareがX-Query-Countヘッダに件数を入れる
+# ヘッダは開発・CI用。QUERY_COUNT_HEADER=1のときだけミドルウェアを入れる
+QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", "0") == "1"
+
+_current_counter = ContextVar("query_counter", default=None)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    token = _current_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _current_counter.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _current_counter.get()
+    if counter is not None:
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+class QueryCountMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with count_queries() as counter:
+            async def send_with_count(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-query-count", str(counter.count).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_count)
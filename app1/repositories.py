@@ -0,0 +1,443 @@
+import bisect
+import heapq
+import os
+import secrets
+import threading
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from app import crud, db_models, models
+from app.database import Base, SessionLocal, engine
+from app.exceptions import DuplicateError, InsufficientStockError, ProductNotFoundError
+from app.fts import ensure_product_fts
+from app.pagination import encode_cursor
+from app.search import ProductSearchIndex
+from app.storage import InMemoryStore
+
+# DATABASE_URLが未設定ならdictのストア、設定されていればSQLAlchemyを使う
+USE_SQLALCHEMY = "DATABASE_URL" in os.environ
+
+
+# エンドポイントはこのインターフェースだけを使う。戻り値はどちらの実装でもdict
+class Repository:
+    # ETagの先頭に付ける。バージョンの番号が同じでも別のデータなら違うETagにする
+    etag_namespace = "db"
+
+    def create_user(self, user: models.UserCreate, hashed_password: str) -> dict:
+        raise NotImplementedError
+
+    def get_user(self, user_id: int):
+        raise NotImplementedError
+
+    def create_product(self, product: models.ProductCreate) -> dict:
+        raise NotImplementedError
+
+    def get_product(self, product_id: int):
+        raise NotImplementedError
+
+    def list_products(self) -> list:
+        raise NotImplementedError
+
+    # 戻り値は(商品のリスト, 次のページのカーソル or None)。カテゴリ(NULLが先頭)→idの順
+    def list_products_page(self, limit: int = 100, category: str = None, cursor: str = None):
+        raise NotImplementedError
+
+    # ETag用のバージョン。商品を書き換えるたびに上がる。商品が無ければNone
+    def get_product_version(self, product_id: int):
+        raise NotImplementedError
+
+    # 商品一覧のETag用。どれかの商品が追加・変更されると変わる文字列
+    def get_product_list_version(self) -> str:
+        raise NotImplementedError
+
+    # 戻り値は(ヒット件数, 商品のリスト)
+    def search_products(self, q: str = None, category: str = None, min_price: float = None,
+                        max_price: float = None, limit: int = 10, offset: int = 0):
+        raise NotImplementedError
+
+    # 全商品を1件ずつ返すジェネレータ。全件をメモリに載せないエクスポート用
+    def iter_products(self, batch_size: int = 1000):
+        raise NotImplementedError
+
+    # 戻り値は(登録件数, [{"index": productsでの位置, "error": ...}])
+    def bulk_create_products(self, products: list, chunk_size: int):
+        raise NotImplementedError
+
+    # 在庫を引き当てて注文を作る。ProductNotFoundError / InsufficientStockErrorのときは何も変更しない
+    # 価格はクライアントの値ではなく商品の価格を使う
+    def create_order(self, order: models.OrderCreate) -> dict:
+        raise NotImplementedError
+
+    def get_order(self, order_id: int):
+        raise NotImplementedError
+
+    # create_orderと同じく在庫を引き当てる。引き当てられなかった注文はerrorsに返す
+    def bulk_create_orders(self, orders: list, chunk_size: int):
+        raise NotImplementedError
+
+    # 戻り値は(注文のリスト, 次のページのカーソル or None)。新しい順
+    def list_user_orders(self, user_id: int, status: str = None, limit: int = 20, cursor: str = None):
+        raise NotImplementedError
+
+    # 注文の無いユーザーは0件の集計を返す
+    def get_user_summary(self, user_id: int) -> dict:
+        raise NotImplementedError
+
+    # 戻り値は(注文, 変更前のステータス)。注文が無ければ(None, None)
+    def update_order_status(self, order_id: int, status: str):
+        raise NotImplementedError
+
+    # 売上集計用。(注文ID, 日付, 商品ID, カテゴリ, 数量, 単価)のリストをbatch_size件ずつ返す
+    def iter_sales_lines(self, after_order_id: int = 0, batch_size: int = 10000):
+        raise NotImplementedError
+
+
+def _empty_user_summary(user_id: int) -> dict:
+    return {"user_id": user_id, "order_count": 0, "lifetime_spend": 0, "last_order_at": None}
+
+
+class InMemoryRepository(Repository):
+    def __init__(self):
+        # データはプロセスと一緒に消えるので、再起動後に同じバージョンにならないようETagにnonceを混ぜる
+        self.etag_namespace = secrets.token_hex(4)
+        self.users = InMemoryStore()
+        self.products = InMemoryStore()
+        self.orders = InMemoryStore()
+        self.search_index = ProductSearchIndex()
+        # ユーザーID → 注文IDの昇順リスト / ユーザーごとの集計
+        self.user_orders = {}
+        self.user_summaries = {}
+        self._summary_lock = threading.Lock()
+        # DBのUNIQUE制約の代わり。列名 → 使われている値
+        self._unique_values = {}
+        self._unique_lock = threading.Lock()
+
+    # 全部の値が未使用のときだけまとめて使用済みにする。どれかが使われていればDuplicateError
+    def _claim_unique(self, **values):
+        with self._unique_lock:
+            for field, value in values.items():
+                if value in self._unique_values.get(field, ()):
+                    raise DuplicateError(field)
+            for field, value in values.items():
+                self._unique_values.setdefault(field, set()).add(value)
+
+    def create_user(self, user, hashed_password):
+        self._claim_unique(email=user.email, username=user.username)
+        user_dict = user.model_dump()
+        user_dict.update({
+            "created_at": datetime.now(),
+            "is_active": True,
+            "hashed_password": hashed_password
+            })
+        del user_dict["password"]
+        return self.users.insert(user_dict)
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    def create_product(self, product):
+        self._claim_unique(name=product.name)
+        created = self.products.insert({**product.model_dump(), "version": 1})
+        self.search_index.add(created)
+        return created
+
+    def get_product(self, product_id):
+        return self.products.get(product_id)
+
+    def list_products(self):
+        return self.products.values()
+
+    def list_products_page(self, limit=100, category=None, cursor=None):
+        def key(product):
+            return (product["category"] is not None, product["category"] or "", product["id"])
+
+        products = self.products.values()
+        if category:
+            products = [p for p in products if p["category"] == category]
+        if cursor:
+            last_category, last_id = crud._decode_product_cursor(cursor)
+            last = (last_category is not None, last_category or "", last_id)
+            products = [p for p in products if key(p) > last]
+        products = heapq.nsmallest(limit + 1, products, key=key)
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            next_cursor = encode_cursor(products[-1]["category"], products[-1]["id"])
+        return products, next_cursor
+
+    def get_product_version(self, product_id):
+        product = self.products.get(product_id)
+        return product["version"] if product else None
+
+    def get_product_list_version(self):
+        products = self.products.values()
+        return (f"{len(products)}-{sum(p['version'] for p in products)}-"
+                f"{max((p['id'] for p in products), default=0)}")
+
+    def search_products(self, q=None, category=None, min_price=None, max_price=None, limit=10, offset=0):
+        total, product_ids = self.search_index.search(q, category, min_price, max_price, limit, offset)
+        return total, [self.products.get(product_id) for product_id in product_ids]
+
+    def iter_products(self, batch_size=1000):
+        yield from self.products.values()
+
+    # 名前が重複する商品はDBと同じくその行だけerrorsに入れ、残りは登録する
+    def bulk_create_products(self, products, chunk_size):
+        created = 0
+        errors = []
+        for start in range(0, len(products), chunk_size):
+            rows = []
+            for offset, product in enumerate(products[start:start + chunk_size]):
+                try:
+                    self._claim_unique(name=product.name)
+                except DuplicateError as e:
+                    errors.append({"index": start + offset, "error": str(e)})
+                    continue
+                rows.append({**product.model_dump(), "version": 1})
+            self.search_index.add_many(self.products.insert_many(rows))
+            created += len(rows)
+        return created, errors
+
+    def create_order(self, order):
+        quantities = {}
+        for item in order.items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        with self.products.transaction() as products:
+            for product_id, quantity in quantities.items():
+                if product_id not in products:
+                    raise ProductNotFoundError(product_id)
+                if products[product_id]["stock_quantity"] < quantity:
+                    raise InsufficientStockError(product_id)
+            for product_id, quantity in quantities.items():
+                products[product_id]["stock_quantity"] -= quantity
+                products[product_id]["version"] += 1
+            prices = {product_id: products[product_id]["price"] for product_id in quantities}
+        order_dict = order.model_dump()
+        for item in order_dict["items"]:
+            item["price"] = prices[item["product_id"]]
+        order_dict.update({
+            "total_amount": sum(item["price"] * item["quantity"] for item in order_dict["items"]),
+            "status": "pending",
+            "created_at": datetime.now()
+            })
+        created = self.orders.insert(order_dict)
+        self._record_orders([created])
+        return created
+
+    def get_order(self, order_id):
+        return self.orders.get(order_id)
+
+    # 1件ずつcreate_orderと同じ手順で在庫を引き当てる。dictのストアなのでchunk_sizeは使わない
+    def bulk_create_orders(self, orders, chunk_size):
+        created = 0
+        errors = []
+        for index, order in enumerate(orders):
+            try:
+                self.create_order(order)
+                created += 1
+            except (ProductNotFoundError, InsufficientStockError) as e:
+                errors.append({"index": index, "error": str(e)})
+        return created, errors
+
+    def _record_orders(self, orders):
+        with self._summary_lock:
+            for order in orders:
+                user_id = order["user_id"]
+                bisect.insort(self.user_orders.setdefault(user_id, []), order["id"])
+                summary = self.user_summaries.setdefault(user_id, _empty_user_summary(user_id))
+                summary["order_count"] += 1
+                summary["lifetime_spend"] += order["total_amount"]
+                if summary["last_order_at"] is None or summary["last_order_at"] < order["created_at"]:
+                    summary["last_order_at"] = order["created_at"]
+
+    def list_user_orders(self, user_id, status=None, limit=20, cursor=None):
+        with self._summary_lock:
+            order_ids = list(self.user_orders.get(user_id, ()))
+        end = len(order_ids)
+        if cursor:
+            end = bisect.bisect_left(order_ids, crud._decode_order_cursor(cursor))
+        orders = []
+        for order_id in reversed(order_ids[:end]):
+            order = self.orders.get(order_id)
+            if status is not None and order["status"] != status:
+                continue
+            orders.append(order)
+            if len(orders) > limit:
+                break
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            next_cursor = encode_cursor(orders[-1]["id"])
+        return orders, next_cursor
+
+    def get_user_summary(self, user_id):
+        with self._summary_lock:
+            return dict(self.user_summaries.get(user_id) or _empty_user_summary(user_id))
+
+    def update_order_status(self, order_id, status):
+        with self.orders.transaction() as orders:
+            order = orders.get(order_id)
+            if order is None:
+                return None, None
+            previous = order["status"]
+            order["status"] = status
+        was_cancelled = previous == crud.CANCELLED
+        if was_cancelled != (status == crud.CANCELLED):
+            sign = 1 if was_cancelled else -1
+            with self._summary_lock:
+                summary = self.user_summaries[order["user_id"]]
+                summary["order_count"] += sign
+                summary["lifetime_spend"] += sign * order["total_amount"]
+        return order, previous
+
+    def iter_sales_lines(self, after_order_id=0, batch_size=10000):
+        batch = []
+        for order in self.orders.values():
+            if order["id"] <= after_order_id or order["status"] == crud.CANCELLED:
+                continue
+            day = order["created_at"].date()
+            for item in order["items"]:
+                product = self.products.get(item["product_id"]) or {}
+                batch.append((
+                    order["id"], day, item["product_id"], product.get("category") or "",
+                    item["quantity"], item["price"],
+                    ))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _row_to_dict(row) -> dict:
+    return {column.name: getattr(row, column.name) for column in row.__table__.columns}
+
+
+class SqlAlchemyRepository(Repository):
+    # メソッドごとにセッションを開き、dictにしたら閉じて接続をプールへ返す
+    # リクエストの終わりまで接続を持ち続けると、同時リクエスト数がプールの上限で詰まる
+    # バージョンはDBの値なので、同じDBを使う全ワーカーで同じETagになる
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+
+    # UNIQUE制約の違反はdictのストアと同じDuplicateErrorにする
+    def create_user(self, user, hashed_password):
+        with self.session_factory() as db:
+            try:
+                return _row_to_dict(crud.create_user(db, user, hashed_password=hashed_password))
+            except IntegrityError:
+                raise DuplicateError("email/username")
+
+    def get_user(self, user_id):
+        with self.session_factory() as db:
+            user = crud.get_user(db, user_id)
+            return _row_to_dict(user) if user else None
+
+    def create_product(self, product):
+        with self.session_factory() as db:
+            try:
+                return _row_to_dict(crud.create_product(db, product))
+            except IntegrityError:
+                raise DuplicateError("name")
+
+    def get_product(self, product_id):
+        with self.session_factory() as db:
+            product = crud.get_product(db, product_id)
+            return _row_to_dict(product) if product else None
+
+    def list_products(self):
+        with self.session_factory() as db:
+            return [_row_to_dict(p) for p in db.query(db_models.Product).order_by(db_models.Product.id)]
+
+    def list_products_page(self, limit=100, category=None, cursor=None):
+        with self.session_factory() as db:
+            products, next_cursor = crud.get_products_page(db, limit, category, cursor)
+            return [_row_to_dict(p) for p in products], next_cursor
+
+    def get_product_version(self, product_id):
+        with self.session_factory() as db:
+            return crud.get_product_version(db, product_id)
+
+    def get_product_list_version(self):
+        with self.session_factory() as db:
+            return crud.get_product_list_version(db)
+
+    def search_products(self, q=None, category=None, min_price=None, max_price=None, limit=10, offset=0):
+        price_range = None
+        if min_price is not None or max_price is not None:
+            price_range = (min_price, max_price)
+        with self.session_factory() as db:
+            total, products = crud.search_products(db, q, category, price_range, limit, offset)
+            return total, [_row_to_dict(p) for p in products]
+
+    # yield_perでサーバーサイドカーソルを使い、batch_size件ずつ取り出す
+    # レスポンスの送信中も使うので、読み終わるまでこのジェネレータ専用のセッションを開いておく
+    def iter_products(self, batch_size=1000):
+        with self.session_factory() as db:
+            query = (
+                    select(db_models.Product)
+                    .order_by(db_models.Product.id)
+                    .execution_options(yield_per=batch_size)
+                    )
+            for product in db.scalars(query):
+                yield _row_to_dict(product)
+
+    def bulk_create_products(self, products, chunk_size):
+        with self.session_factory() as db:
+            return crud.bulk_create_products(db, products, chunk_size)
+
+    def _order_to_dict(self, order):
+        order_dict = _row_to_dict(order)
+        order_dict["items"] = [_row_to_dict(item) for item in order.order_items]
+        return order_dict
+
+    def create_order(self, order):
+        with self.session_factory() as db:
+            return crud.place_order(db, order)
+
+    def get_order(self, order_id):
+        with self.session_factory() as db:
+            order = crud.get_order(db, order_id, load="selectin")
+            return self._order_to_dict(order) if order else None
+
+    def bulk_create_orders(self, orders, chunk_size):
+        with self.session_factory() as db:
+            return crud.bulk_create_orders(db, orders, chunk_size)
+
+    def list_user_orders(self, user_id, status=None, limit=20, cursor=None):
+        with self.session_factory() as db:
+            orders, next_cursor = crud.get_user_orders_page(db, user_id, status, limit, cursor)
+            return [_row_to_dict(o) for o in orders], next_cursor
+
+    def get_user_summary(self, user_id):
+        with self.session_factory() as db:
+            summary = crud.get_user_summary(db, user_id)
+            return _row_to_dict(summary) if summary else _empty_user_summary(user_id)
+
+    def update_order_status(self, order_id, status):
+        with self.session_factory() as db:
+            order, previous = crud.update_order_status(db, order_id, status)
+            return (self._order_to_dict(order), previous) if order else (None, None)
+
+    def iter_sales_lines(self, after_order_id=0, batch_size=10000):
+        with self.session_factory() as db:
+            yield from crud.iter_sales_lines(db, after_order_id, batch_size)
+
+
+memory_repository = InMemoryRepository()
+
+
+sql_repository = SqlAlchemyRepository()
+
+
+# FastAPIの依存関係。SQLAlchemyのときもセッションは各メソッドの中で開いて閉じる
+def get_repository():
+    return sql_repository if USE_SQLALCHEMY else memory_repository
+
+
+def create_tables():
+    if USE_SQLALCHEMY:
+        Base.metadata.create_all(engine)
+        if engine.dialect.name == "sqlite":
+            with engine.begin() as connection:
+                ensure_product_fts(connection)
@@ -0,0 +1,46 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # orjsonが無い環境では標準のjsonで同じ形式を出す
+    orjson = None
+
+# dictやリストをそのままJSONにするレスポンス
+# response_modelの無いルートは、戻り値をjsonable_encoderで1件ずつ辿ってから標準のjsonに渡している
+# ハンドラがこのクラスを直接返せばjsonable_encoderを通らず、orjsonで1回でバイト列にする
+# response_modelのあるルートはFastAPIがpydanticで直接JSONにするので、そちらはそのままにする
+# (default_response_classを変えるとその経路が使われなくなり、かえって遅くなる)
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "tolist"):  # NumPyの配列・スカラー
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__}はJSONにできません")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(
+                content,
+                default=_default,
+                ensure_ascii=False,
+                allow_nan=False,
+                separators=(",", ":"),
+                ).encode("utf-8")
@@ -0,0 +1,133 @@
+import bisect
+import heapq
+import re
+import threading
+
+# 商品検索用のインメモリインデックス
+# - 名前/説明のトークン → {商品ID: スコア} の転置インデックス
+# - カテゴリ → 商品IDのソート済みリスト
+# - (価格, 商品ID)のソート済みリスト。価格の範囲はbisectで切り出す
+# 商品の登録・更新のたびにadd()で差分だけ更新する
+
+TOKEN_RE = re.compile(r"\w+")
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text: str) -> list:
+    return [token.lower() for token in TOKEN_RE.findall(text or "")]
+
+
+class ProductSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._terms = {}
+        self._categories = {}
+        self._prices = []
+        # 商品ID → (トークンごとのスコア, カテゴリ, 価格)。削除・更新時に使う
+        self._docs = {}
+
+    @staticmethod
+    def _scores(product: dict) -> dict:
+        scores = {}
+        for token in tokenize(product.get("name")):
+            scores[token] = scores.get(token, 0) + NAME_WEIGHT
+        for token in tokenize(product.get("description")):
+            scores[token] = scores.get(token, 0) + DESCRIPTION_WEIGHT
+        return scores
+
+    def add(self, product: dict):
+        product_id = product["id"]
+        scores = self._scores(product)
+        category = product.get("category")
+        price = product["price"]
+
+        with self._lock:
+            if product_id in self._docs:
+                self.remove(product_id)
+            for token, score in scores.items():
+                self._terms.setdefault(token, {})[product_id] = score
+            bisect.insort(self._categories.setdefault(category, []), product_id)
+            bisect.insort(self._prices, (price, product_id))
+            self._docs[product_id] = (scores, category, price)
+
+    # 一括登録用。1件ずつinsortすると価格のリストの挿入が毎回O(n)になるので、末尾に足して最後に並べ直す
+    def add_many(self, products):
+        with self._lock:
+            categories = set()
+            for product in products:
+                product_id = product["id"]
+                scores = self._scores(product)
+                category = product.get("category")
+                if product_id in self._docs:
+                    self.remove(product_id)
+                for token, score in scores.items():
+                    self._terms.setdefault(token, {})[product_id] = score
+                self._categories.setdefault(category, []).append(product_id)
+                self._prices.append((product["price"], product_id))
+                self._docs[product_id] = (scores, category, product["price"])
+                categories.add(category)
+            for category in categories:
+                self._categories[category].sort()
+            self._prices.sort()
+
+    def remove(self, product_id: int):
+        with self._lock:
+            doc = self._docs.pop(product_id, None)
+            if doc is None:
+                return
+            scores, category, price = doc
+            for token in scores:
+                postings = self._terms[token]
+                del postings[product_id]
+                if not postings:
+                    del self._terms[token]
+            ids = self._categories[category]
+            del ids[bisect.bisect_left(ids, product_id)]
+            if not ids:
+                del self._categories[category]
+            del self._prices[bisect.bisect_left(self._prices, (price, product_id))]
+
+    def _price_range(self, min_price, max_price) -> set:
+        lo = 0 if min_price is None else bisect.bisect_left(self._prices, (min_price, float("-inf")))
+        hi = len(self._prices) if max_price is None else bisect.bisect_right(self._prices, (max_price, float("inf")))
+        return {product_id for _, product_id in self._prices[lo:hi]}
+
+    # 戻り値は(ヒット件数, 商品IDのリスト)。qがあればスコアの高い順、なければID順
+    def search(self, q: str = None, category: str = None, min_price: float = None,
+               max_price: float = None, limit: int = 10, offset: int = 0):
+        tokens = list(dict.fromkeys(tokenize(q)))
+        with self._lock:
+            filters = []
+            postings = []
+            for token in tokens:
+                if token not in self._terms:
+                    return 0, []
+                postings.append(self._terms[token])
+            if category is not None:
+                filters.append(self._categories.get(category, ()))
+            if min_price is not None or max_price is not None:
+                filters.append(self._price_range(min_price, max_price))
+
+            # 小さい集合から順に絞り込む
+            sources = sorted(postings + filters, key=len)
+            if sources:
+                candidates = set(sources[0])
+                for source in sources[1:]:
+                    candidates.intersection_update(source)
+            else:
+                candidates = set(self._docs)
+
+            total = len(candidates)
+            if tokens:
+                ranked = heapq.nsmallest(
+                        offset + limit,
+                        candidates,
+                        key=lambda product_id: (-sum(p[product_id] for p in postings), product_id),
+                        )
+            else:
+                ranked = heapq.nsmallest(offset + limit, candidates)
+        return total, ranked[offset:offset + limit]
+
+    def __len__(self):
+        return len(self._docs)
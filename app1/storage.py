@@ -0,0 +1,113 @@
+import itertools
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+
+# プロセス内で単調増加するID。itertools.countのnext()はGILの下でアトミックなのでロック不要
+class CounterIdAllocator:
+    def __init__(self, start: int = 1):
+        self._counter = itertools.count(start)
+
+    def next_id(self) -> int:
+        return next(self._counter)
+
+
+# 複数ワーカー用のSnowflake形式ID
+# 41bit: エポックからのミリ秒 / 10bit: ワーカーID / 12bit: 同一ミリ秒内の連番
+class SnowflakeIdAllocator:
+    EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id < (1 << self.WORKER_BITS):
+            raise ValueError("worker_idは0〜1023である必要があります")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = max(int(time.time() * 1000), self._last_ms)
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << self.SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # 同一ミリ秒で連番を使い切ったら次のミリ秒まで待つ
+                    while now_ms <= self._last_ms:
+                        time.sleep(0.0001)
+                        now_ms = int(time.time() * 1000)
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (
+                ((now_ms - self.EPOCH_MS) << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                | (self.worker_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+# ID_ALLOCATOR=snowflake で複数ワーカー向け。WORKER_IDはワーカーごとに変えること
+def create_id_allocator():
+    if os.getenv("ID_ALLOCATOR", "counter") == "snowflake":
+        return SnowflakeIdAllocator(int(os.getenv("WORKER_ID", os.getpid() % 1024)))
+    return CounterIdAllocator()
+
+
+# スレッドプールで動く同期ハンドラから同時に触られても壊れないdict
+class InMemoryStore:
+    def __init__(self, allocator=None):
+        self._allocator = allocator or create_id_allocator()
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def insert(self, record: dict) -> dict:
+        record["id"] = self._allocator.next_id()
+        with self._lock:
+            self._data[record["id"]] = record
+        return record
+
+    def insert_many(self, records: list) -> list:
+        for record in records:
+            record["id"] = self._allocator.next_id()
+        with self._lock:
+            self._data.update((record["id"], record) for record in records)
+        return records
+
+    # 複数レコードの確認と更新をまとめてアトミックに行うときに使う
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self._data
+
+    def get(self, record_id: int, default=None):
+        with self._lock:
+            return self._data.get(record_id, default)
+
+    def update(self, record_id: int, **fields) -> dict:
+        with self._lock:
+            record = self._data[record_id]
+            record.update(fields)
+            return record
+
+    def delete(self, record_id: int):
+        with self._lock:
+            return self._data.pop(record_id, None)
+
+    def values(self) -> list:
+        with self._lock:
+            return list(self._data.values())
+
+    def __getitem__(self, record_id: int) -> dict:
+        with self._lock:
+            return self._data[record_id]
+
+    def __contains__(self, record_id) -> bool:
+        with self._lock:
+            return record_id in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,92 @@
+import importlib.util
+import itertools
+import os
+import sys
+import tempfile
+from pathlib import Path
+import pytest
+
+# app1のモジュールはパッケージ名appでimportする(from app.X import ...)
+# ディレクトリ名がappでなくてもテストできるよう、app1をappとして読み込む
+APP_DIR = Path(__file__).resolve().parents[1]
+
+# 各モジュールはimport時にDATABASE_URLを読むので、先に一時ファイルのSQLiteを指定しておく
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir.name}/test.db")
+
+if "app" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+            "app", APP_DIR / "__init__.py", submodule_search_locations=[str(APP_DIR)])
+    sys.modules["app"] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules["app"])
+
+from fastapi.testclient import TestClient
+from app import models
+from app.analytics import sales_analytics
+from app.cache import product_cache
+from app.database import SessionLocal
+from app.main import app
+from app.repositories import InMemoryRepository, get_repository, sql_repository
+
+_unique = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+# プロセス全体のキャッシュはテストの間で持ち越さない
+# (インメモリのリポジトリはテストごとにIDが1から振り直されるので、前のテストの商品が返ってしまう)
+@pytest.fixture(autouse=True)
+def reset_caches():
+    product_cache.clear()
+    sales_analytics.reset()
+
+
+# テストごとに空のdictのストアへ切り替える
+@pytest.fixture
+def memory_repo():
+    repo = InMemoryRepository()
+    app.dependency_overrides[get_repository] = lambda: repo
+    yield repo
+    app.dependency_overrides.pop(get_repository, None)
+
+
+# 両方のバックエンドで同じテストを流す。SQLiteのDBは全テストで共有する
+@pytest.fixture(params=["sqlalchemy", "memory"])
+def repo(request, client):
+    if request.param == "memory":
+        return request.getfixturevalue("memory_repo")
+    return sql_repository
+
+
+@pytest.fixture
+def db(client):
+    with SessionLocal() as session:
+        yield session
+
+
+# DBを共有するので、名前が重ならないデータを作る
+@pytest.fixture
+def make_user(repo):
+    def make():
+        n = next(_unique)
+        user = models.UserCreate(email=f"user{n}@example.com", username=f"user{n}", password="password")
+        return repo.create_user(user, "x")["id"]
+    return make
+
+
+# OrderCreateはproduct_id=1を受け付けないので、1番は注文に使わない
+@pytest.fixture
+def make_product(repo):
+    def make(price=10.0, stock_quantity=0, category="test"):
+        while True:
+            n = next(_unique)
+            product = models.ProductCreate(name=f"product{n}", price=price, category=category,
+                                           stock_quantity=stock_quantity)
+            product_id = repo.create_product(product)["id"]
+            if product_id != 1:
+                return product_id
+    return make
@@ -0,0 +1,111 @@
+import random
+from collections import defaultdict
+from datetime import date
+import pytest
+from app import analytics
+from app.analytics import SalesAnalytics
+
+
+# iter_sales_linesだけを持つリポジトリ。明細は(注文ID, 日, 商品ID, カテゴリ, 数量, 単価)
+class FakeSales:
+    def __init__(self, lines=()):
+        self.lines = list(lines)
+        self.calls = []
+
+    def iter_sales_lines(self, after_order_id=0, batch_size=10000):
+        self.calls.append(after_order_id)
+        rows = [line for line in self.lines if line[0] > after_order_id]
+        for i in range(0, len(rows), batch_size):
+            yield rows[i:i + batch_size]
+
+
+DAY1, DAY2, DAY3 = date(2025, 1, 1), date(2025, 1, 2), date(2025, 1, 3)
+
+
+# 2回目からは取り込み済みの最大注文IDより新しい明細だけを読む
+def test_refresh_reads_only_new_orders():
+    repo = FakeSales([(1, DAY1, 10, "a", 2, 5.0), (2, DAY1, 11, "b", 1, 3.0)])
+    sales = SalesAnalytics()
+
+    assert sales.report(repo)["total_revenue"] == 13.0
+    repo.lines.append((3, DAY2, 10, "a", 1, 5.0))
+    # mark_dirtyされるまでは読み直さない
+    assert sales.report(repo)["total_revenue"] == 13.0
+    sales.mark_dirty()
+    assert sales.report(repo)["total_revenue"] == 18.0
+
+    assert repo.calls == [0, 2]
+    assert sales.stats()["last_order_id"] == 3
+    assert sales.stats()["lines"] == 3
+    assert sales.rebuilds == 1
+
+
+# 新しい明細の日付を含む期間の結果だけ作り直す
+def test_new_lines_invalidate_only_ranges_that_include_them():
+    repo = FakeSales([(1, DAY1, 10, "a", 1, 5.0), (2, DAY2, 10, "a", 1, 5.0)])
+    sales = SalesAnalytics()
+    ranges = [(DAY1, DAY1), (None, DAY1), (DAY2, None), (None, None), (DAY1, DAY3)]
+    for start, end in ranges:
+        sales.report(repo, start, end)
+
+    repo.lines.append((3, DAY2, 11, "b", 1, 7.0))
+    sales.mark_dirty()
+    hits, misses = sales.hits, sales.misses
+    results = [sales.report(repo, start, end)["total_revenue"] for start, end in ranges]
+
+    assert results == [5.0, 5.0, 12.0, 17.0, 17.0]
+    assert sales.hits - hits == 2
+    assert sales.misses - misses == 3
+
+
+# np.unique/bincountの集計が1行ずつ足した結果と一致する。バッチをまたいでもカテゴリの番号がずれない
+def test_aggregation_matches_reference(monkeypatch):
+    monkeypatch.setattr(analytics, "ANALYTICS_BATCH_SIZE", 7)
+    rng = random.Random(0)
+    lines = [(
+        order_id, date(2025, 1, rng.randint(1, 5)), rng.randint(1, 20), rng.choice(["a", "b", "c", ""]),
+        rng.randint(1, 5), rng.choice([1.25, 2.5, 10.0, 99.99]),
+        ) for order_id in range(1, 301)]
+    by_category_day = defaultdict(float)
+    by_product = defaultdict(float)
+    for _, day, product_id, category, quantity, price in lines:
+        if day >= date(2025, 1, 2):
+            by_category_day[(day.isoformat(), category or None)] += quantity * price
+            by_product[product_id] += quantity * price
+
+    result = SalesAnalytics().report(FakeSales(lines), start=date(2025, 1, 2), top_n=5)
+
+    assert {(row["day"], row["category"]): row["revenue"]
+            for row in result["revenue_by_category_day"]} == pytest.approx(dict(by_category_day))
+    assert result["total_revenue"] == pytest.approx(sum(by_category_day.values()))
+    assert result["lines"] == sum(1 for line in lines if line[1] >= date(2025, 1, 2))
+    revenues = [row["revenue"] for row in result["top_products"]]
+    assert revenues == sorted(revenues, reverse=True)
+    assert revenues[0] == pytest.approx(max(by_product.values()))
+    assert all(row["revenue"] == pytest.approx(by_product[row["product_id"]]) for row in result["top_products"])
+
+
+# 注文で増え、キャンセルで全件を読み直して消える
+def test_sales_endpoint_follows_orders(client, repo, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(price=2.5, stock_quantity=10, category="analytics")
+
+    # SQLiteのDBは他のテストと共有なので、このテストのカテゴリの売上を見る
+    def revenue():
+        response = client.get("/analytics/sales")
+        assert response.status_code == 200
+        return sum(row["revenue"] for row in response.json()["revenue_by_category_day"]
+                   if row["category"] == "analytics")
+
+    before = revenue()
+    order = client.post("/orders", json={"user_id": user_id, "items": [
+        {"product_id": product_id, "quantity": 4}]}).json()
+    assert revenue() - before == pytest.approx(10.0)
+
+    client.patch(f"/orders/{order['id']}/status", json={"status": "cancelled"})
+    assert revenue() == pytest.approx(before)
+
+
+def test_sales_endpoint_rejects_top_n(client, repo):
+    assert client.get("/analytics/sales?top_n=0").status_code == 400
+    assert client.get("/analytics/sales?top_n=101").status_code == 400
@@ -0,0 +1,62 @@
+import anyio
+import pytest
+from app import async_crud, database, models
+from app.exceptions import InsufficientStockError
+
+pytestmark = [pytest.mark.anyio, pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# 非同期エンジンはテストのイベントループで作られるので、テストごとに閉じる
+@pytest.fixture
+async def async_db():
+    database.get_async_engine()
+    async with database.AsyncSessionLocal() as db:
+        yield db
+    await database.dispose_async_engine()
+
+
+def _order(user_id, *lines):
+    return models.OrderCreate(user_id=user_id, items=[
+        models.OrderItem(product_id=product_id, quantity=quantity) for product_id, quantity in lines
+        ])
+
+
+# crud.place_orderと同じくDBの価格で計算し、在庫を減らす
+async def test_place_order_reprices_and_reserves(async_db, repo, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(price=12.5, stock_quantity=5)
+
+    order = await async_crud.place_order(async_db, _order(user_id, (product_id, 2)))
+
+    assert order["total_amount"] == 25.0
+    assert (await async_crud.get_product(async_db, product_id)).stock_quantity == 3
+    assert [item.price for item in (await async_crud.get_order(async_db, order["id"])).order_items] == [12.5]
+
+
+# 同じ商品を200件同時に注文しても在庫より多くは売らない
+async def test_concurrent_buyers_do_not_oversell(async_db, repo, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(stock_quantity=50)
+    outcomes = []
+
+    async def buy():
+        async with database.AsyncSessionLocal() as db:
+            try:
+                await async_crud.place_order(db, _order(user_id, (product_id, 1)))
+                outcomes.append("ok")
+            except InsufficientStockError:
+                outcomes.append("sold out")
+
+    async with anyio.create_task_group() as tg:
+        for _ in range(200):
+            tg.start_soon(buy)
+
+    assert outcomes.count("ok") == 50
+    assert outcomes.count("sold out") == 150
+    assert repo.get_product(product_id)["stock_quantity"] == 0
+    assert repo.get_user_summary(user_id)["order_count"] == 50
@@ -0,0 +1,37 @@
+import threading
+from app import main
+
+
+def test_bulk_products_ndjson_reports_bad_rows(client, repo):
+    body = b'{"name": "bulk-a", "price": 1, "category": "bulk"}\nnot json\n{"name": "bulk-b"}\n'
+
+    response = client.post("/products/bulk", content=body, headers={"content-type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 1
+    assert [e["index"] for e in result["errors"]] == [1, 2]
+
+
+def test_bulk_rejects_non_array(client, repo):
+    response = client.post("/products/bulk", json={"name": "x"})
+    assert response.status_code == 400
+
+
+# 本文のJSONの解析はイベントループではなくスレッドプールで行う
+def test_bulk_body_is_parsed_off_the_event_loop(client, memory_repo, monkeypatch):
+    threads = []
+    parse = main._parse_bulk_body
+
+    def recording(*args):
+        threads.append(threading.current_thread())
+        return parse(*args)
+
+    monkeypatch.setattr(main, "_parse_bulk_body", recording)
+    loop_thread = client.portal.call(threading.current_thread)
+
+    client.post("/products/bulk", json=[{"name": "bulk-c", "price": 1, "category": "bulk"}])
+    client.post("/orders/bulk", json=[])
+
+    assert len(threads) == 2
+    assert loop_thread not in threads
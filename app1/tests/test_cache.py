@@ -0,0 +1,105 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.cache import LocalSharedCache, ReadThroughCache, TTLCache
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+# 同じキーの同時のミスは1回だけ読み込み、残りはその結果を待つ
+def test_concurrent_misses_load_once():
+    cache = ReadThroughCache("test", 100, 60)
+    release = threading.Event()
+
+    def loader():
+        release.wait()
+        return {"id": 1}
+
+    with ThreadPoolExecutor(20) as pool:
+        futures = [pool.submit(cache.get_or_load, 1, loader) for _ in range(20)]
+        _wait_until(lambda: cache.coalesced == 19)
+        release.set()
+        values = [future.result() for future in futures]
+
+    assert values == [{"id": 1}] * 20
+    assert cache.loads == 1
+    assert cache.coalesced == 19
+
+
+# 読み込み中に無効化された値はキャッシュしない(古い値が残らない)
+def test_invalidate_during_load_is_not_cached():
+    cache = ReadThroughCache("test", 100, 60)
+
+    def loader():
+        cache.invalidate(1)
+        return {"id": 1, "stock_quantity": 5}
+
+    assert cache.get_or_load(1, loader) == {"id": 1, "stock_quantity": 5}
+    assert cache.stats()["size"] == 0
+    assert cache.get_or_load(1, lambda: {"id": 1, "stock_quantity": 4}) == {"id": 1, "stock_quantity": 4}
+    assert cache.loads == 2
+
+
+# 読み込みの例外は待っている全員に届き、何もキャッシュしない
+def test_loader_errors_reach_every_waiter():
+    cache = ReadThroughCache("test", 100, 60)
+    release = threading.Event()
+
+    def loader():
+        release.wait()
+        raise RuntimeError("db down")
+
+    with ThreadPoolExecutor(5) as pool:
+        futures = [pool.submit(cache.get_or_load, 1, loader) for _ in range(5)]
+        _wait_until(lambda: cache.coalesced == 4)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError, match="db down"):
+                future.result()
+
+    assert cache.stats()["size"] == 0
+    assert cache.get_or_load(1, lambda: {"id": 1}) == {"id": 1}
+
+
+def test_ttl_expiry_is_counted():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses, cache.expirations) == (1, 1, 1)
+
+
+# 最後に使われたのが古いものから捨てる
+def test_lru_eviction_is_counted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.evictions == 1
+
+
+# 2段目の共有キャッシュに入った値は他のワーカーのミスでも使われ、無効化は両方に効く
+def test_shared_cache_between_workers():
+    shared = LocalSharedCache()
+    worker_a = ReadThroughCache("product", 10, 60, shared=shared)
+    worker_b = ReadThroughCache("product", 10, 60, shared=shared)
+
+    worker_a.get_or_load(1, lambda: {"id": 1})
+    assert worker_b.get_or_load(1, lambda: pytest.fail("should not load")) == {"id": 1}
+    assert worker_b.shared_hits == 1
+
+    worker_a.invalidate(1)
+    assert shared.get("product:1") is None
@@ -0,0 +1,17 @@
+import anyio.to_thread
+from app.database import THREADPOOL_LIMIT, check_pool_capacity, pool_stats
+
+
+# 既定ではDBのプールがスレッドプールと同じ大きさになり、起動時にスレッド数も揃える
+def test_pool_covers_threadpool(client):
+    assert pool_stats()["size"] >= THREADPOOL_LIMIT
+    assert check_pool_capacity(THREADPOOL_LIMIT)
+
+    async def total_tokens():
+        return anyio.to_thread.current_default_thread_limiter().total_tokens
+    assert client.portal.call(total_tokens) == THREADPOOL_LIMIT
+
+
+def test_small_pool_is_reported(caplog):
+    assert not check_pool_capacity(pool_stats()["size"] + pool_stats()["max_overflow"] + 1)
+    assert "THREADPOOL_LIMIT" in caplog.text
@@ -0,0 +1,35 @@
+import itertools
+
+_unique = itertools.count(1)
+
+
+# UNIQUE制約の違反はどちらのバックエンドでも409
+def test_duplicate_user_is_409(client, repo):
+    n = next(_unique)
+    user = {"email": f"dup{n}@example.com", "username": f"dup{n}", "password": "password"}
+    assert client.post("/users", json=user).status_code == 200
+
+    assert client.post("/users", json=user).status_code == 409
+    assert client.post("/users", json={**user, "username": f"dup{n}-other"}).status_code == 409
+    assert client.post("/users", json={**user, "email": f"dup{n}-other@example.com"}).status_code == 409
+
+
+def test_duplicate_product_name_is_409(client, repo):
+    product = {"name": f"dup-product{next(_unique)}", "price": 1, "category": "dup"}
+    assert client.post("/products", json=product).status_code == 200
+    assert client.post("/products", json=product).status_code == 409
+
+
+# 一括登録では重複した行だけerrorsに入り、残りは登録される
+def test_bulk_duplicate_names_are_row_errors(client, repo):
+    name = f"dup-bulk{next(_unique)}"
+    rows = [
+        {"name": name, "price": 1, "category": "dup"},
+        {"name": f"{name}-b", "price": 1, "category": "dup"},
+        {"name": name, "price": 2, "category": "dup"},
+        ]
+
+    result = client.post("/products/bulk", json=rows).json()
+
+    assert result["created"] == 2
+    assert [error["index"] for error in result["errors"]] == [2]
@@ -0,0 +1,70 @@
+import pytest
+from app import models
+from app.repositories import SqlAlchemyRepository
+
+
+def test_product_etag_304_and_invalidation(client, repo, make_product, make_user):
+    product_id = make_product(stock_quantity=5)
+    first = client.get(f"/products/{product_id}")
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+
+    assert client.get(f"/products/{product_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/products/{product_id}", headers={"If-None-Match": "*"}).status_code == 304
+
+    # 注文で在庫が変わればETagも変わる
+    client.post("/orders", json={"user_id": make_user(), "items": [
+        {"product_id": product_id, "quantity": 1}]})
+    changed = client.get(f"/products/{product_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["stock_quantity"] == 4
+    assert changed.headers["etag"] != etag
+
+
+# 存在しないリソースは"*"でも304にしない
+def test_if_none_match_star_on_missing_product(client, repo):
+    response = client.get("/products/999999", headers={"If-None-Match": "*"})
+    assert response.status_code == 404
+    assert "etag" not in response.headers
+
+
+def test_product_list_etag(client, repo, make_product, make_user):
+    etag = client.get("/products").headers["etag"]
+    assert client.get("/products", headers={"If-None-Match": etag}).status_code == 304
+
+    product_id = make_product(stock_quantity=5)
+    added = client.get("/products", headers={"If-None-Match": etag})
+    assert added.status_code == 200
+
+    client.post("/orders", json={"user_id": make_user(), "items": [
+        {"product_id": product_id, "quantity": 1}]})
+    assert client.get("/products", headers={"If-None-Match": added.headers["etag"]}).status_code == 200
+
+
+# バージョンはDBにあるので、別のワーカー(別のRepositoryとキャッシュ)の書き込みでもETagが変わる
+@pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)
+def test_etag_follows_writes_from_other_workers(client, repo, make_product, make_user):
+    product_id = make_product(stock_quantity=5)
+    first = client.get(f"/products/{product_id}")
+    etag = first.headers["etag"]
+
+    other_worker = SqlAlchemyRepository()
+    other_worker.create_order(models.OrderCreate(user_id=make_user(), items=[
+        models.OrderItem(product_id=product_id, quantity=2)]))
+
+    changed = client.get(f"/products/{product_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["stock_quantity"] == 3
+    assert changed.headers["etag"] != etag
+
+
+# 在庫を引き当てるUPDATEでバージョンも上がる
+@pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)
+def test_reserve_stock_bumps_version(client, repo, make_product, make_user):
+    product_id = make_product(stock_quantity=5)
+    assert repo.get_product_version(product_id) == 1
+
+    repo.create_order(models.OrderCreate(user_id=make_user(), items=[
+        models.OrderItem(product_id=product_id, quantity=1)]))
+
+    assert repo.get_product_version(product_id) == 2
@@ -0,0 +1,83 @@
+import itertools
+import json
+import tracemalloc
+import anyio
+import pytest
+from app import crud, models
+from app.main import app
+
+pytestmark = pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)
+
+
+# TestClientはレスポンス全体をメモリに溜めるので、ASGIアプリを直接呼んで送られたチャンクを捨てる
+async def _export(query_string: bytes):
+    sent = {"bytes": 0, "chunks": 0, "lines": 0}
+    requested = False
+
+    # 本文を1回返したら、切断を待つ側はレスポンスが終わるまで待たせておく
+    async def receive():
+        nonlocal requested
+        if requested:
+            await anyio.sleep_forever()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            sent["bytes"] += len(body)
+            sent["chunks"] += 1
+            sent["lines"] += body.count(b"\n")
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/products/export", "raw_path": b"/products/export",
+        "query_string": query_string, "root_path": "", "headers": [],
+        "client": ("testclient", 50000), "server": ("testserver", 80),
+    }
+    await app(scope, receive, send)
+    return sent
+
+
+def _export_peak(client, query_string=b"format=ndjson"):
+    tracemalloc.start()
+    try:
+        sent = client.portal.call(_export, query_string)
+        return sent, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+_batches = itertools.count()
+
+
+def _add_products(db, count):
+    batch = next(_batches)
+    products = [models.ProductCreate(name=f"export-{batch}-{n}", description="x" * 100, price=1, category="export")
+                for n in range(count)]
+    crud.bulk_create_products(db, products)
+
+
+# 行数を4倍以上にしてもエクスポート中のピークメモリはほとんど変わらない
+def test_export_peak_memory_is_bounded(client, db, repo):
+    formats = [b"format=ndjson", b"format=csv"]
+    _add_products(db, 5000)
+    for query_string in formats:
+        _export_peak(client, query_string)  # 文のキャッシュなどを温めておく
+    small = {query_string: _export_peak(client, query_string) for query_string in formats}
+
+    _add_products(db, 4 * (small[formats[0]][0]["lines"]))
+    large = {query_string: _export_peak(client, query_string) for query_string in formats}
+
+    for query_string in formats:
+        (small_sent, small_peak), (large_sent, large_peak) = small[query_string], large[query_string]
+        assert large_sent["lines"] > 4 * small_sent["lines"]
+        assert large_peak < small_peak * 1.5, query_string
+
+
+def test_export_ndjson_rows(client, db, repo):
+    _add_products(db, 10)
+    sent = client.portal.call(_export, b"")
+    assert sent["lines"] == len(list(repo.iter_products()))
+    first = json.loads(client.get("/products/export").text.splitlines()[0])
+    assert set(first) >= {"id", "name", "price", "category", "stock_quantity"}
@@ -0,0 +1,78 @@
+import importlib.util
+from pathlib import Path
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import create_engine, text
+from app import models
+from app.database import Base
+from app.fts import build_match_query
+
+pytestmark = pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)
+
+MIGRATION_PATH = Path(__file__).resolve().parents[1] / "migrations" / "versions" / "0001_products_fts.py"
+
+
+def _search(repo, q):
+    return [product["id"] for product in repo.search_products(q=q, limit=50)[1]]
+
+
+# 追加・名前の変更・削除にトリガーで追従する
+def test_index_follows_insert_rename_delete(repo, db):
+    product_id = repo.create_product(models.ProductCreate(
+        name="zephyrwidget lamp", description="desk light", price=1, category="fts"))["id"]
+    assert _search(repo, "zephyrwidget") == [product_id]
+
+    db.execute(text("UPDATE products SET name = 'quillbrook lamp' WHERE id = :id"), {"id": product_id})
+    db.commit()
+    assert _search(repo, "zephyrwidget") == []
+    assert _search(repo, "quillbrook") == [product_id]
+
+    # 在庫だけの更新ではインデックスは変わらない
+    db.execute(text("UPDATE products SET stock_quantity = 3 WHERE id = :id"), {"id": product_id})
+    db.commit()
+    assert _search(repo, "quillbrook") == [product_id]
+
+    db.execute(text("DELETE FROM products WHERE id = :id"), {"id": product_id})
+    db.commit()
+    assert _search(repo, "quillbrook") == []
+
+
+# 名前の一致は説明の一致の2倍の重みなので、idが後でも先に来る
+def test_name_hits_rank_above_description_hits(repo):
+    in_description = repo.create_product(models.ProductCreate(
+        name="plain mug", description="a mug shaped like a marmoset", price=1, category="fts"))["id"]
+    in_name = repo.create_product(models.ProductCreate(
+        name="marmoset mug", description="ceramic", price=1, category="fts"))["id"]
+
+    assert _search(repo, "marmoset") == [in_name, in_description]
+
+
+# 既存のDBに0001を当てると、それまでの商品も'rebuild'でインデックスに入る
+def test_migration_backfills_existing_products(repo, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'existing.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO products (name, description, price, category, stock_quantity) "
+            "VALUES ('kestrel kite', 'flies high', 1, 'toys', 1), ('plain kite', 'kestrel print', 1, 'toys', 1)"))
+    spec = importlib.util.spec_from_file_location("products_fts_migration", MIGRATION_PATH)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+
+    with engine.begin() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            migration.upgrade()
+        rows = connection.execute(text(
+            "SELECT rowid FROM products_fts WHERE products_fts MATCH :q ORDER BY bm25(products_fts, 2.0, 1.0)"),
+            {"q": build_match_query("kestrel")}).scalars().all()
+    assert rows == [1, 2]
+
+    # 移行後の追加はトリガーで入る
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO products (name, price, category, stock_quantity) VALUES ('kestrel glove', 1, 'toys', 1)"))
+        count = connection.execute(text(
+            "SELECT count(*) FROM products_fts WHERE products_fts MATCH :q"), {"q": build_match_query("kestrel")}).scalar()
+    assert count == 3
+    engine.dispose()
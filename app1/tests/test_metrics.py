@@ -0,0 +1,34 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from app import metrics
+from app.metrics import RequestMetrics
+
+
+# 定期的な書き出しと/metricsの集計が同時に走っても、一時ファイルを取り合って失敗しない
+def test_concurrent_flushes(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    request_metrics = RequestMetrics()
+    request_metrics.observe("GET", "/products/{product_id}", 200, 0.003, 120)
+    snapshot = request_metrics.snapshot()
+
+    def work(n):
+        if n % 2:
+            request_metrics.flush(snapshot)
+            return None
+        return request_metrics.render(snapshot)
+
+    with ThreadPoolExecutor(16) as pool:
+        rendered = [body for body in pool.map(work, range(400)) if body is not None]
+
+    assert all('route="/products/{product_id}",status="200"} 1' in body for body in rendered)
+    assert os.listdir(tmp_path) == [f"metrics_{os.getpid()}.json"]
+    with open(tmp_path / f"metrics_{os.getpid()}.json") as f:
+        assert json.load(f) == snapshot
+
+
+def test_metrics_endpoint(client):
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'http_responses_total{method="GET",route="/health",status="200"}' in response.text
@@ -0,0 +1,28 @@
+from app.analytics import sales_analytics
+
+
+def test_status_change_resets_analytics_only_on_cancel(client, repo, make_user, make_product, monkeypatch):
+    resets = []
+    monkeypatch.setattr(sales_analytics, "reset", lambda: resets.append(1))
+    user_id = make_user()
+    product_id = make_product(price=5.0, stock_quantity=10)
+    order = client.post("/orders", json={"user_id": user_id, "items": [
+        {"product_id": product_id, "quantity": 2}]}).json()
+
+    def patch(status):
+        response = client.patch(f"/orders/{order['id']}/status", json={"status": status})
+        assert response.status_code == 200
+        assert response.json()["status"] == status
+        return len(resets)
+
+    assert patch("paid") == 0
+    assert patch("cancelled") == 1
+    assert repo.get_user_summary(user_id)["order_count"] == 0
+    assert patch("cancelled") == 1
+    assert patch("pending") == 2
+    assert repo.get_user_summary(user_id)["lifetime_spend"] == 10.0
+
+
+def test_status_change_unknown_order(client, repo):
+    response = client.patch("/orders/999999/status", json={"status": "paid"})
+    assert response.status_code == 404
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from app.database import pool_stats
+
+
+def _order(user_id, *lines):
+    return {"user_id": user_id, "items": [
+        {"product_id": product_id, "quantity": quantity} for product_id, quantity in lines
+        ]}
+
+
+# 接続はリポジトリのメソッドの中だけで使う。同時リクエストがプールの上限を超えても詰まらない
+def test_concurrent_orders_release_connections(client, repo, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(stock_quantity=1000)
+    checked_out = pool_stats()["checked_out"]
+
+    with ThreadPoolExecutor(64) as pool:
+        responses = list(pool.map(lambda _: client.post("/orders", json=_order(user_id, (product_id, 1))), range(200)))
+
+    assert [r.status_code for r in responses] == [200] * 200
+    assert pool_stats()["checked_out"] == checked_out
+    assert repo.get_product(product_id)["stock_quantity"] == 800
+
+
+# 同じ商品を200人が同時に買っても在庫より多くは売らない
+def test_concurrent_buyers_do_not_oversell(client, repo, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(stock_quantity=50)
+
+    with ThreadPoolExecutor(64) as pool:
+        responses = list(pool.map(lambda _: client.post("/orders", json=_order(user_id, (product_id, 1))), range(200)))
+
+    statuses = [r.status_code for r in responses]
+    assert statuses.count(200) == 50
+    assert statuses.count(409) == 150
+    assert repo.get_product(product_id)["stock_quantity"] == 0
+    assert repo.get_user_summary(user_id)["order_count"] == 50
+
+
+# 戻り値はDBの価格で作る。クライアントが送った価格は使わない
+def test_create_order_reprices_from_db(client, repo, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(price=12.5, stock_quantity=5)
+
+    response = client.post("/orders", json=_order(user_id, (product_id, 2)))
+
+    assert response.status_code == 200
+    order = response.json()
+    assert order["total_amount"] == 25.0
+    assert order["status"] == "pending"
+    assert client.get(f"/orders/{order['id']}").json() == order
+
+    # 価格を送ってきても無視する
+    response = client.post("/orders", json={"user_id": user_id, "items": [
+        {"product_id": product_id, "quantity": 1, "price": 0.01}]})
+    assert response.json()["total_amount"] == 12.5
+
+
+# 在庫の足りない行は何も変えずに409
+def test_insufficient_stock_leaves_other_lines(client, repo, make_user, make_product):
+    user_id = make_user()
+    plenty = make_product(stock_quantity=10)
+    scarce = make_product(stock_quantity=1)
+
+    response = client.post("/orders", json=_order(user_id, (plenty, 3), (scarce, 2)))
+
+    assert response.status_code == 409
+    assert repo.get_product(plenty)["stock_quantity"] == 10
+    assert repo.get_product(scarce)["stock_quantity"] == 1
+
+
+# 一括注文も1件ずつ在庫を引き当て、DBの価格を使う。引き当てられない注文だけerrorsに入る
+def test_bulk_orders_reserve_stock(client, repo, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(price=4.0, stock_quantity=3)
+    other_id = make_product(price=1.0, stock_quantity=10)
+    orders = [
+        _order(user_id, (product_id, 2), (other_id, 1)),
+        _order(user_id, (product_id, 2), (other_id, 1)),  # 在庫不足。other_idの分も戻す
+        _order(user_id, (999999, 1)),                      # 存在しない商品
+        _order(user_id, (product_id, 1)),
+        ]
+
+    response = client.post("/orders/bulk?chunk_size=3", json=orders)
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert [e["index"] for e in result["errors"]] == [1, 2]
+    assert repo.get_product(product_id)["stock_quantity"] == 0
+    assert repo.get_product(other_id)["stock_quantity"] == 9
+    summary = repo.get_user_summary(user_id)
+    assert summary["order_count"] == 2
+    assert summary["lifetime_spend"] == 9.0 + 4.0
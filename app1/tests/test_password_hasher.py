@@ -0,0 +1,13 @@
+from app.password_hasher import password_hasher
+
+
+# ハッシュ計算の受付が上限に達したら、ユーザー登録は待たせずに503 + Retry-After
+def test_create_user_returns_503_when_hasher_is_full(client, repo, monkeypatch):
+    monkeypatch.setattr(password_hasher, "max_pending", 0)
+    rejected = password_hasher.stats()["rejected"]
+
+    response = client.post("/users", json={"email": "busy@example.com", "username": "busy", "password": "password"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert client.get("/metrics/password-hasher").json()["rejected"] == rejected + 1
@@ -0,0 +1,90 @@
+import itertools
+import pytest
+from app import models
+from app.pagination import encode_cursor
+
+_names = itertools.count(1)
+
+
+# APIではカテゴリが必須だが、列はNULLを許すので古いデータには残っている
+@pytest.fixture
+def make_uncategorized(repo):
+    def make():
+        product = models.ProductCreate.model_construct(
+                name=f"uncategorized{next(_names)}", description=None, price=1.0, category=None, stock_quantity=0)
+        return repo.create_product(product)["id"]
+    return make
+
+
+def _walk(client, **params):
+    pages = []
+    cursor = None
+    while True:
+        response = client.get("/products", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        body = response.json()
+        pages.append([p["id"] for p in body["products"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def _sort_key(product):
+    return (product["category"] is not None, product["category"] or "", product["id"])
+
+
+# NULLのカテゴリが先頭に並び、ページの境目をまたいでも抜けや重複が無い
+def test_pages_cover_null_categories(client, repo, make_product, make_uncategorized):
+    created = [make_uncategorized(), make_product(category="a"), make_uncategorized(),
+               make_product(category="b"), make_uncategorized(), make_product(category="a")]
+
+    products = {p["id"]: p for p in repo.list_products()}
+    # SQLiteのDBは他のテストと共有で商品が多いので、50ページ程度に収める
+    limit = max(2, len(products) // 50)
+    pages = _walk(client, limit=limit)
+
+    ids = [product_id for page in pages for product_id in page]
+    assert len(ids) == len(set(ids)) == len(products)
+    assert set(created) <= set(ids)
+    assert ids == [p["id"] for p in sorted(products.values(), key=_sort_key)]
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_pages_within_category(client, repo, make_product):
+    category = f"page-test{next(_names)}"
+    for _ in range(5):
+        make_product(category=category)
+    # make_productは1番を使わずに作り直すので、作った数ではなくカテゴリの商品で比べる
+    ids = sorted(p["id"] for p in repo.list_products() if p["category"] == category)
+
+    assert _walk(client, category=category, limit=2) == [ids[i:i + 2] for i in range(0, len(ids), 2)]
+
+
+# 最後の行のカテゴリがNULLのカーソルからも続きを返す
+def test_cursor_after_null_category(client, repo, make_product, make_uncategorized):
+    first, second = make_uncategorized(), make_uncategorized()
+    categorized = make_product(category="after-null")
+
+    ids = [p["id"] for p in client.get("/products", params={
+        "limit": 1000, "cursor": encode_cursor(None, first)}).json()["products"]]
+
+    assert second in ids and categorized in ids and first not in ids
+    assert ids.index(second) < ids.index(categorized)
+
+
+@pytest.mark.parametrize("params", [
+    {"limit": 0}, {"limit": 1001}, {"cursor": "not-a-cursor"},
+    {"cursor": encode_cursor(1, 2)}, {"cursor": encode_cursor("a", "b")},
+    ])
+def test_bad_page_parameters(client, repo, params):
+    assert client.get("/products", params=params).status_code == 400
+
+
+# パラメータが無ければ今まで通り全件
+def test_without_parameters_returns_all(client, repo, make_product):
+    product_id = make_product()
+
+    body = client.get("/products").json()
+
+    assert "next_cursor" not in body
+    assert product_id in [p["id"] for p in body["products"]]
@@ -0,0 +1,40 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import crud, models
+from app.main import app
+from app.query_counter import QueryCountMiddleware, count_queries
+
+pytestmark = pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)
+
+
+# 明細50行の注文を読み、明細と商品まで辿ったときのSQLの数
+def _render_order(db, order_id, load):
+    db.expire_all()
+    with count_queries() as counter:
+        order = crud.get_order(db, order_id, load=load)
+        [(item.quantity, item.product.name) for item in order.order_items]
+    return counter.count
+
+
+@pytest.fixture
+def order_id(db, make_user, make_product):
+    product_ids = [make_product(stock_quantity=1) for _ in range(50)]
+    order = models.OrderCreate(user_id=make_user(), items=[
+        models.OrderItem(product_id=product_id, quantity=1) for product_id in product_ids])
+    return crud.place_order(db, order)["id"]
+
+
+def test_get_order_selectin_is_constant(db, order_id):
+    assert _render_order(db, order_id, None) > 50
+    assert _render_order(db, order_id, "selectin") <= 3
+
+
+def test_get_order_joined_is_one_query(db, order_id):
+    assert _render_order(db, order_id, "joined") == 1
+
+
+def test_query_count_header(client, order_id):
+    assert "x-query-count" not in client.get(f"/orders/{order_id}").headers
+    counted = TestClient(QueryCountMiddleware(app)).get(f"/orders/{order_id}")
+    assert counted.status_code == 200
+    assert 1 <= int(counted.headers["x-query-count"]) <= 3
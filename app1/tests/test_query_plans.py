@@ -0,0 +1,96 @@
+import re
+import pytest
+from sqlalchemy import event
+from app import crud, models
+from app.database import Base, engine
+from app.pagination import encode_cursor
+
+pytestmark = pytest.mark.skipif(engine.dialect.name != "sqlite", reason="EXPLAIN QUERY PLANはSQLiteの構文")
+
+
+# fnが実行したSELECTをEXPLAIN QUERY PLANにかけ、(SQL, 計画の各行)のリストを返す
+def _query_plans(fn):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    assert statements
+    with engine.connect() as connection:
+        return [
+            (statement, [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)])
+            for statement, parameters in statements
+            ]
+
+
+# "SCAN products"のようにインデックスを使わないテーブルの全件走査
+# サブクエリ(anon_1など)の走査やFTS5の仮想テーブルは対象外
+def _table_scans(plans):
+    scans = []
+    for statement, details in plans:
+        for detail in details:
+            match = re.fullmatch(r"SCAN (\w+)( AS \w+)?", detail)
+            if match and match.group(1) in Base.metadata.tables:
+                scans.append((statement, detail))
+    return scans
+
+
+@pytest.fixture
+def orders(db, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(price=3.0, stock_quantity=100, category="plans")
+    order = models.OrderCreate(user_id=user_id, items=[models.OrderItem(product_id=product_id, quantity=1)])
+    order_ids = [crud.place_order(db, order)["id"] for _ in range(5)]
+    return user_id, order_ids
+
+
+@pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)
+def test_user_orders_page_uses_index_order(db, orders):
+    user_id, order_ids = orders
+
+    def run():
+        page, cursor = crud.get_user_orders_page(db, user_id, limit=2)
+        crud.get_user_orders_page(db, user_id, limit=2, cursor=cursor)
+        crud.get_user_orders_page(db, user_id, status="pending", limit=2)
+    plans = _query_plans(run)
+
+    assert _table_scans(plans) == []
+    assert not [detail for _, details in plans for detail in details if "TEMP B-TREE" in detail]
+
+
+@pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)
+def test_crud_reads_do_not_scan_tables(db, orders):
+    user_id, order_ids = orders
+
+    def run():
+        crud.get_order(db, order_ids[0], load="selectin")
+        crud.get_order(db, order_ids[0], load="joined")
+        crud.search_products(db, price_range=(1, 5))
+        crud.search_products(db, category="plans", price_range=(1, None))
+        crud.get_products_page(db, limit=2, category="plans")
+        crud.get_user_summary(db, user_id)
+        for _ in crud.iter_sales_lines(db, after_order_id=order_ids[-2]):
+            pass
+    plans = _query_plans(run)
+
+    assert _table_scans(plans) == []
+
+
+# カテゴリ無しのページは(category, id)のインデックス順に読む。NULLS FIRSTでも並べ替えない
+@pytest.mark.parametrize("repo", ["sqlalchemy"], indirect=True)
+def test_products_page_uses_index_order(db, make_product):
+    make_product(category="plans")
+
+    def run():
+        page, cursor = crud.get_products_page(db, limit=1)
+        crud.get_products_page(db, limit=1, cursor=cursor)
+        crud.get_products_page(db, limit=1, cursor=encode_cursor(None, 0))
+    plans = _query_plans(run)
+
+    assert not [detail for _, details in plans for detail in details if "TEMP B-TREE" in detail]
@@ -0,0 +1,92 @@
+from app.search import ProductSearchIndex
+
+
+def _product(product_id, price, category="a", name="", description=""):
+    return {"id": product_id, "price": price, "category": category, "name": name, "description": description}
+
+
+def _index(*products):
+    index = ProductSearchIndex()
+    for product in products:
+        index.add(product)
+    return index
+
+
+# 価格の範囲は両端を含む
+def test_price_range_bounds_are_inclusive():
+    index = _index(_product(1, 10), _product(2, 20), _product(3, 20), _product(4, 30))
+
+    assert index.search(min_price=20, max_price=20) == (2, [2, 3])
+    assert index.search(min_price=10, max_price=30) == (4, [1, 2, 3, 4])
+    assert index.search(min_price=20.5) == (1, [4])
+    assert index.search(max_price=10) == (1, [1])
+    assert index.search(min_price=31) == (0, [])
+
+
+# 入れ直すと古いカテゴリ・価格・トークンは残らない
+def test_readd_replaces_category_price_and_terms():
+    index = _index(_product(1, 10, "a", name="red lamp"), _product(2, 15, "a"))
+
+    index.add(_product(1, 50, "b", name="blue lamp"))
+
+    assert index.search(category="a") == (1, [2])
+    assert index.search(category="b") == (1, [1])
+    assert index.search(min_price=0, max_price=20) == (1, [2])
+    assert index.search(q="red") == (0, [])
+    assert index.search(q="blue") == (1, [1])
+    assert len(index) == 2
+
+
+def test_remove_cleans_every_structure():
+    index = _index(_product(1, 10, "a", name="lamp"), _product(2, 10, "b", name="lamp"))
+
+    index.remove(1)
+    index.remove(1)  # 無いIDは何もしない
+
+    assert index.search(q="lamp") == (1, [2])
+    assert index.search(category="a") == (0, [])
+    assert index.search(min_price=10, max_price=10) == (1, [2])
+    assert "a" not in index._categories
+    assert len(index._prices) == len(index) == 1
+
+
+# 名前の一致は説明の2倍。複数の語はスコアを足し、同点はID順
+def test_ranking_by_score_then_id():
+    index = _index(
+        _product(1, 1, description="lamp"),
+        _product(2, 1, name="lamp"),
+        _product(3, 1, name="desk lamp", description="desk"),
+        _product(4, 1, description="lamp"),
+        )
+
+    assert index.search(q="lamp") == (4, [2, 3, 1, 4])
+    assert index.search(q="desk lamp") == (1, [3])
+    assert index.search(q="lamp missing") == (0, [])
+
+
+def test_offset_and_limit_page_through_ranked_results():
+    index = _index(*(_product(i, i, name="lamp" if i % 2 else "lamp lamp") for i in range(1, 21)))
+    ranked = index.search(q="lamp", limit=20)[1]
+
+    pages = [index.search(q="lamp", limit=6, offset=offset) for offset in (0, 6, 12, 18)]
+
+    assert all(total == 20 for total, _ in pages)
+    assert [product_id for _, ids in pages for product_id in ids] == ranked
+    assert ranked[:10] == list(range(2, 21, 2))
+
+
+# 一括登録は1件ずつのaddと同じ状態になる(入れ直しも含む)
+def test_add_many_matches_add():
+    products = [_product(i, (i * 37) % 11, f"c{i % 3}", name=f"lamp n{i % 4}") for i in range(1, 40)]
+    updated = [_product(5, 99, "c9", name="desk")]
+    one_by_one = _index(*products, *updated)
+    bulk = ProductSearchIndex()
+
+    bulk.add_many(products)
+    bulk.add_many(updated)
+
+    for query in ({"q": "lamp"}, {"q": "desk"}, {"category": "c1"}, {"category": "c9"},
+                  {"min_price": 3, "max_price": 7}, {"q": "n2", "min_price": 5}):
+        assert bulk.search(limit=50, **query) == one_by_one.search(limit=50, **query)
+    assert bulk._prices == one_by_one._prices
+    assert bulk._categories == one_by_one._categories
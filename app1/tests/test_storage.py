@@ -0,0 +1,53 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.storage import InMemoryStore, SnowflakeIdAllocator
+
+
+# スレッドの切り替えを頻繁にして競合を起こしやすくする
+@pytest.fixture
+def contended():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+# 1,000件を並列にPOSTしても、IDが重なって上書きされる書き込みが無い
+def test_parallel_posts_do_not_lose_writes(client, repo, contended):
+    names = [f"parallel-{repo.__class__.__name__}-{n}" for n in range(1000)]
+
+    def post(name):
+        return client.post("/products", json={"name": name, "price": 1, "category": "parallel"})
+
+    with ThreadPoolExecutor(100) as pool:
+        responses = list(pool.map(post, names))
+
+    assert [r.status_code for r in responses] == [200] * 1000
+    ids = [r.json()["id"] for r in responses]
+    assert len(set(ids)) == 1000
+    assert [repo.get_product(product_id)["name"] for product_id in ids] == names
+
+
+def test_store_insert_is_atomic(contended):
+    store = InMemoryStore()
+    with ThreadPoolExecutor(16) as pool:
+        records = list(pool.map(lambda n: store.insert({"n": n}), range(10000)))
+
+    assert len(store) == 10000
+    assert len({record["id"] for record in records}) == 10000
+    assert all(store[record["id"]]["n"] == record["n"] for record in records)
+
+
+def test_snowflake_ids_are_unique_and_increasing(contended):
+    allocator = SnowflakeIdAllocator(worker_id=7)
+
+    def allocate(_):
+        return [allocator.next_id() for _ in range(2000)]
+
+    with ThreadPoolExecutor(8) as pool:
+        batches = list(pool.map(allocate, range(8)))
+
+    assert len({i for batch in batches for i in batch}) == 16000
+    assert all(batch == sorted(batch) for batch in batches)
+    assert all((i >> SnowflakeIdAllocator.SEQUENCE_BITS) & 1023 == 7 for batch in batches for i in batch)
@@ -0,0 +1,73 @@
+def _place(client, user_id, product_id, quantity=1):
+    response = client.post("/orders", json={"user_id": user_id, "items": [
+        {"product_id": product_id, "quantity": quantity}]})
+    assert response.status_code == 200
+    return response.json()
+
+
+def _pages(client, user_id, **params):
+    pages = []
+    cursor = None
+    while True:
+        response = client.get(f"/users/{user_id}/orders", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        pages.append([order["id"] for order in page["orders"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+# 7件をlimit=3で辿ると3+3+1件。新しい順で重複も抜けもない(created_atが同じ秒でもidで決まる)
+def test_keyset_pages_cover_all_orders_newest_first(client, repo, make_user, make_product):
+    user_id = make_user()
+    other_user = make_user()
+    product_id = make_product(stock_quantity=100)
+    order_ids = [_place(client, user_id, product_id)["id"] for _ in range(7)]
+    _place(client, other_user, product_id)
+
+    pages = _pages(client, user_id, limit=3)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [order_id for page in pages for order_id in page] == order_ids[::-1]
+
+
+def test_status_filter(client, repo, make_user, make_product):
+    user_id = make_user()
+    product_id = make_product(stock_quantity=100)
+    order_ids = [_place(client, user_id, product_id)["id"] for _ in range(5)]
+    for order_id in order_ids[1::2]:
+        client.patch(f"/orders/{order_id}/status", json={"status": "paid"})
+
+    assert _pages(client, user_id, status="paid", limit=1) == [[order_ids[3]], [order_ids[1]]]
+    assert sum(_pages(client, user_id, status="pending", limit=2), []) == order_ids[4::-2]
+
+
+def test_invalid_cursor_and_limit_are_400(client, repo, make_user):
+    user_id = make_user()
+    assert client.get(f"/users/{user_id}/orders", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get(f"/users/{user_id}/orders", params={"limit": 0}).status_code == 400
+    assert client.get("/users/999999/orders").status_code == 404
+
+
+# 集計は注文ごとに足し、キャンセルで引き、取り消しで戻す
+def test_summary_across_orders_and_cancellation(client, repo, make_user, make_product):
+    user_id = make_user()
+    assert client.get(f"/users/{user_id}/summary").json()["order_count"] == 0
+    cheap = make_product(price=2.5, stock_quantity=100)
+    dear = make_product(price=40.0, stock_quantity=100)
+    _place(client, user_id, cheap, quantity=4)
+    cancelled = _place(client, user_id, dear)
+    _place(client, user_id, dear, quantity=2)
+
+    summary = client.get(f"/users/{user_id}/summary").json()
+    assert (summary["order_count"], summary["lifetime_spend"]) == (3, 130.0)
+    assert summary["last_order_at"] is not None
+
+    client.patch(f"/orders/{cancelled['id']}/status", json={"status": "cancelled"})
+    summary = client.get(f"/users/{user_id}/summary").json()
+    assert (summary["order_count"], summary["lifetime_spend"]) == (2, 90.0)
+
+    client.patch(f"/orders/{cancelled['id']}/status", json={"status": "pending"})
+    summary = client.get(f"/users/{user_id}/summary").json()
+    assert (summary["order_count"], summary["lifetime_spend"]) == (3, 130.0)
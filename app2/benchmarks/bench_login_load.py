@@ -0,0 +1,81 @@
+import argparse
+import statistics
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+import anyio
+import httpx
+
+# app2のディレクトリから python benchmarks/bench_login_load.py で実行する
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import main
+from main import app, create_access_token, password_hasher
+
+# ログイン(bcrypt)を同時に流している間の/protectedのレイテンシを測る
+# - idle: ログイン無し
+# - process pool: 今の実装。bcryptはプロセスプールで実行し、上限を超えたログインは503
+# - inline: 変更前と同じく、bcryptをイベントループの上で実行する
+
+
+async def inline_authenticate(fake_db, username, password):
+    user = main.get_user(fake_db, username)
+    if not user or not main.verify_password(password, user.hashed_password):
+        return False
+    return user
+
+
+async def run(client, token, logins: int, probes: int):
+    latencies = []
+    statuses = {}
+    done = anyio.Event()
+
+    async def login_loop():
+        while not done.is_set():
+            response = await client.post("/token", data={"username": "testuser", "password": "secret"})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async with anyio.create_task_group() as tg:
+        for _ in range(logins):
+            tg.start_soon(login_loop)
+        await anyio.sleep(0.2 if logins else 0)
+        # 10msごとに1回送る予定で、予定時刻から応答までを測る
+        # (イベントループが止まっていると送信そのものが遅れるので、その待ちも含める)
+        origin = time.perf_counter()
+        for i in range(probes):
+            scheduled = origin + i * 0.01
+            await anyio.sleep(max(0, scheduled - time.perf_counter()))
+            response = await client.get("/protected", headers={"Authorization": f"Bearer {token}"})
+            latencies.append(time.perf_counter() - scheduled)
+            response.raise_for_status()
+        done.set()
+    return latencies, statuses
+
+
+def report(name, latencies, statuses):
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    logins = " ".join(f"{code}:{count}" for code, count in sorted(statuses.items())) or "-"
+    print(f"{name:<16}protected p50_ms={cuts[49] * 1000:.2f} p99_ms={cuts[98] * 1000:.2f} "
+          f"max_ms={max(latencies) * 1000:.2f}  logins {logins}")
+
+
+async def main_(args):
+    token = create_access_token({"sub": "testuser"}, timedelta(minutes=30))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # プロセスプールの起動は計測に含めない
+        await password_hasher.verify("secret", main.fake_users_db["testuser"]["hashed_password"])
+        print(f"concurrent_logins={args.logins} probes={args.probes} "
+              f"workers={password_hasher.workers} max_pending={password_hasher.max_pending}")
+        report("idle", *await run(client, token, 0, args.probes))
+        report("process pool", *await run(client, token, args.logins, args.probes))
+        main.authenticate_user = inline_authenticate
+        report("inline", *await run(client, token, args.logins, args.probes))
+    password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=8)
+    parser.add_argument("--probes", type=int, default=30)
+    anyio.run(main_, parser.parse_args())
@@ -0,0 +1,50 @@
+import argparse
+import statistics
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+import anyio
+import httpx
+
+# app2のディレクトリから python benchmarks/bench_token_cache.py で実行する
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from main import app, create_access_token, get_current_user, token_cache
+
+# 同じトークンで/protectedを繰り返し呼び、トークンキャッシュの有無で比べる
+# get_current_user単体(jwt.decode + UserInDB)と、ASGI経由のリクエスト全体の両方を測る
+
+
+async def measure(fn, count: int):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await fn()
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1_000_000, statistics.quantiles(latencies, n=100)[98] * 1_000_000
+
+
+async def main(args):
+    token = create_access_token({"sub": "testuser"}, timedelta(minutes=30))
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    maxsize = token_cache.maxsize
+    print(f"requests={args.requests}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def request():
+            (await client.get("/protected", headers=headers)).raise_for_status()
+
+        for name, size in (("cache off", 0), ("cache on", maxsize)):
+            token_cache.maxsize = size
+            token_cache.clear()
+            dependency = await measure(lambda: get_current_user(token), args.requests)
+            full = await measure(request, args.requests)
+            print(f"{name:<10}get_current_user p50_us={dependency[0]:.1f} p99_us={dependency[1]:.1f}  "
+                  f"/protected p50_us={full[0]:.1f} p99_us={full[1]:.1f}")
+    token_cache.maxsize = maxsize
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    anyio.run(main, parser.parse_args())
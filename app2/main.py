@@ -8,6 +8,8 @@ from pydantic import BaseModel, EmailStr
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext
 from static_files import setup_static_files
+from password_hasher import password_hasher, PasswordHasherBusy
+from token_cache import token_cache
 
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
@@ -63,6 +65,10 @@ app.add_middleware(
 # 静的ファイルの設定
 setup_static_files(app)
 
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -74,11 +80,12 @@ def get_user(db, username: str):
         user_dict = db[username]
         return UserInDB(**user_dict)
 
-def authenticate_user(fake_db, username: str, password: str):
+# bcryptの照合はプロセスプールで行い、イベントループを止めない
+async def authenticate_user(fake_db, username: str, password: str):
     user = get_user(fake_db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await password_hasher.verify(password, user.hashed_password):
         return False
     return user
 
@@ -92,7 +99,16 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# ユーザを無効化したときは、そのユーザのキャッシュ済みトークンも捨てる
+def disable_user(username: str):
+    if username in fake_users_db:
+        fake_users_db[username]["disabled"] = True
+    token_cache.invalidate_user(username)
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -109,6 +125,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     user = get_user(fake_users_db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    token_cache.set(token, user, user.username, payload.get("exp"))
     return user
 
 async def get_current_active_user(current_user: Annotated[User, Depends(get_current_user)]):
@@ -120,7 +137,14 @@ async def get_current_active_user(current_user: Annotated[User, Depends(get_curr
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ) -> Token:
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(fake_users_db, form_data.username, form_data.password)
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress",
+            headers={"Retry-After": "1"},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -141,4 +165,12 @@ async def read_users_me(current_user: Annotated[User, Depends(get_current_active
 async def protected_route(
     current_user: Annotated[User, Depends(get_current_active_user)]
 ):
-    return {"message": f"Hello {current_user.username}, this is a protected route!"}
\ No newline at end of file
+    return {"message": f"Hello {current_user.username}, this is a protected route!"}
+
+@app.get("/metrics/password-hasher")
+async def password_hasher_metrics():
+    return password_hasher.stats()
+
+@app.get("/metrics/token-cache")
+async def token_cache_metrics():
+    return token_cache.stats()
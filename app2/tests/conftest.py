@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# app2のモジュールはディレクトリ直下にあり、フラットにimportする(from token_cache import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
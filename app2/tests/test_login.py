@@ -0,0 +1,70 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import anyio
+import pytest
+from fastapi.testclient import TestClient
+from main import app, password_hasher
+from password_hasher import PasswordHasher, PasswordHasherBusy
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# プロセスプールの代わりにスレッドで動かし、終わるタイミングをテストから決める
+@pytest.fixture
+def blocking_hasher():
+    hasher = PasswordHasher(workers=1, max_pending=3)
+    hasher._executor = ThreadPoolExecutor(3)
+    release = threading.Event()
+    yield hasher, release
+    release.set()
+    hasher.shutdown()
+
+
+async def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        await anyio.sleep(0.001)
+
+
+# 実行中+待ちがmax_pendingに達したら、それ以上は待たせずにPasswordHasherBusy
+async def test_rejects_when_max_pending_is_reached(blocking_hasher):
+    hasher, release = blocking_hasher
+    async with anyio.create_task_group() as tg:
+        for _ in range(3):
+            tg.start_soon(hasher._submit, release.wait)
+        await _wait_until(lambda: hasher.stats()["pending"] == 3)
+
+        # ワーカー1つで3件受け付けているので、2件は待ち行列にいる
+        assert hasher.stats()["queue_depth"] == 2
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.verify("secret", "hash")
+        assert hasher.stats()["rejected"] == 1
+        release.set()
+
+    assert hasher.stats()["pending"] == 0
+    assert hasher.stats()["queue_depth"] == 0
+
+
+def test_login_returns_503_with_retry_after_when_busy(monkeypatch):
+    monkeypatch.setattr(password_hasher, "max_pending", 0)
+    with TestClient(app) as client:
+        response = client.post("/token", data={"username": "testuser", "password": "secret"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+def test_login_verifies_in_the_process_pool():
+    with TestClient(app) as client:
+        ok = client.post("/token", data={"username": "testuser", "password": "secret"})
+        wrong = client.post("/token", data={"username": "testuser", "password": "wrong"})
+
+    assert ok.status_code == 200
+    assert wrong.status_code == 401
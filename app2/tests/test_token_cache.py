@@ -0,0 +1,74 @@
+import time
+from datetime import timedelta
+from fastapi.testclient import TestClient
+from main import app, create_access_token, disable_user, fake_users_db, token_cache
+from token_cache import TokenCache
+
+
+# トークンのexpを過ぎたらTTLが残っていても使わない
+def test_expiry_is_capped_at_token_exp():
+    cache = TokenCache(maxsize=10, ttl=300)
+    cache.set("short", "alice", "alice", exp=time.time() + 0.05)
+    cache.set("long", "bob", "bob", exp=time.time() + 3600)
+    assert cache.get("short") == "alice"
+
+    time.sleep(0.06)
+
+    assert cache.get("short") is None
+    assert cache.get("long") == "bob"
+    assert cache.stats()["size"] == 1
+
+
+def test_ttl_applies_before_exp():
+    cache = TokenCache(maxsize=10, ttl=0)
+    cache.set("token", "alice", "alice", exp=time.time() + 3600)
+    assert cache.get("token") is None
+
+
+# 最後に使われたのが古いものから捨てる
+def test_lru_eviction():
+    cache = TokenCache(maxsize=2, ttl=300)
+    cache.set("a", 1, "u1")
+    cache.set("b", 2, "u2")
+    cache.get("a")
+    cache.set("c", 3, "u3")
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    # 追い出されたトークンはユーザ単位の索引からも消える
+    assert "u2" not in cache._by_user
+
+
+def test_invalidate_user_drops_only_that_users_tokens():
+    cache = TokenCache(maxsize=10, ttl=300)
+    cache.set("alice-1", "alice", "alice")
+    cache.set("alice-2", "alice", "alice")
+    cache.set("bob-1", "bob", "bob")
+
+    cache.invalidate_user("alice")
+
+    assert cache.get("alice-1") is None
+    assert cache.get("alice-2") is None
+    assert cache.get("bob-1") == "bob"
+
+
+def test_size_zero_disables_the_cache():
+    cache = TokenCache(maxsize=0, ttl=300)
+    cache.set("token", "alice", "alice")
+    assert cache.get("token") is None
+    assert cache.stats()["size"] == 0
+
+
+# 無効化したユーザのトークンはキャッシュに残っていても通らない
+def test_disabled_user_is_rejected_even_when_cached(monkeypatch):
+    monkeypatch.setitem(fake_users_db, "testuser", dict(fake_users_db["testuser"]))
+    token = create_access_token({"sub": "testuser"}, timedelta(minutes=5))
+    headers = {"Authorization": f"Bearer {token}"}
+    with TestClient(app) as client:
+        assert client.get("/protected", headers=headers).status_code == 200
+        assert client.get("/protected", headers=headers).status_code == 200
+        assert client.get("/metrics/token-cache").json()["hits"] >= 1
+
+        disable_user("testuser")
+
+        assert client.get("/protected", headers=headers).status_code == 400
+    token_cache.clear()
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 検証済みトークン→ユーザのキャッシュ。TOKEN_CACHE_SIZE=0で無効になる
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+# トークンのexpより前でも、この秒数が経てば再検証する
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+
+class TokenCache:
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: int = TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # digest -> (user, expires_at, username)
+        self._entries = OrderedDict()
+        # username -> {digest, ...} ユーザ単位の無効化用
+        self._by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        # トークン文字列そのものはメモリに残さない
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str):
+        if self.maxsize <= 0:
+            return None
+        key = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user
+
+    def set(self, token: str, user, username: str, exp: float | None = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        key = self._digest(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user, expires_at, username)
+            self._by_user.setdefault(username, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: bytes):
+        _, _, username = self._entries.pop(key)
+        keys = self._by_user.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[username]
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            for key in list(self._by_user.get(username, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+token_cache = TokenCache()